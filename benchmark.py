@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright (c) 2013-2014 Oliver Breitwieser
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+"""
+    Benchmarks for all stages of dota2vgs on synthetic input.
+
+    Usage:
+        benchmark.py [-o <filename>] [-r <num>] [-s <shape>]...
+                     [--cfg-lines <num>] [--lst-keys <num>]
+                     [--compare <filename>]
+
+    Options:
+        -o --output <filename>
+            Write the results as JSON to the given file.
+        -r --repeat <num>
+            Number of runs of each benchmark (the minimum time is reported).
+            [default: 5]
+        -s --shape <shape>
+            Layout shapes to benchmark (default: all).
+        --cfg-lines <num>
+            Number of lines of the synthetic cfg file.
+            [default: 2000]
+        --lst-keys <num>
+            Number of key bindings of the synthetic lst file.
+            [default: 2000]
+        --compare <filename>
+            Print the change of the timings relative to the results in the
+            given JSON file.
+        -h --help
+            Show this help message.
+
+    Each benchmark runs in a fresh process so that its peak memory can be
+    measured (via tracemalloc if available, the maximum resident set size
+    otherwise).
+"""
+
+from __future__ import print_function
+
+import json
+import multiprocessing
+import os.path as osp
+import platform
+import sys
+import time
+
+try:
+    from docopt import docopt
+except ImportError:
+    sys.path.append(osp.join(osp.dirname(osp.abspath(__file__)),
+        "dependencies"))
+    from docopt import docopt
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+    import resource
+
+import dota2vgs
+from dota2vgs import synthetic
+
+
+def run_composer(inputs):
+    dota2vgs.Composer([StringIO(inputs["cfg"])], [StringIO(inputs["lst"])],
+            inputs["layout"], output_file=StringIO(), silent=True)
+
+
+def run_sheet(inputs):
+    dota2vgs.SheetMaker(inputs["layout"], StringIO())
+
+
+def run_overlay(inputs):
+    writer = dota2vgs.AutohotkeyWriter()
+    writer.set_layout(inputs["layout"])
+    writer.write(StringIO())
+
+
+def run_lst_parser(inputs):
+    dota2vgs.LST_Hotkey_Parser(StringIO(inputs["lst"])).get_hotkey_functions(
+            None)
+
+
+def run_bind_parser(inputs):
+    dota2vgs.BindParser(StringIO(inputs["cfg"]), silent=True)
+
+
+# benchmarks depending on the layout shape
+layout_targets = [
+        ("Composer", run_composer),
+        ("SheetMaker", run_sheet),
+        ("AutohotkeyWriter", run_overlay),
+    ]
+
+input_targets = [
+        ("LST_Parser", run_lst_parser),
+        ("BindParser", run_bind_parser),
+    ]
+
+
+def get_peak_memory_kb():
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        # reported in bytes
+        usage //= 1024
+    return usage
+
+
+def measure(args):
+    """
+        Run a single benchmark, returns the wall times of all runs and the
+        peak memory (in kB).
+    """
+    func, inputs, repeat = args
+
+    if tracemalloc is not None:
+        tracemalloc.start()
+    else:
+        rss_before = get_peak_memory_kb()
+
+    times = []
+    for i in range(repeat):
+        t_start = time.time()
+        func(inputs)
+        times.append(time.time() - t_start)
+
+    if tracemalloc is not None:
+        peak_memory = tracemalloc.get_traced_memory()[1] // 1024
+        tracemalloc.stop()
+    else:
+        peak_memory = get_peak_memory_kb() - rss_before
+
+    return times, peak_memory
+
+
+def run_benchmark(name, func, inputs, size, repeat):
+    # fresh process for each benchmark to measure its peak memory
+    pool = multiprocessing.Pool(1)
+    try:
+        times, peak_memory = pool.apply(measure, ((func, inputs, repeat),))
+    finally:
+        pool.close()
+        pool.join()
+
+    result = {
+            "name" : name,
+            "size" : size,
+            "repeat" : repeat,
+            "time_min" : min(times),
+            "time_mean" : sum(times) / len(times),
+            "peak_memory_kb" : peak_memory,
+        }
+    print("{:<40} {:>10.4f}s {:>10}kB".format(name, result["time_min"],
+        peak_memory))
+    return result
+
+
+def get_layout_size(layout):
+    ir = dota2vgs.LayoutIR(layout)
+    return {
+            "groups" : len(ir.group_indices),
+            "phrases" : len(ir) - len(ir.group_indices),
+            "depth" : max(ir.depths),
+        }
+
+
+def run_all(shapes, repeat, cfg_lines, lst_keys):
+    cfg = synthetic.make_cfg(cfg_lines)
+    lst = synthetic.make_lst(lst_keys)
+
+    results = []
+    for name, func in input_targets:
+        results.append(run_benchmark(name, func, {"cfg" : cfg, "lst" : lst},
+            {"cfg_lines" : cfg_lines, "lst_keys" : lst_keys}, repeat))
+
+    for shape in shapes:
+        layout = synthetic.make_shaped_layout(shape)
+        size = get_layout_size(layout)
+        inputs = {"cfg" : cfg, "lst" : lst, "layout" : layout}
+        for name, func in layout_targets:
+            results.append(run_benchmark("{}[{}]".format(name, shape), func,
+                inputs, size, repeat))
+
+    return results
+
+
+def compare(results, filename):
+    with open(filename, "r") as f:
+        previous = dict((r["name"], r) for r in json.load(f)["results"])
+
+    print()
+    print("Relative to {}:".format(filename))
+    for r in results:
+        if r["name"] not in previous:
+            continue
+        prev = previous[r["name"]]
+        print("{:<40} time x{:.2f}  memory x{:.2f}".format(r["name"],
+            r["time_min"] / max(prev["time_min"], 1e-9),
+            float(r["peak_memory_kb"]) / max(prev["peak_memory_kb"], 1)))
+
+
+def main():
+    args = docopt(__doc__, argv=sys.argv[1:])
+
+    shapes = args["--shape"]
+    if len(shapes) == 0:
+        shapes = sorted(synthetic.layout_shapes.keys())
+
+    results = run_all(shapes, int(args["--repeat"]),
+            int(args["--cfg-lines"]), int(args["--lst-keys"]))
+
+    if args["--output"] is not None:
+        with open(args["--output"], "w") as f:
+            json.dump({
+                "version" : ".".join(map(str, dota2vgs.version.__version__)),
+                "python" : platform.python_version(),
+                "platform" : platform.platform(),
+                "timestamp" : time.time(),
+                "memory_measurement" : "tracemalloc"
+                    if tracemalloc is not None else "maxrss",
+                "results" : results,
+                }, f, indent=2, sort_keys=True)
+
+    if args["--compare"] is not None:
+        compare(results, args["--compare"])
+
+
+if __name__ == "__main__":
+    main()
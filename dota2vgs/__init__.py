@@ -21,13 +21,68 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
-from .logcfg import log
 
-from .vgs import *
-from .cfg_parser import *
-from .lst_parser import *
-from .format import *
-from .overlay import *
+"""
+    The contents of all submodules are available directly from the package.
+    Submodules are only imported once one of their names is accessed so that
+    importing the package (e.g. for the command line interface) is cheap.
+"""
 
-from . import errors
+import sys
+import importlib
+from types import ModuleType
 
+# submodule -> names exported from it
+_exports = {
+        "vgs" : ["Composer"],
+        "cfg_parser" : ["BindParser", "AliasParser", "CfgLoader", "CfgError"],
+        "lst_parser" : ["LST_Parser", "LST_Hotkey_Parser", "LST_Error"],
+        "format" : ["SheetMaker"],
+        "overlay" : ["ConsoleWriter", "GroupWriter", "AutohotkeyWriter"],
+        "layout" : ["LayoutIR"],
+        "cache" : ["BuildCache", "ParseCache", "LayoutCache",
+            "MemoryParseCache"],
+        "batch" : ["BatchJob", "BatchResult", "load_manifest", "run_batch"],
+        "profiling" : ["Profiler", "null_profiler"],
+        "watch" : ["Rebuilder", "run_watch"],
+        "mangle" : ["SymbolTable"],
+        "analyze" : ["ScriptAnalyzer"],
+        "console" : ["Console"],
+        "optimize" : ["LayoutOptimizer"],
+        "misc" : ["load_data", "AtomicFile"],
+        "logcfg" : ["log"],
+    }
+
+_origins = dict((name, module) for module, names in _exports.items()
+        for name in names)
+
+
+class _LazyModule(ModuleType):
+    """
+        Package module importing submodules on first access.
+    """
+
+    def __getattr__(self, name):
+        if name in _origins:
+            module = importlib.import_module("." + _origins[name],
+                    self.__name__)
+            value = getattr(module, name)
+        else:
+            try:
+                value = importlib.import_module("." + name, self.__name__)
+            except ImportError:
+                raise AttributeError("module {} has no attribute {}".format(
+                    self.__name__, name))
+        setattr(self, name, value)
+        return value
+
+    def __dir__(self):
+        return sorted(set(self.__all__) | set(self.__dict__))
+
+
+_module = _LazyModule(__name__)
+_module.__dict__.update(sys.modules[__name__].__dict__)
+_module.__all__ = sorted(_origins) + ["errors"]
+# keep the original module alive, its globals are used by _LazyModule
+_module._original_module = sys.modules[__name__]
+sys.modules[__name__] = _module
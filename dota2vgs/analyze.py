@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright (c) 2013-2014 Oliver Breitwieser
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+"""
+    Report what the aliases of a composed script cost.
+"""
+
+__all__ = ["ScriptAnalyzer"]
+
+from .commands import Alias, StatefulAlias
+
+
+class ScriptAnalyzer(object):
+    """
+        Collects for every alias of `composer` (a `Composer` that did not
+        stream its aliases) how long it is compared to `Alias.max_cmd_len`,
+        into how many chunks it is split and how many bytes it takes up in
+        the script.
+
+        Group and phrase aliases are attributed to their group; for every
+        group the number of commands executed when reaching it from the
+        start hotkey is determined as well.
+    """
+
+    def __init__(self, composer):
+        self.composer = composer
+        self.composer.compose_aliases()
+
+        self.LE = composer.LE
+        self.aliases = {}
+        # alias name -> number of commands executed when calling it
+        self.executed = {}
+
+        for a in composer.iter_aliases():
+            self.aliases[a.name] = self.get_alias_info(a)
+
+        self.total_bytes = sum(len(line) for line in composer.iter_lines())
+
+        for name in self.aliases:
+            self.get_executed(name)
+
+        self.groups = self.get_group_info()
+
+    def get_alias_info(self, alias):
+        mangled = self.composer.mangle_command(alias)
+        text = mangled.get()
+
+        content = []
+        for c in mangled.content:
+            content.extend(mangled.split_command(c))
+        length = mangled.cmd_length()
+        if length <= mangled.max_cmd_len:
+            chunks = 1
+        else:
+            chunks = len(mangled.make_chunks(content,
+                chain=mangled.dispatch == "chain")) - 1
+
+        num_aliases = text.count(self.LE) + 1
+        if isinstance(alias, StatefulAlias):
+            helpers = num_aliases - 2
+        else:
+            helpers = num_aliases - 1
+
+        return {
+                "name" : alias.name,
+                "length" : length,
+                "chunks" : chunks,
+                "helpers" : helpers,
+                "bytes" : len(text) + len(self.LE),
+                "num_commands" : len(content),
+                # (unmangled) names of other aliases that might be called
+                "content" : list(alias.content),
+            }
+
+    def get_executed(self, name):
+        """
+            Number of commands executed when calling alias `name`, including
+            all aliases of the script it calls (e.g. menu frames).
+        """
+        if name in self.executed:
+            return self.executed[name]
+        # guard against aliases calling themselves
+        self.executed[name] = 0
+
+        info = self.aliases[name]
+        # every helper is called once
+        count = info["num_commands"] + info["helpers"]
+        for c in info["content"]:
+            if c in self.aliases and c != name:
+                count += self.get_executed(c)
+        self.executed[name] = count
+        return count
+
+    def get_group_info(self):
+        comp = self.composer
+        ir = comp.ir
+
+        groups = {}
+        for idx in ir.group_indices:
+            group_alias = comp.get_aname_group(ir.names[idx])
+            names = [group_alias] + [comp.get_aname_phrase(ir.names[p])
+                    for p in ir.phrases[idx]]
+            # phrases with the same name share their alias, which is
+            # attributed to the first group only
+            own = [self.aliases[n] for n in names
+                    if n in self.aliases and "group" not in self.aliases[n]]
+            for info in own:
+                info["group"] = ir.names[idx]
+
+            parent = ir.parents[idx]
+            path_commands = self.executed.get(group_alias, 0)
+            if parent >= 0:
+                path = groups[parent]["path"] + "/" + ir.names[idx]
+                path_commands += groups[parent]["path_commands"]
+            else:
+                path = ir.names[idx]
+
+            groups[idx] = {
+                    "name" : ir.names[idx],
+                    "path" : path,
+                    "depth" : ir.depths[idx],
+                    "aliases" : sum(1 + i["helpers"] for i in own),
+                    "bytes" : sum(i["bytes"] for i in own),
+                    "commands" : self.executed.get(group_alias, 0),
+                    "path_commands" : path_commands,
+                }
+
+        # children come after their parents in the IR
+        for idx in ir.group_indices:
+            groups[idx]["subtree_bytes"] = groups[idx]["bytes"]
+        for idx in reversed(ir.group_indices[1:]):
+            groups[ir.parents[idx]]["subtree_bytes"] +=\
+                    groups[idx]["subtree_bytes"]
+
+        return [groups[idx] for idx in ir.group_indices]
+
+    def get_results(self):
+        aliases = []
+        for name in sorted(self.aliases):
+            info = self.aliases[name]
+            aliases.append({
+                "name" : info["name"],
+                "group" : info.get("group", None),
+                "length" : info["length"],
+                "chunks" : info["chunks"],
+                "helpers" : info["helpers"],
+                "bytes" : info["bytes"],
+                "commands" : self.executed[name],
+                })
+
+        return {
+                "max_cmd_len" : Alias.max_cmd_len,
+                "total_bytes" : self.total_bytes,
+                "total_aliases" : sum(1 + a["helpers"] for a in aliases),
+                "total_helpers" : sum(a["helpers"] for a in aliases),
+                "aliases" : aliases,
+                "groups" : self.groups,
+            }
+
+    def report_text(self, top=20):
+        """
+            Only the `top` longest aliases and largest groups are listed (all
+            of them if `top` is None).
+        """
+        results = self.get_results()
+        lines = ["Script: {total_bytes} bytes, {total_aliases} aliases "
+                "({total_helpers} helpers), at most {max_cmd_len} characters "
+                "per alias".format(**results), ""]
+
+        aliases = sorted(results["aliases"],
+                key=lambda a: (-a["length"], a["name"]))[:top]
+        lines.append("{:<32} {:>8} {:>6} {:>6} {:>8} {:>8}".format(
+            "Alias", "Length", "Limit", "Chunks", "Bytes", "Commands"))
+        for a in aliases:
+            lines.append("{:<32} {:>8} {:>5.0f}% {:>6} {:>8} {:>8}".format(
+                a["name"], a["length"],
+                100. * a["length"] / results["max_cmd_len"],
+                a["chunks"], a["bytes"], a["commands"]))
+        lines.append("")
+
+        groups = sorted(results["groups"],
+                key=lambda g: (-g["bytes"], g["path"]))[:top]
+        lines.append("{:<40} {:>8} {:>8} {:>8} {:>8} {:>8}".format(
+            "Group", "Aliases", "Bytes", "Subtree", "Commands", "Path"))
+        for g in groups:
+            lines.append("{:<40} {:>8} {:>8} {:>8} {:>8} {:>8}".format(
+                g["path"], g["aliases"], g["bytes"], g["subtree_bytes"],
+                g["commands"], g["path_commands"]))
+        return "\n".join(lines)
+
+    def report_json(self):
+        import json
+        return json.dumps(self.get_results(), indent=2, sort_keys=True)
+
+    def report(self, format="text", top=20):
+        if format == "json":
+            return self.report_json()
+        else:
+            return self.report_text(top=top)
@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright (c) 2013-2014 Oliver Breitwieser
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""
+    Compose the VGS for many players (e.g. a whole team) at once.
+
+    The jobs are read from a YAML manifest:
+
+        jobs:
+          - name: player1
+            cfg: [player1/autoexec.cfg, player1/config.cfg]
+            lst: [player1/dotakeys_personal.lst]
+            layout: team.yaml
+            output: player1/vgs.cfg
+
+    Relative filenames are relative to the directory of the manifest. `name`
+    defaults to the output filename. Additional entries `differential`,
+    `dispatch` and `follow_exec` correspond to the command line options of the
+    vgs mode. Files executed by several jobs are only parsed once per worker.
+"""
+
+__all__ = ["BatchJob", "BatchResult", "load_manifest", "run_batch"]
+
+import os.path as osp
+import multiprocessing
+import time
+import traceback
+
+from .logcfg import log
+from .misc import load_data, load_layout, AtomicFile
+from .vgs import Composer
+from .cache import LayoutCache, ParseCache
+from .cfg_parser import CfgLoader
+
+
+class BatchJob(object):
+    """
+        A single composition in a batch.
+    """
+
+    def __init__(self, name, cfg_files, lst_files, layout_file, output_file,
+            differential=False, alias_dispatch=None, follow_exec=False):
+        self.name = name
+        self.cfg_files = cfg_files
+        self.lst_files = lst_files
+        self.layout_file = layout_file
+        self.output_file = output_file
+        self.differential = differential
+        self.alias_dispatch = alias_dispatch
+        self.follow_exec = follow_exec
+
+
+class BatchResult(object):
+    """
+        Outcome of a `BatchJob`; `error` is None on success.
+    """
+
+    def __init__(self, name, duration, error=None):
+        self.name = name
+        self.duration = duration
+        self.error = error
+
+    @property
+    def success(self):
+        return self.error is None
+
+
+def load_manifest(manifest_file):
+    """
+        Returns a list of `BatchJob`s read from the given manifest filename.
+    """
+    with open(manifest_file, "r") as f:
+        manifest = load_data(f)
+
+    basedir = osp.dirname(osp.abspath(manifest_file))
+
+    def get_path(filename):
+        return osp.join(basedir, osp.expanduser(filename))
+
+    def get_paths(filenames):
+        if not isinstance(filenames, list):
+            filenames = [filenames]
+        return [get_path(fn) for fn in filenames]
+
+    jobs = []
+    for entry in manifest["jobs"]:
+        jobs.append(BatchJob(
+            name=entry.get("name", entry["output"]),
+            cfg_files=get_paths(entry.get("cfg", [])),
+            lst_files=get_paths(entry.get("lst", [])),
+            layout_file=get_path(entry["layout"]),
+            output_file=get_path(entry["output"]),
+            differential=entry.get("differential", False),
+            alias_dispatch=entry.get("dispatch", None),
+            follow_exec=entry.get("follow_exec", False),
+            ))
+    return jobs
+
+
+# layouts, parse cache and cfg loader of the current batch, set once per
+# worker process
+_layouts = {}
+_parse_cache = None
+_cfg_loader = None
+
+
+def _init_worker(layouts, cache_dir=None):
+    global _layouts, _parse_cache, _cfg_loader
+    _layouts = layouts
+    if cache_dir is not None:
+        _parse_cache = ParseCache(cache_dir)
+    else:
+        _parse_cache = None
+    _cfg_loader = CfgLoader(parse_cache=_parse_cache, silent=True)
+
+
+def _run_job(job):
+    t_start = time.time()
+    try:
+        cfg_files = [open(fn, "r") for fn in job.cfg_files]
+        lst_files = [open(fn, "r") for fn in job.lst_files]
+        try:
+            with AtomicFile(job.output_file) as output_file:
+                Composer(
+                    cfg_files=cfg_files,
+                    lst_files=lst_files,
+                    layout_file=_layouts[job.layout_file],
+                    output_file=output_file,
+                    silent=True,
+                    differential=job.differential,
+                    alias_dispatch=job.alias_dispatch,
+                    parse_cache=_parse_cache,
+                    cfg_loader=_cfg_loader if job.follow_exec else None)
+        finally:
+            for f in cfg_files + lst_files:
+                f.close()
+    except Exception:
+        return BatchResult(job.name, time.time() - t_start,
+                error=traceback.format_exc())
+
+    return BatchResult(job.name, time.time() - t_start)
+
+
+def run_batch(jobs, processes=None, cache_dir=None):
+    """
+        Run all `jobs` distributed over `processes` worker processes (all
+        available cores by default).
+
+        If `cache_dir` is given, all workers share a `ParseCache` in it and
+        the parsed layouts are cached there as well (see `LayoutCache`).
+
+        Every layout is only read once and handed to each worker when it is
+        started.
+
+        Jobs whose layout cannot be loaded fail without being started, all
+        other jobs still run.
+
+        Returns a list of `BatchResult`s in the order of `jobs`.
+    """
+    layout_cache = None
+    if cache_dir is not None:
+        layout_cache = LayoutCache(cache_dir)
+
+    layouts = {}
+    # layout file -> traceback of the failed attempt to load it
+    layout_errors = {}
+    for fn in set(job.layout_file for job in jobs):
+        try:
+            with open(fn, "r") as f:
+                layouts[fn] = load_layout(f, cache=layout_cache)
+        except Exception:
+            layout_errors[fn] = traceback.format_exc()
+
+    results = [None] * len(jobs)
+    pending = []
+    for i, job in enumerate(jobs):
+        if job.layout_file in layout_errors:
+            results[i] = BatchResult(job.name, 0.,
+                    error=layout_errors[job.layout_file])
+        else:
+            pending.append(i)
+
+    if not pending:
+        return results
+
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = max(1, min(processes, len(pending)))
+
+    pending_jobs = [jobs[i] for i in pending]
+    if processes == 1:
+        _init_worker(layouts, cache_dir)
+        pending_results = [_run_job(job) for job in pending_jobs]
+    else:
+        pool = multiprocessing.Pool(processes, initializer=_init_worker,
+                initargs=(layouts, cache_dir))
+        try:
+            pending_results = pool.map(_run_job, pending_jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+    for i, result in zip(pending, pending_results):
+        results[i] = result
+
+    return results
+
+
+def report_results(results, wallclock):
+    """
+        Log timings and failures of a batch; returns the number of failures.
+    """
+    num_failed = 0
+    for r in results:
+        if r.success:
+            log.info("{}: composed in {:.3f}s".format(r.name, r.duration))
+        else:
+            num_failed += 1
+            log.error("{}: failed after {:.3f}s\n{}".format(r.name,
+                r.duration, r.error))
+
+    log.info("Composed {} of {} jobs in {:.3f}s (sum of job times: "
+            "{:.3f}s).".format(len(results) - num_failed, len(results),
+                wallclock, sum(r.duration for r in results)))
+    return num_failed
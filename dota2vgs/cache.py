@@ -0,0 +1,400 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright (c) 2013-2014 Oliver Breitwieser
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""
+    Caches that allow skipping work that was already done in a previous run.
+"""
+
+__all__ = ["BuildCache", "ParseCache", "LayoutCache", "MemoryParseCache"]
+
+import os
+import os.path as osp
+import hashlib
+import marshal
+
+from .logcfg import log
+from .misc import load_data
+from .version import __version__
+
+
+def get_pickle():
+    # only imported if a build cache is used
+    try:
+        import cPickle as pickle
+    except ImportError:
+        import pickle
+    return pickle
+
+
+def fingerprint(*items):
+    """
+        Returns a hex digest identifying the (repr of the) supplied items.
+    """
+    return hashlib.sha1(repr(items).encode("utf-8")).hexdigest()
+
+
+class BuildCache(object):
+    """
+        Keeps the emitted text of all groups of a previous build so that
+        groups whose fingerprint did not change need not be composed again.
+
+        Entries are keyed by the path of group names leading to the group.
+        Only entries that were used or created during the current build are
+        written back by `save`.
+    """
+
+    version = 1
+
+    def __init__(self, filename=None):
+        self.filename = filename
+        # entries from the previous build
+        self.entries = {}
+        # entries of the current build
+        self.updated = {}
+
+        if self.filename is not None and osp.isfile(self.filename):
+            self.load(self.filename)
+
+    def load(self, filename):
+        pickle = get_pickle()
+        try:
+            with open(filename, "rb") as f:
+                version, entries = pickle.load(f)
+        except Exception as e:
+            log.warn("Could not read build cache {}: {}".format(filename, e))
+            return
+
+        if version == self.version:
+            self.entries = entries
+
+    def save(self, filename=None):
+        if filename is None:
+            filename = self.filename
+        if filename is None:
+            return
+
+        pickle = get_pickle()
+        tmp_filename = filename + ".tmp"
+        with open(tmp_filename, "wb") as f:
+            pickle.dump((self.version, self.updated), f,
+                    pickle.HIGHEST_PROTOCOL)
+        if osp.exists(filename):
+            os.remove(filename)
+        os.rename(tmp_filename, filename)
+
+    def lookup(self, path, fingerprint):
+        """
+            Returns the entry for the group at `path` if its fingerprint
+            matches, None otherwise.
+
+            A matching entry (and all entries below it) is kept for the
+            current build.
+        """
+        entry = self.entries.get(path, None)
+
+        if entry is None or entry["fingerprint"] != fingerprint:
+            return None
+
+        self.keep(path)
+        return entry
+
+    def keep(self, path):
+        entry = self.entries[path]
+        self.updated[path] = entry
+        for child in entry["children"]:
+            self.keep(child)
+
+    def iter_subtree(self, path):
+        """
+            Yields (path, entry)-tuples for the group at `path` and all its
+            subgroups.
+        """
+        entry = self.updated[path]
+        yield path, entry
+        for child in entry["children"]:
+            for item in self.iter_subtree(child):
+                yield item
+
+    def store(self, path, fingerprint, texts, children, duplicates):
+        """
+            `texts` is a list of (alias name, emitted text) tuples.
+            `children` are the paths of all direct subgroups.
+        """
+        self.updated[path] = {
+                "fingerprint" : fingerprint,
+                "texts" : texts,
+                "children" : children,
+                "duplicates" : duplicates,
+            }
+
+
+class ParseCache(object):
+    """
+        On-disk cache for the results of parsing input files (cfg/lst).
+
+        Every entry is stored in its own file in `directory` and identified
+        by the kind of result and the absolute path of the input file. An
+        entry is used if size and modification time of the input are
+        unchanged, or -- if only the modification time changed -- if the
+        content hash is still the same.
+
+        Results are stored with `marshal` and therefore have to consist of
+        builtin types only.
+
+        If the entries exceed `max_size` bytes in total, the least recently
+        used ones are removed. If `directory` is None, nothing is stored.
+    """
+
+    version = 2
+
+    def __init__(self, directory, max_size=1 << 24):
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+        if self.directory is not None and not osp.isdir(self.directory):
+            os.makedirs(self.directory)
+
+    def get(self, kind, f, compute):
+        """
+            Returns the result of parsing the (opened) file `f`. On a cache
+            miss `compute()` is called to get it.
+
+            Files without a name on disk (e.g. StringIO) are not cached.
+        """
+        if self.directory is None:
+            return compute()
+        try:
+            path = osp.abspath(f.name)
+            stat = os.fstat(f.fileno())
+        except (AttributeError, ValueError, EnvironmentError):
+            return compute()
+
+        entry_file = osp.join(self.directory,
+                hashlib.sha1("{}\0{}".format(kind, path).encode("utf-8"))\
+                        .hexdigest())
+        entry = self.load_entry(entry_file)
+
+        digest = None
+        if entry is not None and entry[1] == stat.st_size:
+            if entry[2] != stat.st_mtime:
+                digest = self.get_digest(f)
+            if digest is None or digest == entry[3]:
+                self.hits += 1
+                if digest is not None:
+                    # remember the new modification time
+                    self.save_entry(entry_file, entry[:2]
+                            + (stat.st_mtime,) + entry[3:])
+                else:
+                    self.touch(entry_file)
+                return entry[4]
+
+        self.misses += 1
+        if digest is None:
+            digest = self.get_digest(f)
+        result = compute()
+
+        self.save_entry(entry_file, (self.get_version(), stat.st_size,
+            stat.st_mtime, digest, result))
+        self.evict()
+        return result
+
+    @classmethod
+    def get_version(cls):
+        # results depend on the parsers as well
+        return (cls.version,) + tuple(__version__)
+
+    def get_digest(self, f):
+        f.seek(0)
+        content = f.read()
+        f.seek(0)
+        if not isinstance(content, bytes):
+            content = content.encode("utf-8")
+        return hashlib.sha1(content).hexdigest()
+
+    def load_entry(self, entry_file):
+        if not osp.isfile(entry_file):
+            return None
+        try:
+            with open(entry_file, "rb") as f:
+                entry = marshal.load(f)
+        except (EOFError, ValueError, TypeError, EnvironmentError):
+            return None
+
+        if entry[0] != self.get_version():
+            return None
+        return entry
+
+    def save_entry(self, entry_file, entry):
+        # several processes might write the same entry
+        tmp_file = "{}.{}.tmp".format(entry_file, os.getpid())
+        try:
+            with open(tmp_file, "wb") as f:
+                marshal.dump(entry, f)
+            if osp.exists(entry_file):
+                os.remove(entry_file)
+            os.rename(tmp_file, entry_file)
+        except EnvironmentError as e:
+            log.warn("Could not write parse cache entry {}: {}".format(
+                entry_file, e))
+
+    def touch(self, entry_file):
+        try:
+            os.utime(entry_file, None)
+        except EnvironmentError:
+            pass
+
+    def evict(self):
+        """
+            Remove least recently used entries until all entries fit into
+            `max_size`.
+        """
+        if self.directory is None:
+            return
+        entries = []
+        total_size = 0
+        for fn in os.listdir(self.directory):
+            path = osp.join(self.directory, fn)
+            try:
+                stat = os.stat(path)
+            except EnvironmentError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total_size += stat.st_size
+
+        entries.sort()
+        for mtime, size, path in entries:
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except EnvironmentError:
+                continue
+            total_size -= size
+
+
+class LayoutCache(ParseCache):
+    """
+        Cache for parsed layouts that is keyed by the hash of the YAML
+        content, so that the (slow) YAML parser only runs if the layout
+        changed.
+
+        Layouts are stored with `marshal` in `directory` or, if it is None,
+        next to the layout file (as ".<filename>.cache"). In the latter case
+        layouts that are not read from a file are not cached.
+    """
+
+    version = 1
+
+    def __init__(self, directory=None, max_size=1 << 24):
+        super(LayoutCache, self).__init__(directory, max_size=max_size)
+
+    def get_entry_file(self, layout_file, digest):
+        if self.directory is not None:
+            return osp.join(self.directory, digest + ".layout")
+
+        try:
+            path = osp.abspath(layout_file.name)
+        except AttributeError:
+            return None
+        dirname, filename = osp.split(path)
+        return osp.join(dirname, ".{}.cache".format(filename))
+
+    def load(self, layout_file):
+        """
+            Returns the layout in `layout_file` (file or YAML string).
+        """
+        if hasattr(layout_file, "read"):
+            content = layout_file.read()
+        else:
+            content = layout_file
+
+        if isinstance(content, bytes):
+            digest = hashlib.sha1(content).hexdigest()
+        else:
+            digest = hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+        entry_file = self.get_entry_file(layout_file, digest)
+        if entry_file is None:
+            return load_data(content)
+
+        entry = self.load_entry(entry_file)
+        if entry is not None and entry[1] == digest:
+            self.hits += 1
+            self.touch(entry_file)
+            return entry[2]
+
+        self.misses += 1
+        layout = load_data(content)
+
+        if not isinstance(layout, dict):
+            # not a valid layout, let the writers complain about it
+            return layout
+        try:
+            marshal.dumps(layout)
+        except ValueError:
+            log.debug("Layout contains types that cannot be cached.")
+            return layout
+
+        self.save_entry(entry_file, (self.get_version(), digest, layout))
+        self.evict()
+        return layout
+
+
+class MemoryParseCache(object):
+    """
+        In-memory variant of `ParseCache` for long running processes (see
+        `dota2vgs.watch`).
+
+        Entries are used as long as size and modification time of the input
+        are unchanged and can be dropped explicitly with `invalidate`.
+    """
+
+    def __init__(self):
+        # absolute path -> {kind: ((size, mtime), result)}
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, kind, f, compute):
+        try:
+            path = osp.abspath(f.name)
+            stat = os.fstat(f.fileno())
+        except (AttributeError, ValueError, EnvironmentError):
+            return compute()
+
+        key = (stat.st_size, stat.st_mtime)
+        entries = self.entries.setdefault(path, {})
+        entry = entries.get(kind, None)
+        if entry is not None and entry[0] == key:
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        result = compute()
+        entries[kind] = (key, result)
+        return result
+
+    def invalidate(self, path):
+        self.entries.pop(osp.abspath(path), None)
@@ -26,10 +26,16 @@
 """
 
 import re
+import os.path as osp
 import logging
 
 from .logcfg import log
 
+
+class CfgError(Exception):
+    pass
+
+
 class BindParser(object):
 
     matcher = re.compile(
@@ -61,3 +67,147 @@ class AliasParser(BindParser):
     matcher = re.compile(
                     r"^alias\s+\"(?P<key>[^\"]+)\"\s\"(?P<function>[^\"]+)\"")
 
+
+
+class CfgLoader(object):
+    """
+        Reads the binds of cfg files and all files they `exec`.
+
+        Commands are applied in execution order, i.e. later binds (and
+        `unbind`/`unbindall`) take precedence. Every file is parsed only
+        once per loader, so a loader can be reused for several builds that
+        share included files.
+
+        Executed files are looked up relative to the directory of the root
+        file (the game's cfg directory), ".cfg" is appended if missing.
+    """
+
+    matchers = {
+        "bind" : BindParser.matcher,
+        "unbind" : re.compile(r"^unbind\s+\"?(?P<key>[^\"\s;]+)\"?"),
+        "unbindall" : re.compile(r"^unbindall\b"),
+        "exec" : re.compile(r"^exec\s+\"?(?P<filename>[^\"\s;]+)\"?"),
+    }
+
+    def __init__(self, parse_cache=None, silent=False):
+        """
+            `parse_cache` is an optional `ParseCache` for the commands of each
+            file.
+        """
+        self.parse_cache = parse_cache
+        self.silent = silent
+        # absolute path -> commands
+        self.commands = {}
+        self.num_parsed = 0
+
+    def load(self, roots):
+        """
+            Execute the `roots` (filenames or opened files) in order and
+            return the resulting binds.
+        """
+        binds = {}
+        for root in roots:
+            if hasattr(root, "read"):
+                path = self.get_path(root)
+                commands = self.get_commands(path, root)
+            else:
+                path = osp.abspath(root)
+                commands = self.get_commands(path)
+
+            if path is not None:
+                basedir = osp.dirname(path)
+            else:
+                basedir = osp.abspath(".")
+
+            self.execute(commands, binds, basedir, [path])
+
+        return binds
+
+    def execute(self, commands, binds, basedir, stack):
+        """
+            Apply `commands` to `binds`. `stack` contains the paths of all
+            files currently being executed.
+        """
+        for cmd in commands:
+            kind = cmd[0]
+            # keys are not case sensitive in the console
+            if kind == "bind":
+                binds[cmd[1].lower()] = cmd[2]
+
+            elif kind == "unbind":
+                binds.pop(cmd[1].lower(), None)
+
+            elif kind == "unbindall":
+                binds.clear()
+
+            elif kind == "exec":
+                filename = cmd[1]
+                if not filename.endswith(".cfg"):
+                    filename += ".cfg"
+                path = osp.abspath(osp.join(basedir, filename))
+
+                if path in stack:
+                    raise CfgError("Cyclic exec: {}".format(" -> ".join(
+                        stack[stack.index(path):] + [path])))
+
+                if path not in self.commands and not osp.isfile(path):
+                    log.warn("Could not find {} executed by {}.".format(
+                        filename, stack[-1]))
+                    continue
+
+                self.execute(self.get_commands(path), binds, basedir,
+                        stack + [path])
+
+    def get_path(self, f):
+        try:
+            return osp.abspath(f.name)
+        except AttributeError:
+            return None
+
+    def get_commands(self, path, f=None):
+        """
+            Returns the (memoized) commands of the file at `path`, read from
+            `f` if given.
+        """
+        if path is not None and path in self.commands:
+            return self.commands[path]
+
+        if f is None:
+            with open(path, "r") as f:
+                commands = self.read_commands(f)
+        else:
+            commands = self.read_commands(f)
+
+        if path is not None:
+            self.commands[path] = commands
+        return commands
+
+    def read_commands(self, f):
+        if self.parse_cache is None:
+            return self.parse(f)
+        else:
+            return self.parse_cache.get("cfg", f, lambda: self.parse(f))
+
+    def parse(self, f):
+        """
+            Returns a list of all relevant commands in the order they appear.
+        """
+        if not self.silent:
+            try:
+                log.info("Parsing: {0}".format(f.name))
+            except AttributeError:
+                pass
+        self.num_parsed += 1
+
+        f.seek(0)
+        commands = []
+        for l in f.readlines():
+            l = l.lstrip()
+            for kind in ("bind", "unbind", "unbindall", "exec"):
+                match = self.matchers[kind].search(l)
+                if match is None:
+                    continue
+                commands.append((kind,) + match.groups())
+                break
+
+        return commands
@@ -25,14 +25,54 @@ import string
 
 from .logcfg import log
 
+try:
+    intern_string = intern
+except NameError:
+    # python 3
+    from sys import intern as intern_string
+
+
+def intern_command(command):
+    """
+        Commands are repeated across many aliases (e.g. the binds restored
+        when switching groups), so only a single copy of each is kept.
+    """
+    if type(command) is str:
+        return intern_string(command)
+    else:
+        return command
+
+
+def split_commands(command, separator=";"):
+    """
+        Split `command` at every `separator` that is not within quotes.
+    """
+    parts = []
+    start = 0
+    in_quotes = False
+    for i, c in enumerate(command):
+        if c == "\"":
+            in_quotes = not in_quotes
+        elif c == separator and not in_quotes:
+            parts.append(command[start:i])
+            start = i + 1
+    parts.append(command[start:])
+    return parts
+
+
 class ScriptCommand(object):
     """
         Makes creating commands writting to file easier.
 
         Automatically inserts ';' between several commands, escapes quotation
         marks.
+
+        The summed length of all commands is updated whenever a command is
+        added so that checking the length of the full command is cheap.
     """
 
+    __slots__ = ("LE", "key", "content", "content_length")
+
     template = "{key} {function}"
 
     # separator = "; "
@@ -44,6 +84,8 @@ class ScriptCommand(object):
         self.LE = lineending
         self.key = key
         self.content = []
+        # length of all commands without separators
+        self.content_length = 0
 
     def add(self, command, escape_command=True):
         """
@@ -53,7 +95,9 @@ class ScriptCommand(object):
         """
         if escape_command:
             command = self._prepare_command(command)
+        command = intern_command(command)
         self.content.append(command)
+        self.content_length += len(command)
 
     def prepend(self, command, escape_command=True):
         """
@@ -61,7 +105,9 @@ class ScriptCommand(object):
         """
         if escape_command:
             command = self._prepare_command(command)
+        command = intern_command(command)
         self.content.insert(0, command)
+        self.content_length += len(command)
 
     def _prepare_command(self, command):
         for esc in self.to_escape:
@@ -82,24 +128,74 @@ class ScriptCommand(object):
     def cmd_length(self, content=None):
         if content is None:
             content = self.content
-        # first count the length of the content
-        length = sum((len(c) for c in content))
+            length = self.content_length
+        else:
+            # first count the length of the content
+            length = sum((len(c) for c in content))
         # and account for inserted separators later on
         length += (len(content)-1) * len(self.separator)
 
         return length
 
 
+class CachedCommand(object):
+    """
+        Stand-in for a command whose full text is already known (e.g. from a
+        previous build).
+    """
+
+    __slots__ = ("key", "text")
+
+    def __init__(self, key, text):
+        self.key = key
+        self.text = text
+
+    def get(self):
+        return self.text
+
+    @property
+    def name(self):
+        return self.key
+
+
 class Bind(ScriptCommand):
+    __slots__ = ()
+
     template = "bind \"{key}\" \"{function}\""
 
 
+class ChunkError(Exception):
+    pass
+
+
 class Alias(ScriptCommand):
+    __slots__ = ("_dispatch",)
+
     template = "alias \"{key}\" \"{function}\""
 
     max_cmd_len = 430 # just a guess
 
-    possible_suffixes = [ "_" + s for s in string.ascii_letters + string.digits]
+    # characters used to name helper aliases
+    suffix_chars = string.ascii_letters + string.digits
+
+    # How helper aliases are called if the content is too long:
+    # "chain": the alias calls the first helper, each helper the next one
+    # "tree": the alias (or intermediate helpers) call all helpers directly
+    dispatch_modes = ("chain", "tree")
+    default_dispatch = "chain"
+
+    def __init__(self, key, lineending="\r\n", dispatch=None):
+        super(Alias, self).__init__(key, lineending=lineending)
+        if dispatch is not None:
+            if dispatch not in self.dispatch_modes:
+                raise ValueError("Unknown dispatch mode: {}".format(dispatch))
+        self._dispatch = dispatch
+
+    @property
+    def dispatch(self):
+        if self._dispatch is None:
+            return self.default_dispatch
+        return self._dispatch
 
     def get(self):
         # first check if we are within limits
@@ -107,61 +203,168 @@ class Alias(ScriptCommand):
             return super(Alias, self).get()
 
         # now we need to chunk the commands to be within the limit
-        chunk_idx = self.make_chunks(self.content)
+        content = []
+        for c in self.content:
+            content.extend(self.split_command(c))
+
+        if self.dispatch == "tree":
+            chunks = self.make_tree_chunks(content)
+        else:
+            chunks = self.make_chain_chunks(content)
 
-        replacement = Alias(self.name)
-        replacement.add(self.get_rep_name(0))
+        return self.LE.join(c.get() for c in chunks)
+
+    def make_helper(self, idx, content):
+        helper = Alias(self.get_rep_name(idx), lineending=self.LE)
+        for c in content:
+            helper.add(c, escape_command=False)
+        return helper
+
+    def make_chain_chunks(self, content):
+        """
+            The alias calls the first helper, every helper calls the next one.
+        """
+        chunk_idx = self.make_chunks(content, chain=True)
+
+        replacement = Alias(self.name, lineending=self.LE)
+        replacement.add(self.get_rep_name(0), escape_command=False)
 
         chunks = [replacement]
         for i, (c_start, c_stop) in enumerate(
                 zip(chunk_idx[:-1], chunk_idx[1:])):
-            chunks.append(Alias(self.get_rep_name(i)))
-
-            for j in range(c_start, c_stop):
-                chunks[-1].add(self.content[j], escape_command=False)
+            chunks.append(self.make_helper(i, content[c_start:c_stop]))
 
             # add the nameof the following alias
             if i < len(chunk_idx)-2:
                 chunks[-1].add(self.get_rep_name(i+1), escape_command=False)
 
-        return self.LE.join(c.get() for c in chunks)
+        return chunks
+
+    def make_tree_chunks(self, content):
+        """
+            The content is distributed over helpers that are all called from
+            the alias. If there are too many helpers to call them from a single
+            alias, intermediate helpers are introduced.
+        """
+        chunks = []
+        calls = content
+
+        while True:
+            chunk_idx = self.make_chunks(calls, chain=False)
+
+            # make sure that the number of calls decreases
+            if len(chunks) > 0 and len(chunk_idx) - 1 >= len(calls):
+                raise ChunkError("Names of helpers for {} are too long to "
+                        "be called.".format(self.name))
+
+            next_calls = []
+            for c_start, c_stop in zip(chunk_idx[:-1], chunk_idx[1:]):
+                helper = self.make_helper(len(chunks), calls[c_start:c_stop])
+                chunks.append(helper)
+                next_calls.append(helper.name)
+            calls = next_calls
+
+            if self.cmd_length(calls) <= self.max_cmd_len:
+                break
 
+        replacement = Alias(self.name, lineending=self.LE)
+        for c in calls:
+            replacement.add(c, escape_command=False)
+
+        return [replacement] + chunks
+
+    @classmethod
+    def get_suffix(cls, idx):
+        """
+            Suffixes are "_a", ..., "_9", "_aa", "_ab", ...
+        """
+        num_chars = len(cls.suffix_chars)
+        suffix = ""
+        idx += 1
+        while idx > 0:
+            idx -= 1
+            suffix = cls.suffix_chars[idx % num_chars] + suffix
+            idx //= num_chars
+        return "_" + suffix
 
     def get_rep_name(self, idx):
         """
             Returns the replacement name.
         """
-        return self.name + self.possible_suffixes[idx]
+        return self.name + self.get_suffix(idx)
+
+    def split_command(self, command):
+        """
+            Split `command` into single commands if it is too long to be put
+            into a helper alias as a whole.
+        """
+        # leave room to call another helper
+        max_len = self.max_cmd_len - len(self.separator)\
+                - len(self.get_rep_name(len(self.suffix_chars) ** 3))
+
+        if len(command) <= max_len:
+            return [command]
 
+        parts = split_commands(command, self.separator)
+        if len(parts) == 1:
+            raise ChunkError("Command for {} is too long ({} > {} "
+                    "characters): {}".format(self.name, len(command), max_len,
+                        command))
 
-    def make_chunks(self, content):
+        split = []
+        for p in parts:
+            split.extend(self.split_command(p))
+        return split
+
+    def make_chunks(self, content, chain=True):
         """
             Make a list containing where the content should
-            be chunked.
+            be chunked so that each chunk fits within `max_cmd_len`.
 
             Includes the last index
+
+            If `chain` is True, room for calling the next helper alias is left
+            in all chunks but the last.
+
+            As the order of commands has to be preserved, filling each chunk
+            as much as possible yields the fewest chunks.
         """
-        # determine the length of the command needed to call the next helper
-        # alias
-        len_next = len(self.name) + len(self.separator) +\
-                max((len(suff) for suff in self.possible_suffixes))
+        len_sep = len(self.separator)
+
+        # remaining[i] is the length of all content starting at i (plus one
+        # separator)
+        remaining = [0] * (len(content) + 1)
+        for i in reversed(range(len(content))):
+            remaining[i] = remaining[i+1] + len(content[i]) + len_sep
 
         chunk_indices = [0]
         cur_idx = 0
-        chunk_size = len_next
 
-        reached_end = False
+        while cur_idx < len(content):
+            if remaining[cur_idx] - len_sep <= self.max_cmd_len:
+                # everything else fits into the last chunk
+                cur_idx = len(content)
+                chunk_indices.append(cur_idx)
+                break
 
-        while cur_idx != len(content):
-            chunk_size += len(content[cur_idx]) + len(self.separator)
+            if chain:
+                # determine the length of the command needed to call the next
+                # helper alias
+                chunk_size = len(self.get_rep_name(len(chunk_indices)))
+            else:
+                chunk_size = -len_sep
 
-            if chunk_size > self.max_cmd_len:
-                chunk_indices.append(cur_idx)
-                chunk_size = len_next
-                continue
+            start_idx = cur_idx
+            while cur_idx < len(content) and chunk_size + len_sep\
+                    + len(content[cur_idx]) <= self.max_cmd_len:
+                chunk_size += len_sep + len(content[cur_idx])
+                cur_idx += 1
 
-            cur_idx += 1
-        chunk_indices.append(len(content))
+            if cur_idx == start_idx:
+                raise ChunkError("Command for {} is too long: {}".format(
+                    self.name, content[cur_idx]))
+
+            chunk_indices.append(cur_idx)
 
         return chunk_indices
 
@@ -173,6 +376,8 @@ class StatefulAlias(Alias):
         Automatically creates two aliases for on and off.
     """
 
+    __slots__ = ()
+
     token_state_on = "+"
     token_state_off = "-"
     token_cmd_split = ";"
@@ -186,8 +391,10 @@ class StatefulAlias(Alias):
         alias_off_name = alias_on_name.replace(self.token_state_on,
                 self.token_state_off)
 
-        alias_on = Alias(alias_on_name)
-        alias_off = Alias(alias_off_name)
+        alias_on = Alias(alias_on_name, lineending=self.LE,
+                dispatch=self.dispatch)
+        alias_off = Alias(alias_off_name, lineending=self.LE,
+                dispatch=self.dispatch)
 
         for c in self.content:
             alias_on.add(c, escape_command=False)
@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright (c) 2013-2014 Oliver Breitwieser
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+"""
+    Minimal interpreter for the console commands used by generated scripts,
+    so that they can be tested without starting the game.
+"""
+
+__all__ = ["Console", "KeyPress", "ConsoleError", "report_replays"]
+
+import os.path as osp
+
+from .commands import split_commands
+
+
+class ConsoleError(Exception):
+    pass
+
+
+class KeyPress(object):
+    """
+        What happened when a key was pressed and released.
+    """
+
+    def __init__(self, key):
+        self.key = key
+        # ids of all phrases said
+        self.said = []
+        # number of commands executed (including calls of aliases)
+        self.commands = 0
+        # deepest nesting of alias calls
+        self.depth = 0
+        self.echoed = []
+        # commands that are neither builtins nor aliases (e.g. "+attack")
+        self.other = []
+
+    def get_results(self):
+        return {
+                "key" : self.key,
+                "said" : self.said,
+                "commands" : self.commands,
+                "depth" : self.depth,
+                "other" : self.other,
+            }
+
+
+class Console(object):
+    """
+        Implements `alias`, `bind`, `unbind`, `unbindall`, `exec`, `echo` and
+        `chatwheel_say`, splitting of commands at ";" and +/- aliases that
+        are run on pressing/releasing the key they are bound to.
+
+        Everything else is recorded as executed but does nothing, except
+        that the arguments of the last call of every such command are kept
+        in `settings` (e.g. "developer").
+
+        Executed files are looked up relative to `basedir`, ".cfg" is
+        appended if missing (see `CfgLoader`).
+    """
+
+    builtins = ("alias", "bind", "unbind", "unbindall", "exec", "echo",
+            "chatwheel_say")
+
+    # guard against aliases calling themselves
+    max_depth = 256
+
+    def __init__(self, basedir="."):
+        self.basedir = basedir
+        self.aliases = {}
+        self.binds = {}
+        self.settings = {}
+        # paths of all files being executed
+        self.exec_stack = []
+        self.record = KeyPress(None)
+
+    def get_state(self):
+        return dict(self.aliases), dict(self.binds), dict(self.settings)
+
+    def set_state(self, state):
+        aliases, binds, settings = state
+        self.aliases = dict(aliases)
+        self.binds = dict(binds)
+        self.settings = dict(settings)
+
+    def load(self, f):
+        """
+            Execute all lines of the opened file `f`.
+
+            Returns a `KeyPress` (with key None) recording what happened.
+        """
+        self.record = KeyPress(None)
+        self.execute_lines(f)
+        return self.record
+
+    def execute_lines(self, f):
+        for line in f:
+            self.execute(self.strip_comment(line).strip())
+
+    @staticmethod
+    def strip_comment(line):
+        """
+            Remove everything after "//" (if not within quotes).
+        """
+        if "//" not in line:
+            return line
+        in_quotes = False
+        for i, c in enumerate(line):
+            if c == "\"":
+                in_quotes = not in_quotes
+            elif c == "/" and not in_quotes and line.startswith("//", i):
+                return line[:i]
+        return line
+
+    def execute(self, text, depth=0):
+        """
+            Execute all commands in `text` (separated by ";").
+        """
+        if depth > self.max_depth:
+            raise ConsoleError("Aliases nested too deep: {}".format(text))
+
+        for cmd in split_commands(text):
+            cmd = cmd.strip()
+            if len(cmd) == 0:
+                continue
+            self.run(cmd, depth)
+
+    def run(self, cmd, depth):
+        record = self.record
+        record.commands += 1
+        record.depth = max(record.depth, depth)
+
+        name, args = self.split_name(cmd)
+
+        if name in self.builtins:
+            getattr(self, "cmd_" + name)(args)
+        elif name in self.aliases:
+            self.execute(self.aliases[name], depth + 1)
+        else:
+            record.other.append(cmd)
+            self.settings[name] = args
+
+    @staticmethod
+    def split_name(cmd):
+        """
+            Returns the first word (unquoted) and the rest of `cmd`.
+        """
+        if cmd.startswith("\""):
+            end = cmd.find("\"", 1)
+            if end < 0:
+                return cmd[1:], ""
+            return cmd[1:end], cmd[end+1:].strip()
+
+        parts = cmd.split(None, 1)
+        if len(parts) == 1:
+            return parts[0], ""
+        return parts[0], parts[1].strip()
+
+    @staticmethod
+    def unquote(text):
+        if len(text) >= 2 and text.startswith("\"") and text.endswith("\""):
+            return text[1:-1]
+        return text
+
+    def cmd_alias(self, args):
+        name, value = self.split_name(args)
+        if len(name) == 0:
+            return
+        self.aliases[name] = self.unquote(value)
+
+    def cmd_bind(self, args):
+        key, value = self.split_name(args)
+        self.binds[key.lower()] = self.unquote(value)
+
+    def cmd_unbind(self, args):
+        self.binds.pop(self.split_name(args)[0].lower(), None)
+
+    def cmd_unbindall(self, args):
+        self.binds.clear()
+
+    def cmd_exec(self, args):
+        filename = self.split_name(args)[0]
+        if not filename.endswith(".cfg"):
+            filename += ".cfg"
+        path = osp.abspath(osp.join(self.basedir, filename))
+
+        if path in self.exec_stack:
+            raise ConsoleError("Cyclic exec: {}".format(" -> ".join(
+                self.exec_stack[self.exec_stack.index(path):] + [path])))
+        if not osp.isfile(path):
+            raise ConsoleError("Could not find {}.".format(filename))
+
+        self.exec_stack.append(path)
+        try:
+            with open(path, "r") as f:
+                self.execute_lines(f)
+        finally:
+            self.exec_stack.pop()
+
+    def cmd_echo(self, args):
+        self.record.echoed.append(self.unquote(args))
+
+    def cmd_chatwheel_say(self, args):
+        self.record.said.append(int(self.split_name(args)[0]))
+
+    def press(self, key):
+        """
+            Press and release `key`. Returns a `KeyPress`.
+        """
+        self.record = KeyPress(key)
+        command = self.binds.get(key.lower(), None)
+        if command is not None:
+            self.execute(command)
+            # the release runs the "-" version of a "+" command
+            if command.startswith("+"):
+                self.execute("-" + self.split_name(command)[0][1:])
+        return self.record
+
+    def replay(self, keys):
+        """
+            Press all `keys` in order, returns a list of `KeyPress`es.
+        """
+        return [self.press(k) for k in keys]
+
+
+def report_replays(replays, format="text"):
+    """
+        `replays` is a list of (keys, list of `KeyPress`es)-tuples.
+    """
+    results = []
+    for keys, presses in replays:
+        results.append({
+            "keys" : keys,
+            "said" : [i for p in presses for i in p.said],
+            "commands" : sum(p.commands for p in presses),
+            "depth" : max([p.depth for p in presses] + [0]),
+            "presses" : [p.get_results() for p in presses],
+            })
+
+    if format == "json":
+        import json
+        return json.dumps(results, indent=2)
+
+    lines = []
+    for r in results:
+        lines.append("Sequence: {}".format(" ".join(r["keys"])))
+        lines.append("{:<12} {:>10} {:>8}  {}".format("Key", "Commands",
+            "Depth", "Said"))
+        for p in r["presses"] + [dict(r, key="Total")]:
+            lines.append("{:<12} {:>10} {:>8}  {}".format(p["key"],
+                p["commands"], p["depth"],
+                " ".join(str(i) for i in p["said"])).rstrip())
+        lines.append("")
+    return "\n".join(lines)
@@ -26,5 +26,7 @@
 
 
 from .lst_parser import LST_Error
+from .cfg_parser import CfgError
 from .vgs import ParseError
+from .commands import ChunkError
 
@@ -21,92 +21,364 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
-__all__ = ["SheetMaker"]
+__all__ = ["SheetMaker", "TextSheet", "MarkdownSheet", "CsvSheet",
+        "HtmlSheet", "sheet_formats"]
+
+import csv
+import json
 
 from .logcfg import log
-from .misc import load_data
-from .vgs import Composer
+from .misc import load_layout, BufferedWriter
+from .layout import LayoutIR
+from .profiling import null_profiler
 
 from pprint import pformat
 
-class SheetMaker(object):
+
+class SheetFormat(object):
     """
-        Makes a sheet cheat for the layout file
+        Base class of all sheet formats.
+
+        The `SheetMaker` traverses the layout only once and reports every
+        group and phrase to all formats. `keys` is the string of hotkeys
+        leading to the group/phrase (prefixes are shared, not rebuilt for
+        every line).
     """
 
-    designator_groups = Composer.designator_groups
-    designator_cmds = Composer.designator_cmds
-    recursive_elements = Composer.recursive_elements
+    extension = None
+
+    def __init__(self, output_file, lineending="\r\n", profiler=None):
+        self.LE = lineending
+        self.output = BufferedWriter(output_file, profiler=profiler)
+
+    def write_line(self, line):
+        self.output.write(line + self.LE)
+
+    def begin(self, layout):
+        pass
+
+    def group(self, keys, name, depth):
+        pass
+
+    def phrase(self, keys, hotkey, name, group_name, phrase_id):
+        pass
+
+    def end_group(self):
+        pass
+
+    def end(self):
+        self.output.flush()
+
+
+class TextSheet(SheetFormat):
+    """
+        Plain text with one line per group and phrase.
+    """
+
+    extension = ".txt"
 
-    str_connector = " -> "
     str_sep_hotkey = " "
     str_space = " "
 
-    def __init__(self, layout_file, output_file,
-            sort_alphabetically=True, lineending="\r\n"):
-        self.LE = lineending
+    def __init__(self, output_file, lineending="\r\n", profiler=None):
+        super(TextSheet, self).__init__(output_file, lineending=lineending,
+                profiler=profiler)
+        if profiler is None:
+            profiler = null_profiler
+        self.profiler = profiler
 
-        layout = load_data(layout_file)
-        self.output_file = output_file
-        self.sort_alphabetically = sort_alphabetically
+    def write_line(self, line):
+        super(TextSheet, self).write_line(line)
+        self.profiler.count("lines_written")
 
-        self.write_prelude(layout)
-        self.handle_group(layout, tuple())
+    def begin(self, layout):
+        self.write_line("Hotkey (start): {}".format(layout["hotkey"]))
+        self.write_line("Hotkey (stop):  {}".format(layout["hotkey_cancel"]))
 
-    def write_prelude(self, layout):
-        self.write_to_file("Hotkey (start): {}".format(layout["hotkey"]))
-        self.write_to_file("Hotkey (stop):  {}".format(layout["hotkey_cancel"]))
+        self.write_line("")
+        self.write_line("Hotkey      Phrase")
+        self.write_line("^^^^^^^^^^^^^^^^^^")
 
-        self.write_to_file("")
-        self.write_to_file("Hotkey      Phrase")
-        self.write_to_file("^^^^^^^^^^^^^^^^^^")
+    def group(self, keys, name, depth):
+        self.write_line(keys + self.str_space  + "-" * 28 + self.str_space
+                + self.str_sep_hotkey + name)
 
-    def handle_group(self, grp, parents):
-        # only write named groups
-        if "name" in grp:
-            fmt_group = self.format_group(grp, parents)
-            self.write_to_file(fmt_group)
+    def phrase(self, keys, hotkey, name, group_name, phrase_id):
+        self.write_line(keys + self.str_sep_hotkey + name)
+
+    def end_group(self):
+        self.write_line("")
 
-        parents = parents + (grp,)
 
-        if self.designator_cmds in grp:
-            self.handle_cmds(grp[self.designator_cmds], parents)
+class MarkdownSheet(SheetFormat):
+    """
+        A heading for every group followed by a table of its phrases.
+    """
 
-        if self.designator_groups in grp:
-            grps = grp[self.designator_groups]
-            if self.sort_alphabetically:
-                grps = sorted(grps, key=lambda x: x["hotkey"])
-            for g in grps:
-                self.handle_group(g, parents)
+    extension = ".md"
 
-        self.write_to_file("")
+    special_chars = "\\`*_|[]#<>"
 
-    def handle_cmds(self, cmds, parents):
-        if self.sort_alphabetically:
-            cmds = sorted(cmds, key=lambda x: x["hotkey"])
-        for cmd in cmds:
-            fmt_cmd = self.format_cmd(cmd, parents)
-            self.write_to_file(fmt_cmd)
+    def escape(self, text):
+        for c in self.special_chars:
+            text = text.replace(c, "\\" + c)
+        return text
+
+    def begin(self, layout):
+        self.write_line("# {}".format(self.escape(
+            layout.get("name", "Voice commands"))))
+        self.write_line("")
+        self.write_line("Start: `{}`, cancel: `{}`".format(layout["hotkey"],
+            layout["hotkey_cancel"]))
+        self.write_line("")
+        self.table_started = False
+
+    def group(self, keys, name, depth):
+        self.write_line("{} {} (`{}`)".format("#" * min(depth + 1, 6),
+            self.escape(name), keys))
+        self.write_line("")
+        self.table_started = False
+
+    def phrase(self, keys, hotkey, name, group_name, phrase_id):
+        if not self.table_started:
+            self.write_line("| Hotkeys | Phrase |")
+            self.write_line("| --- | --- |")
+            self.table_started = True
+        self.write_line("| `{}` | {} |".format(keys, self.escape(name)))
+
+    def end_group(self):
+        if self.table_started:
+            self.write_line("")
+            self.table_started = False
+
+
+class CsvSheet(SheetFormat):
+    """
+        One row per phrase.
+    """
+
+    extension = ".csv"
+
+    columns = ["hotkeys", "hotkey", "group", "phrase", "id"]
+
+    def begin(self, layout):
+        self.writer = csv.writer(self.output, lineterminator=self.LE)
+        self.writer.writerow(self.columns)
 
-    def format_group(self, grp, parents):
-        fmt_parents = self.format_parents(parents)
-        fmt_hotkey = fmt_parents + self.str_connector + grp["hotkey"]
-        fmt_group = fmt_hotkey + self.str_space  + "-" * 28 + self.str_space +\
-                self.str_sep_hotkey + grp["name"]
+    def phrase(self, keys, hotkey, name, group_name, phrase_id):
+        if group_name is None:
+            group_name = ""
+        self.writer.writerow([keys, hotkey, group_name, name, phrase_id])
 
-        return fmt_group
 
-    def format_parents(self, parents):
-        return self.str_connector.join(prnt["hotkey"] for prnt in parents)
+class HtmlSheet(SheetFormat):
+    """
+        Self-contained HTML page with a table of all phrases that can be
+        searched.
+
+        The search index maps every (lower case) word of the phrase and group
+        names as well as every hotkey to the rows containing it, so that the
+        page only has to look up the typed words.
+    """
+
+    extension = ".html"
+
+    head = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<style>
+body {{ font-family: sans-serif; }}
+table {{ border-collapse: collapse; }}
+td, th {{ padding: 2px 8px; text-align: left; }}
+tr.group td {{ font-weight: bold; padding-top: 8px; }}
+code {{ font-size: 110%; }}
+</style>
+</head>
+<body>
+<h1>{title}</h1>
+<p>Start: <code>{start}</code>, cancel: <code>{cancel}</code></p>
+<p><input id="search" type="search" placeholder="Search..."></p>
+<table>
+<tr><th>Hotkeys</th><th>Phrase</th><th>Group</th></tr>"""
+
+    # rows matching all typed words (prefixes of indexed words) are shown
+    script = """</table>
+<script>
+var index = {index};
+var rows = document.querySelectorAll("tr.phrase");
+var words = Object.keys(index);
+document.getElementById("search").oninput = function() {{
+    var query = this.value.toLowerCase().split(/\\s+/).filter(Boolean);
+    var shown = null;
+    query.forEach(function(q) {{
+        var found = {{}};
+        words.forEach(function(w) {{
+            if (w.lastIndexOf(q, 0) === 0) {{
+                index[w].forEach(function(i) {{ found[i] = true; }});
+            }}
+        }});
+        if (shown !== null) {{
+            for (var i in shown) {{ if (!found[i]) {{ delete shown[i]; }} }}
+        }} else {{
+            shown = found;
+        }}
+    }});
+    for (var i = 0; i < rows.length; i++) {{
+        rows[i].style.display = (shown === null || shown[i]) ? "" : "none";
+    }}
+}};
+</script>
+</body>
+</html>"""
+
+    def escape(self, text):
+        return text.replace("&", "&amp;").replace("<", "&lt;")\
+                .replace(">", "&gt;").replace("\"", "&quot;")
+
+    def begin(self, layout):
+        self.index = {}
+        self.num_rows = 0
+        self.write_line(self.head.format(
+            title=self.escape(layout.get("name", "Voice commands")),
+            start=self.escape(layout["hotkey"]),
+            cancel=self.escape(layout["hotkey_cancel"])))
+
+    def group(self, keys, name, depth):
+        self.write_line("<tr class=\"group\"><td><code>{}</code></td>"
+                "<td colspan=\"2\">{}</td></tr>".format(self.escape(keys),
+                    self.escape(name.replace("_", " "))))
+
+    def phrase(self, keys, hotkey, name, group_name, phrase_id):
+        if group_name is None:
+            group_name = ""
+        self.write_line("<tr class=\"phrase\"><td><code>{}</code></td>"
+                "<td>{}</td><td>{}</td></tr>".format(self.escape(keys),
+                    self.escape(name.replace("_", " ")),
+                    self.escape(group_name.replace("_", " "))))
+
+        words = set(name.lower().split("_"))
+        words.update(group_name.lower().split("_"))
+        words.add(hotkey.lower())
+        words.discard("")
+        for word in words:
+            self.index.setdefault(word, []).append(self.num_rows)
+        self.num_rows += 1
+
+    def end(self):
+        index = json.dumps(self.index, sort_keys=True, separators=(",", ":"))
+        # make sure the index cannot end the script
+        self.write_line(self.script.format(index=index.replace("</",
+            "<\\/")))
+        super(HtmlSheet, self).end()
+
+
+sheet_formats = {
+        "text" : TextSheet,
+        "markdown" : MarkdownSheet,
+        "csv" : CsvSheet,
+        "html" : HtmlSheet,
+    }
+
+
+class SheetMaker(object):
+    """
+        Makes a sheet cheat for the layout file
+
+        The layout is traversed once and written in all requested formats
+        (see `sheet_formats`) at the same time.
+    """
+
+    str_connector = " -> "
+
+    def __init__(self, layout_file, output_file,
+            sort_alphabetically=True, lineending="\r\n", profiler=None,
+            layout_cache=None, outputs=None):
+        """
+            `output_file` receives the plain text sheet (may be None).
+
+            `outputs` optionally maps further format names to the files the
+            sheet is written to in that format.
+
+            `profiler` is an optional `Profiler` recording the time spent in
+            the different stages.
+
+            `layout_cache` is an optional `LayoutCache` used to skip parsing
+            the layout file if it did not change.
+        """
+        self.LE = lineending
+        if profiler is None:
+            profiler = null_profiler
+        self.profiler = profiler
+
+        with self.profiler.stage("load_layout"):
+            layout = load_layout(layout_file, cache=layout_cache)
+        with self.profiler.stage("compile_layout"):
+            self.ir = LayoutIR(layout)
+        self.output_file = output_file
+        self.sort_alphabetically = sort_alphabetically
+
+        self.formats = []
+        if output_file is not None:
+            self.formats.append(TextSheet(output_file, lineending=self.LE,
+                profiler=self.profiler))
+        if outputs is not None:
+            for name, f in sorted(outputs.items()):
+                if name not in sheet_formats:
+                    raise ValueError("Unknown sheet format: {}".format(name))
+                self.formats.append(sheet_formats[name](f,
+                    lineending=self.LE, profiler=self.profiler))
+
+        with self.profiler.stage("format"):
+            for fmt in self.formats:
+                fmt.begin(layout)
+            self.handle_group(0, None)
+            for fmt in self.formats:
+                fmt.end()
+
+    def handle_group(self, idx, prefix):
+        """
+            Write group `idx` of the layout IR. `prefix` contains the hotkeys
+            of all parent groups (None for the root group).
+        """
+        ir = self.ir
+        hotkey = ir.hotkeys[idx]
+        if prefix is None:
+            keys = hotkey
+            prefix = ""
+        else:
+            keys = prefix + self.str_connector + hotkey
 
-    def format_cmd(self, cmd, parents):
-        fmt_parents = self.format_parents(parents)
-        fmt_cmd = fmt_parents + self.str_connector + cmd["hotkey"] +\
-                self.str_sep_hotkey + cmd["name"]
+        # only write named groups
+        if ir.names[idx] is not None:
+            fmt_keys = prefix + self.str_connector + hotkey
+            for fmt in self.formats:
+                fmt.group(fmt_keys, ir.names[idx], ir.depths[idx])
+
+        if len(ir.phrases[idx]) > 0:
+            self.handle_cmds(idx, keys)
 
-        return fmt_cmd
+        if self.sort_alphabetically:
+            grps = ir.groups_by_hotkey[idx]
+        else:
+            grps = ir.groups[idx]
+        for g in grps:
+            self.handle_group(g, keys)
 
-    def write_to_file(self, line):
-        # log.info(line)
-        self.output_file.write(line + self.LE)
+        for fmt in self.formats:
+            fmt.end_group()
 
+    def handle_cmds(self, idx, keys):
+        ir = self.ir
+        if self.sort_alphabetically:
+            cmds = ir.phrases_by_hotkey[idx]
+        else:
+            cmds = ir.phrases[idx]
+        prefix = keys + self.str_connector
+        group_name = ir.names[idx]
+        for cmd in cmds:
+            cmd_keys = prefix + ir.hotkeys[cmd]
+            for fmt in self.formats:
+                fmt.phrase(cmd_keys, ir.hotkeys[cmd], ir.names[cmd],
+                        group_name, ir.items[cmd].get("id", None))
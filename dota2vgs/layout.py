@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright (c) 2013-2014 Oliver Breitwieser
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""
+    Compiled representation of a layout shared by all writers.
+"""
+
+__all__ = ["LayoutIR"]
+
+
+class LayoutIR(object):
+    """
+        Flat, indexed representation of a layout that is built in a single
+        pass.
+
+        All groups and phrases are nodes stored in breadth-first order, i.e.
+        parents always come before their children and the root group has
+        index 0. Per-node information is kept in parallel lists.
+
+        Hotkeys are numbered in the order they are first encountered so that
+        the hotkeys of the children of each group can be stored as an integer
+        bitmask.
+    """
+
+    designator_groups = "groups"
+    designator_cmds = "phrases"
+
+    GROUP = 0
+    PHRASE = 1
+
+    def __init__(self, layout, root_name=None):
+        """
+            `root_name` is the name of the root group, which usually does not
+            have one in the layout file.
+        """
+        self.layout = layout
+
+        # original dictionaries
+        self.items = []
+        self.kinds = []
+        self.parents = []
+        self.depths = []
+        self.names = []
+        self.hotkeys = []
+        # indices of direct subgroups/phrases in layout order (empty for
+        # phrases)
+        self.groups = []
+        self.phrases = []
+
+        # hotkey <-> bit position
+        self.keys = []
+        self.key_bits = {}
+        # hotkey -> indices of all nodes using it
+        self.key_nodes = {}
+
+        # per node: bitmask of the hotkeys of all direct children
+        self.masks = []
+        # group index -> hotkeys used by several children
+        self.duplicates = {}
+
+        if root_name is None:
+            root_name = layout.get("name", None)
+
+        for k in ("hotkey", "hotkey_cancel"):
+            if k in layout:
+                self.add_key(layout[k])
+
+        self.compile(root_name)
+        self.sort_children()
+
+    def add_key(self, key):
+        if key not in self.key_bits:
+            self.key_bits[key] = 1 << len(self.keys)
+            self.keys.append(key)
+        return self.key_bits[key]
+
+    def add_node(self, item, kind, parent, name):
+        idx = len(self.items)
+        self.items.append(item)
+        self.kinds.append(kind)
+        self.parents.append(parent)
+        self.depths.append(self.depths[parent] + 1 if parent >= 0 else 0)
+        self.names.append(name)
+        self.groups.append([])
+        self.phrases.append([])
+        self.masks.append(0)
+
+        hotkey = item.get("hotkey", None)
+        self.hotkeys.append(hotkey)
+
+        if parent >= 0:
+            bit = self.add_key(hotkey)
+            self.key_nodes.setdefault(hotkey, []).append(idx)
+
+            if self.masks[parent] & bit:
+                duplicates = self.duplicates.setdefault(parent, [])
+                if hotkey not in duplicates:
+                    duplicates.append(hotkey)
+            self.masks[parent] |= bit
+
+            if kind == self.GROUP:
+                self.groups[parent].append(idx)
+            else:
+                self.phrases[parent].append(idx)
+
+        return idx
+
+    def compile(self, root_name):
+        self.add_node(self.layout, self.GROUP, -1, root_name)
+
+        # nodes are appended while iterating -> breadth-first
+        idx = 0
+        while idx < len(self.items):
+            item = self.items[idx]
+            if self.kinds[idx] == self.GROUP:
+                for phrase in item.get(self.designator_cmds, []):
+                    self.add_node(phrase, self.PHRASE, idx, phrase["name"])
+                for group in item.get(self.designator_groups, []):
+                    self.add_node(group, self.GROUP, idx, group["name"])
+            idx += 1
+
+    def sort_children(self):
+        """
+            Prepare sorted views of the children of all groups.
+        """
+        by_name = lambda i: self.names[i]
+        by_hotkey = lambda i: self.hotkeys[i]
+
+        self.groups_by_name = [sorted(g, key=by_name) for g in self.groups]
+        self.phrases_by_name = [sorted(p, key=by_name) for p in self.phrases]
+        self.groups_by_hotkey = [sorted(g, key=by_hotkey)
+                for g in self.groups]
+        self.phrases_by_hotkey = [sorted(p, key=by_hotkey)
+                for p in self.phrases]
+
+    def __len__(self):
+        return len(self.items)
+
+    @property
+    def group_indices(self):
+        """
+            All groups in breadth-first order.
+        """
+        return [i for i, k in enumerate(self.kinds) if k == self.GROUP]
+
+    @property
+    def all_hotkeys(self):
+        """
+            All hotkeys used anywhere in the layout (including the start and
+            cancel hotkey).
+        """
+        return set(self.keys)
+
+    def get_bit(self, key):
+        """
+            Bit for `key`, 0 if the key is not used in the layout.
+        """
+        return self.key_bits.get(key, 0)
+
+    def get_keys(self, mask):
+        """
+            Decode a bitmask into a list of hotkeys.
+        """
+        keys = []
+        pos = 0
+        while mask:
+            if mask & 1:
+                keys.append(self.keys[pos])
+            mask >>= 1
+            pos += 1
+        return keys
+
+    def get_children(self, idx):
+        return self.groups[idx] + self.phrases[idx]
+
+    def get_concurrent_hotkeys(self, idx):
+        """
+            Hotkeys of all children of group `idx` (may contain duplicates).
+        """
+        return [self.hotkeys[c] for c in self.get_children(idx)]
+
+    def get_path(self, idx):
+        """
+            Indices of all groups from the root down to (and including) `idx`.
+        """
+        path = []
+        while idx >= 0:
+            path.append(idx)
+            idx = self.parents[idx]
+        return path[::-1]
@@ -40,6 +40,8 @@ loglevel_in_use = "INFO"               # same for loglevels
 
 log = logging.getLogger(LOGNAME)
 log.setLevel(logging.DEBUG)
+# handlers are only installed by `setup`
+log.addHandler(logging.NullHandler())
 
 
 default_handler_stream = None
@@ -51,6 +53,7 @@ def set_loglevel(lg, lvl):
 
 
 def set_loglevel_stream(lvl="INFO"):
+    setup()
     set_loglevel(default_handler_stream, lvl)
 
 
@@ -109,14 +112,25 @@ def make_verbose():
         h.setFormatter(default_verbose_formatter)
 
 
-if "DEBUG" in os.environ:
-    formatter_in_use = default_verbose_formatter
+def setup():
+    """
+        Install the default stream handler (only done once).
+
+        Set the environment variable DEBUG for verbose output.
+    """
+    global formatter_in_use, default_handler_stream
+
+    if default_handler_stream is not None:
+        return
+
+    if "DEBUG" in os.environ:
+        formatter_in_use = default_verbose_formatter
 
-default_handler_stream = add_stream_handler(
-        loglevel="INFO")
+    default_handler_stream = add_stream_handler(
+            loglevel="INFO")
 
-if "DEBUG" in os.environ:
-    make_verbose()
+    if "DEBUG" in os.environ:
+        make_verbose()
 
-for i in range(3):
-    log.debug("-" * 80)
+    for i in range(3):
+        log.debug("-" * 80)
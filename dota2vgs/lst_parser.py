@@ -33,62 +33,155 @@ class LST_Error(Exception):
     pass
 
 
-class ParentDict(dict):
-    """
-        A dict that knows about its parent.
+class LST_Parser(object):
     """
+        Parses Valve KeyValues files in a single scan.
 
-    def __init__(self, parent, *args, **kwargs):
-        self.parent = parent
-        super(ParentDict, self).__init__(*args, **kwargs)
-
-
-class LST_Parser(object):
+        Quoted and unquoted tokens, braces anywhere on a line, "//"-comments,
+        conditionals (e.g. "[$WIN32]", ignored) and escape sequences within
+        quoted tokens are supported. Nested sections are plain dicts.
+    """
 
-    matchers = {
-        "keyval"  :
-            re.compile("^\s*\"(?P<key>[^\"]+)\"\s*\"(?P<value>[^\"]+)\"\s*$"),
-        "keyname" :
-            re.compile("^\s*\"(?P<key>[^\"]+)\"\s*$"),
-        "dict-begin" :
-            re.compile("^\s*{\s*$"),
-        "dict-end" :
-            re.compile("^\s*}\s*$"),
-    }
+    # Sections only containing key-value pairs (i.e. almost all of them) are
+    # matched as a whole and converted by `pair_matcher`. Otherwise key-value
+    # pairs and section names are matched as one token as they make up most
+    # of the file.
+    token_pattern = r"""
+        \s*(?:
+            "(QUOTED)"\s*{                      # 1: flat section name
+                ((?:\s*"QUOTED"\s*"QUOTED")*)   # 2: its content
+                \s*}
+          | "(QUOTED)"                          # 3: quoted token
+                (?:\s*"(QUOTED)"                # 4: value of the token
+                  |\s*({))?                     # 5: section begin
+          | (})                                 # 6: section end
+          | ({)                                 # 7: unnamed section begin
+          | //[^\n]*                            # comment
+          | (\[[^\]\n]*\])                      # 8: conditional
+          | ([^\s{}"]+)                         # 9: unquoted token
+          | (\S)                                # 10: error
+        )"""
+    pair_pattern = r'"(QUOTED)"\s*"(QUOTED)"'
+
+    # quoted tokens without escape sequences can be matched a lot faster
+    quoted_plain = r'[^"]*'
+    quoted_escaped = r'[^"\\]*(?:\\.[^"\\]*)*'
+
+    tokenizer = re.compile(token_pattern.replace("QUOTED", quoted_plain),
+            re.VERBOSE | re.DOTALL)
+    tokenizer_escaped = re.compile(
+            token_pattern.replace("QUOTED", quoted_escaped),
+            re.VERBOSE | re.DOTALL)
+    pair_matcher = re.compile(pair_pattern.replace("QUOTED", quoted_plain))
+    pair_matcher_escaped = re.compile(
+            pair_pattern.replace("QUOTED", quoted_escaped))
+
+    escapes = {"n": "\n", "t": "\t", "\\": "\\", "\"": "\""}
+    escape_matcher = re.compile(r"\\(.)")
 
     def __init__(self, f, silent=False):
         self.silent = silent
 
         f.seek(0)
-        self.content = {}
-
-        current = self.content
-        next_name = None
+        self.content = self.parse(f.read())
+
+    def parse(self, data):
+        content = {}
+        stack = []
+        current = content
+        # name of a key whose value has not been read yet
+        key = None
+
+        escaped = "\\" in data
+        unescape = self.unescape
+        if escaped:
+            tokenizer = self.tokenizer_escaped
+            pair_matcher = self.pair_matcher_escaped
+        else:
+            tokenizer = self.tokenizer
+            pair_matcher = self.pair_matcher
+
+        for m in tokenizer.finditer(data):
+            kind = m.lastindex
+
+            if kind == 4:
+                name, value = m.group(3, 4)
+                if escaped:
+                    name, value = unescape(name), unescape(value)
+                if key is None:
+                    current[name] = value
+                else:
+                    current[key] = name
+                    key = value
+                continue
 
-        for line in f.readlines():
-            line = line.strip()
+            elif kind == 2:
+                name, section = m.group(1, 2)
+                section = pair_matcher.findall(section)
+                if escaped:
+                    name = unescape(name)
+                    section = [(unescape(k), unescape(v)) for k, v in section]
+                if key is not None:
+                    # the name is actually the value of `key`
+                    raise LST_Error("Section without name at position "
+                            "{}.".format(m.start(2) - 1))
+                current[name] = dict(section)
+                continue
 
-            # try to find a key-value pair
-            keyval = self.matchers["keyval"].search(line)
-            if keyval is not None:
-                keyval = keyval.groupdict()
-                current[keyval["key"]] = keyval["value"]
+            elif kind == 3:
+                token = m.group(3)
+                if escaped:
+                    token = unescape(token)
+
+            elif kind == 5 or kind == 7:
+                if kind == 5:
+                    name = m.group(3)
+                    if escaped:
+                        name = unescape(name)
+                    if key is not None:
+                        current[key] = name
+                        key = None
+                    else:
+                        key = name
+                if key is None:
+                    raise LST_Error("Section without name at position "
+                            "{}.".format(m.end() - 1))
+                stack.append(current)
+                current[key] = current = {}
+                key = None
                 continue
 
-            keyname = self.matchers["keyname"].search(line)
-            if keyname is not None:
-                next_name = keyname.groupdict()["key"]
+            elif kind == 6:
+                if len(stack) == 0:
+                    raise LST_Error("Unbalanced '}}' at position {}.".format(
+                        m.start(6)))
+                current = stack.pop()
+                key = None
                 continue
 
-            begin = self.matchers["dict-begin"].search(line)
-            if begin is not None:
-                current[next_name] = ParentDict(current)
-                current = current[next_name]
+            elif kind == 9:
+                token = m.group(9)
+            elif kind == 10:
+                raise LST_Error("Unexpected {} at position {}.".format(
+                    m.group(10), m.start(10)))
+            else:
+                # comments and conditionals
                 continue
 
-            end = self.matchers["dict-end"].search(line)
-            if end is not None:
-                current = current.parent
+            if key is None:
+                key = token
+            else:
+                current[key] = token
+                key = None
+
+        if len(stack) > 0:
+            raise LST_Error("Missing '}' at end of file.")
+
+        return content
+
+    def unescape(self, token):
+        return self.escape_matcher.sub(
+                lambda m: self.escapes.get(m.group(1), m.group(0)), token)
 
     def get(self):
         return self.content
@@ -98,7 +191,8 @@ class LST_Hotkey_Parser(LST_Parser):
 
     def get_hotkey_functions(self, hotkeys):
         """
-            Return a dict containing the functions for the supplied hotkeys.
+            Return a dict containing the functions for the supplied hotkeys
+            (all hotkeys if `hotkeys` is None).
         """
 
         mappings = {}
@@ -107,7 +201,8 @@ class LST_Hotkey_Parser(LST_Parser):
 
             for k,v in read_hotkeys.items():
                 # also ignore if there is no keybinding or a modifier in place
-                if "Key" not in v or "Modifier" in v:
+                if not v.get("Key", "") or not v.get("Action", "")\
+                        or v.get("Modifier", ""):
                     continue
 
                 if not self.check_validity(k, v):
@@ -120,7 +215,7 @@ class LST_Hotkey_Parser(LST_Parser):
                 if len(key) == 1:
                     key = key.lower()
 
-                if key in hotkeys:
+                if hotkeys is None or key in hotkeys:
                     mappings[key] = function
         except KeyError:
             raise LST_Error("No hotkey information found in specified .lst file!")
@@ -23,29 +23,49 @@
 
 from __future__ import print_function
 
-import glob
 import os.path as osp
+import contextlib
 import itertools
 import sys
+import time
 
-try:
-    from docopt import docopt
-except ImportError:
-    current_dir = osp.abspath(osp.dirname(sys.argv[0]))
-    sys.path.append(osp.join(current_dir, "dependencies"))
-    from docopt import docopt
-
-
-from . import SheetMaker, Composer, AutohotkeyWriter
+# NOTE: Everything else is imported only when needed to keep the startup
+# time low.
 from .version import __version__
 
 __doc__ =\
 """
     Usage:
         {prgm}  vgs [-c <filename>]... [-l <filename>]...
-                [-y <filename>] [-o <filename>]
-        {prgm}  sheet [-y <filename>] [-o <filename>]
-        {prgm}  overlay [-y <filename>] [-o <filename>]
+                [-y <filename>] [-o <filename>] [--build-cache <filename>]
+                [--differential] [--dispatch <mode>] [--cache-dir <dir>]
+                [--mangle <filename>] [-x] [--profile <format>]
+                [--cprofile <stage>] [--cprofile-output <filename>]
+        {prgm}  sheet [-y <filename>] [-o <filename>] [--cache-dir <dir>]
+                [--sheet-formats <formats>] [--profile <format>]
+                [--cprofile <stage>] [--cprofile-output <filename>]
+        {prgm}  overlay [-y <filename>] [-o <filename>] [--cache-dir <dir>]
+                [--dispatch-table] [--profile <format>] [--cprofile <stage>]
+                [--cprofile-output <filename>]
+        {prgm}  analyze [-c <filename>]... [-l <filename>]...
+                [-y <filename>] [-o <filename>] [--differential]
+                [--dispatch <mode>] [--mangle <filename>] [-x]
+                [--format <format>] [--top <num>]
+        {prgm}  optimize [-c <filename>]... [-l <filename>]...
+                [-y <filename>] [-o <filename>] [--weights <filename>]
+                [--keys <keys>] [--reserve <keys>] [--max-group-size <num>]
+                [--format <format>] [--top <num>]
+        {prgm}  simulate [--script <filename>] [--format <format>]
+                <keys>...
+        {prgm}  batch [-j <num>] [--cache-dir <dir>] <manifest>
+        {prgm}  all [-c <filename>]... [-l <filename>]...
+                [-y <filename>] [-o <filename>] [--sheet-output <filename>]
+                [--overlay-output <filename>] [--differential]
+                [--dispatch <mode>] [-x] [-j <num>]
+        {prgm}  watch [-c <filename>]... [-l <filename>]...
+                [-y <filename>] [-o <filename>] [--sheet-output <filename>]
+                [--overlay-output <filename>] [--differential]
+                [--dispatch <mode>] [-x] [--poll] [--debounce <ms>]
 
     Modes:
         (default) :   Generate the vgs file.
@@ -53,30 +73,133 @@ __doc__ =\
         sheet :     Make a cheat sheet of all the commands present in the layout
                     file.
 
+        analyze :   Compose the vgs file without writing it and report the
+                    length of every alias compared to the maximum command
+                    length, into how many chunks it is split, the size of
+                    the script per group and how many commands are executed
+                    to reach each group.
+
+        optimize :  Rearrange the phrases of the layout into groups so that
+                    the expected number of keystrokes per phrase is minimal
+                    given how often each phrase is used (see --weights).
+                    Keys bound in the cfg/lst files are not used within
+                    groups. Reports the cost before and after and writes
+                    the new layout to the output file if one is given.
+
+        simulate :  Load a generated vgs file into a minimal console
+                    interpreter and press the given key sequences (keys
+                    separated by spaces or commas), e.g. "v,q,c". Reports
+                    the ids of all phrases said as well as the commands
+                    executed and how deeply aliases were nested for every
+                    keypress. Every sequence starts from the state after
+                    loading the file.
+
+        batch :     Generate the vgs files for all jobs listed in the manifest
+                    (see `dota2vgs.batch`) in parallel.
+
+        all :       Generate the vgs file, cheat sheet and overlay at once
+                    from a single parse of the layout.
+
+        watch :     Generate the vgs file (and optionally sheet and overlay)
+                    and regenerate them whenever their inputs change.
+
     Options:
         -c --cfg-file <filename>
             Specify .cfg files from which to read existing bindings. The
             files will be read in the order specified. Therefore it is
             important to match the order in which they are sourced.
             [default: autoexec.cfg config.cfg]
-
         -l --lst-file <filename>
             Specify .lst files from which to read existing bindings.
             Typically keybinds from the Dota 2 are saved in those The files
             will be read in the order specified. Therefore it is important
             to match the order in which they are sourced.
             [default: dotakeys_personal.lst]
-
         -y --layout-file <filename>
             Specify YAML-file containing the layout used to create the VGS.
             [default: layout.yaml]
-
         -o --output-file <filename>
             Specify output filename.
-
+        -x --follow-exec
+            Also read the binds of all files executed by the cfg files (in
+            execution order).
+        --build-cache <filename>
+            Keep the aliases of all groups in the given file and only compose
+            groups again that changed since the last run.
+        --differential
+            Only change the aliases of keys that actually differ between a
+            group and its parent group when switching groups.
+        --dispatch <mode>
+            How aliases exceeding the maximum command length call their
+            helper aliases: "chain" (each helper calls the next one) or
+            "tree" (helpers are called directly by the alias).
+            [default: chain]
+        --mangle <filename>
+            Replace all generated alias names by short symbols to keep the
+            script small. The symbols are kept in the given file so that they
+            stay the same between runs and are listed in a readable map next
+            to it (same name with ".map" appended).
+        --format <format>
+            Format of the analyze and simulate reports: "text" or "json".
+            [default: text]
+        --weights <filename>
+            YAML file mapping phrase names or ids to how often they are used
+            (phrases not listed are never used). Without it all phrases are
+            weighted the same.
+        --keys <keys>
+            Keys phrases and groups may use in optimize mode, either as a
+            string of single characters or separated by commas.
+            [default: abcdefghijklmnopqrstuvwxyz]
+        --reserve <keys>
+            Keys that are not to be used in optimize mode (besides start and
+            cancel hotkey), given like --keys.
+        --max-group-size <num>
+            Maximum number of phrases and groups within every group in
+            optimize mode (default: number of usable keys).
+        --script <filename>
+            Generated vgs file loaded in simulate mode. [default: vgs.cfg]
+        --top <num>
+            Number of longest aliases and largest groups listed in the text
+            report of analyze. [default: 20]
+        --cache-dir <dir>
+            Keep the parsed contents of cfg, lst and layout files in the
+            given directory so that unchanged files need not be parsed
+            again.
+        --sheet-formats <formats>
+            Comma-separated list of formats the cheat sheet is written in
+            at once ("text", "markdown", "csv", "html"). Only the text sheet
+            is written to the output file, the others replace its extension
+            with their own. [default: text]
+        --dispatch-table
+            Bind every hotkey of the overlay only once and look up what it
+            does in a table for the current group (same as setting
+            "dispatch_table" in the overlay section of the layout).
+        --sheet-output <filename>
+            Also write the cheat sheet to the given file in watch mode
+            (default in all mode: sheet.txt).
+        --overlay-output <filename>
+            Also write the overlay to the given file in watch mode
+            (default in all mode: vgs_overlay.ahk).
+        --poll
+            Poll the inputs for changes instead of using inotify.
+        --debounce <ms>
+            Wait until the inputs did not change for the given time before
+            rebuilding. [default: 50]
+        -j --jobs <num>
+            Number of worker processes in batch mode (default: number of
+            cores) or threads in all mode (default: one per output).
+        --profile <format>
+            Print the time spent in each stage (and how often it was run)
+            as well as counts of created objects after finishing. Format is
+            "text" or "json".
+        --cprofile <stage>
+            Run the given stage (e.g. "compose" or "alias_text") under
+            cProfile.
+        --cprofile-output <filename>
+            File to which the cProfile statistics are written.
+            [default: dota2vgs.prof]
         --usage
             Print usage only.
-
         -h --help
             Show this help message.
 
@@ -88,48 +211,335 @@ def open_files(filenames, mode="r"):
     return [open(fn, mode=mode) for fn in filenames]
 
 
+def split_keys(keys):
+    """
+        Keys are either given as a string of single characters or separated
+        by commas.
+    """
+    if "," in keys:
+        return [k.strip() for k in keys.split(",") if len(k.strip()) > 0]
+    return list(keys)
+
+
+def get_docopt():
+    try:
+        from docopt import docopt
+    except ImportError:
+        # fall back to the bundled version
+        current_dir = osp.abspath(osp.dirname(sys.argv[0]))
+        sys.path.append(osp.join(current_dir, "dependencies"))
+        from docopt import docopt
+    return docopt
+
+
 def main_loop():
+    docopt = get_docopt()
     args = docopt(__doc__, argv=sys.argv[1:], version=__version__)
 
+    from . import logcfg
+    logcfg.setup()
+
+    from .cfg_parser import CfgError
+    from .commands import ChunkError
+    try:
+        run_mode(args)
+    except CfgError as e:
+        sys.exit("Could not read the cfg files: {}".format(e))
+    except ChunkError as e:
+        sys.exit("Could not split up an alias, please use shorter names in "
+                "the layout. {}".format(e))
+
+
+def run_mode(args):
+    if args["simulate"]:
+        from .console import Console, report_replays
+
+        console = Console(basedir=osp.dirname(osp.abspath(args["--script"])))
+        with open(args["--script"], "r") as f:
+            console.load(f)
+        state = console.get_state()
+
+        replays = []
+        for sequence in args["<keys>"]:
+            keys = sequence.replace(",", " ").split()
+            console.set_state(state)
+            replays.append((keys, console.replay(keys)))
+
+        print(report_replays(replays, args["--format"]))
+        return
+
+    if args["batch"]:
+        from .batch import load_manifest, run_batch, report_results
+
+        processes = args["--jobs"]
+        if processes is not None:
+            processes = int(processes)
+        jobs = load_manifest(args["<manifest>"])
+        t_start = time.time()
+        results = run_batch(jobs, processes=processes,
+                cache_dir=args["--cache-dir"])
+        if report_results(results, time.time() - t_start) > 0:
+            sys.exit(1)
+        return
+
+    if args["watch"] or args["all"]:
+        from .watch import Rebuilder, report_build, run_watch
+
+        outputs = {"vgs" : args["--output-file"] or "vgs.cfg"}
+        if args["--sheet-output"] is not None:
+            outputs["sheet"] = args["--sheet-output"]
+        elif args["all"]:
+            outputs["sheet"] = "sheet.txt"
+        if args["--overlay-output"] is not None:
+            outputs["overlay"] = args["--overlay-output"]
+        elif args["all"]:
+            outputs["overlay"] = "vgs_overlay.ahk"
+
+        rebuilder = Rebuilder(args["--cfg-file"], args["--lst-file"],
+                args["--layout-file"], outputs,
+                follow_exec=args["--follow-exec"],
+                composer_kwargs={
+                    "differential" : args["--differential"],
+                    "alias_dispatch" : args["--dispatch"],
+                })
+
+        if args["all"]:
+            threads = len(outputs)
+            if args["--jobs"] is not None:
+                threads = int(args["--jobs"])
+            results = rebuilder.build(threads=threads)
+            report_build(results)
+            if any(error is not None for target, duration, error in results):
+                sys.exit(1)
+        else:
+            run_watch(rebuilder, polling=args["--poll"],
+                    debounce=float(args["--debounce"]) / 1000.)
+        return
+
+    profiler = None
+    if args["--profile"] is not None or args["--cprofile"] is not None:
+        from .profiling import Profiler
+        profiler = Profiler(cprofile_stage=args["--cprofile"])
+
     layout_file = open(args["--layout-file"], mode="r")
 
+    layout_cache = None
+    if args["--cache-dir"] is not None:
+        from .cache import LayoutCache
+        layout_cache = LayoutCache(args["--cache-dir"])
+
     if args["sheet"]:
         sheet_filename = args["--output-file"]
         if sheet_filename is None:
             sheet_filename = "sheet.txt"
 
-        sheet_file = open(sheet_filename, "w")
-        SheetMaker(layout_file, sheet_file)
+        from .format import SheetMaker, sheet_formats
+        from .misc import AtomicFile
 
-        sheet_file.close()
+        filenames = {}
+        for name in args["--sheet-formats"].split(","):
+            name = name.strip()
+            if name == "text":
+                filenames[name] = sheet_filename
+            elif name in sheet_formats:
+                filenames[name] = osp.splitext(sheet_filename)[0]\
+                        + sheet_formats[name].extension
+            else:
+                sys.exit("Unknown sheet format: {}".format(name))
+
+        outputs = dict((name, AtomicFile(fn))
+                for name, fn in filenames.items())
+        sheet_file = outputs.pop("text", None)
+
+        with atomic_outputs([sheet_file] + list(outputs.values())):
+            SheetMaker(layout_file, sheet_file, profiler=profiler,
+                    layout_cache=layout_cache, outputs=outputs)
 
     elif args["overlay"]:
         overlay_filename = args["--output-file"]
         if overlay_filename is None:
             overlay_filename = "vgs_overlay.ahk"
 
-        overlay_file = open(overlay_filename, "w")
+        from .overlay import AutohotkeyWriter
 
-        writer = AutohotkeyWriter()
-        writer.set_layout_from_file(layout_file)
-        writer.write(overlay_file)
+        from .misc import AtomicFile
 
-        overlay_file.close()
+        overlay_file = AtomicFile(overlay_filename)
+
+        with atomic_outputs([overlay_file]):
+            writer = AutohotkeyWriter(profiler=profiler,
+                    layout_cache=layout_cache,
+                    dispatch_table=args["--dispatch-table"] or None)
+            writer.set_layout_from_file(layout_file)
+            writer.write(overlay_file)
+
+    elif args["analyze"]:
+        from .vgs import Composer
+        from .analyze import ScriptAnalyzer
 
-    elif args["vgs"]:
         cfg_files   = open_files(args["--cfg-file"], mode="r")
         lst_files   = open_files(args["--lst-file"], mode="r")
-        output_filename = args["--output-file"]
-        if output_filename is None:
-            output_filename = "vgs.cfg"
-        output_file = open(output_filename, mode="w")
-        Composer(
+        symbol_table = None
+        if args["--mangle"] is not None:
+            # the table is only read, symbols of new names are not kept
+            from .mangle import SymbolTable
+            symbol_table = SymbolTable(args["--mangle"])
+        composer = Composer(
             cfg_files=cfg_files,
             lst_files=lst_files,
             layout_file=layout_file,
-            output_file=output_file)
+            silent=True,
+            differential=args["--differential"],
+            alias_dispatch=args["--dispatch"],
+            follow_exec=args["--follow-exec"],
+            profiler=profiler,
+            layout_cache=layout_cache,
+            symbol_table=symbol_table)
+        for f in itertools.chain(cfg_files, lst_files):
+            f.close()
 
-        for f in itertools.chain(cfg_files, lst_files, [output_file]):
+        report = ScriptAnalyzer(composer).report(args["--format"],
+                top=int(args["--top"]))
+        if args["--output-file"] is None:
+            print(report)
+        else:
+            with open(args["--output-file"], "w") as f:
+                f.write(report + "\n")
+
+    elif args["optimize"]:
+        from .optimize import LayoutOptimizer
+        from .cfg_parser import BindParser
+        from .lst_parser import LST_Hotkey_Parser
+        from .misc import load_layout, dump_data, AtomicFile
+
+        bound_keys = set()
+        for cfg_file in open_files(args["--cfg-file"], mode="r"):
+            bound_keys.update(BindParser(cfg_file).get())
+            cfg_file.close()
+        for lst_file in open_files(args["--lst-file"], mode="r"):
+            bound_keys.update(LST_Hotkey_Parser(lst_file)\
+                    .get_hotkey_functions(None))
+            lst_file.close()
+
+        weights = None
+        if args["--weights"] is not None:
+            with open(args["--weights"], "r") as f:
+                weights = load_layout(f)
+
+        max_group_size = args["--max-group-size"]
+        if max_group_size is not None:
+            max_group_size = int(max_group_size)
+
+        try:
+            optimizer = LayoutOptimizer(load_layout(layout_file, layout_cache),
+                    weights=weights, keys=split_keys(args["--keys"]),
+                    reserved=split_keys(args["--reserve"] or ""),
+                    bound_keys=bound_keys, max_group_size=max_group_size)
+        except ValueError as e:
+            sys.exit("Cannot optimize layout: {}. Keys bound in the cfg/lst "
+                    "files and the start/cancel hotkeys are never used, "
+                    "offer more keys with --keys or reserve fewer with "
+                    "--reserve.".format(e))
+        optimized = optimizer.optimize()
+        print(optimizer.report(optimized, args["--format"],
+            top=int(args["--top"])))
+
+        if args["--output-file"] is not None:
+            output_file = AtomicFile(args["--output-file"])
+            with atomic_outputs([output_file]):
+                dump_data(optimized, output_file)
+
+    elif args["vgs"]:
+        from .vgs import Composer
+        from .cache import BuildCache, ParseCache
+        from .misc import AtomicFile
+
+        cfg_files   = open_files(args["--cfg-file"], mode="r")
+        lst_files   = open_files(args["--lst-file"], mode="r")
+        output_filename = args["--output-file"]
+        if output_filename is None:
+            output_filename = "vgs.cfg"
+        if args["--mangle"] is not None:
+            map_filename = args["--mangle"] + ".map"
+            paths = [osp.abspath(fn) for fn in (output_filename,
+                args["--mangle"], map_filename)]
+            if len(set(paths)) < len(paths):
+                sys.exit("Output file, symbol table and symbol map have to "
+                        "be different files.")
+        output_file = AtomicFile(output_filename)
+        build_cache = None
+        if args["--build-cache"] is not None:
+            build_cache = BuildCache(args["--build-cache"])
+        parse_cache = None
+        if args["--cache-dir"] is not None:
+            parse_cache = ParseCache(args["--cache-dir"])
+        symbol_table = None
+        if args["--mangle"] is not None:
+            from .mangle import SymbolTable
+            symbol_table = SymbolTable(args["--mangle"])
+        with atomic_outputs([output_file]):
+            Composer(
+                cfg_files=cfg_files,
+                lst_files=lst_files,
+                layout_file=layout_file,
+                output_file=output_file,
+                build_cache=build_cache,
+                differential=args["--differential"],
+                alias_dispatch=args["--dispatch"],
+                parse_cache=parse_cache,
+                follow_exec=args["--follow-exec"],
+                profiler=profiler,
+                layout_cache=layout_cache,
+                symbol_table=symbol_table)
+        if build_cache is not None:
+            build_cache.save()
+        if symbol_table is not None:
+            symbol_table.save()
+            map_file = AtomicFile(map_filename)
+            with atomic_outputs([map_file]):
+                symbol_table.write_map(map_file)
+
+        for f in itertools.chain(cfg_files, lst_files):
             f.close()
     layout_file.close()
 
+    if profiler is not None:
+        report_profile(profiler, args["--profile"], args["--cprofile"],
+                args["--cprofile-output"])
+
+
+@contextlib.contextmanager
+def atomic_outputs(files):
+    """
+        Close all `AtomicFile`s in `files` (None entries are ignored) after
+        the block, or discard them if it raised an exception.
+    """
+    from .logcfg import log
+
+    files = [f for f in files if f is not None]
+    try:
+        yield files
+    except:
+        for f in files:
+            f.discard()
+        raise
+
+    for f in files:
+        f.close()
+        if not f.changed:
+            log.info("{} is unchanged.".format(f.name))
+
+
+def report_profile(profiler, format, cprofile_stage, cprofile_filename):
+    from .logcfg import log
+
+    if format is not None:
+        print(profiler.report(format))
+
+    if cprofile_stage is not None:
+        if profiler.dump_cprofile(cprofile_filename):
+            log.info("Wrote cProfile statistics of stage {} to {}.".format(
+                cprofile_stage, cprofile_filename))
+        else:
+            log.warn("Stage {} was never run.".format(cprofile_stage))
+
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright (c) 2013-2014 Oliver Breitwieser
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+"""
+    Replace the long generated alias names by short ones.
+"""
+
+__all__ = ["SymbolTable"]
+
+import os
+import os.path as osp
+import re
+import string
+
+from .logcfg import log
+
+
+def get_pickle():
+    # only imported if a symbol table is saved or loaded
+    try:
+        import cPickle as pickle
+    except ImportError:
+        import pickle
+    return pickle
+
+
+class SymbolTable(object):
+    """
+        Maps the generated alias names (everything starting with "vgs_") to
+        short symbols "va", "vb", ..., "v9", "vaa", ...
+
+        Names that are referenced more often get shorter symbols. Once a name
+        has a symbol it is kept (also in the saved table) so that names stay
+        stable between builds; only new names are distributed over the free
+        symbols.
+
+        Symbols only contain lowercase letters and digits, so that they can
+        neither clash with helper aliases (which contain an underscore) nor
+        depend on the console being case sensitive.
+    """
+
+    version = 1
+
+    prefix = "v"
+    symbol_chars = string.ascii_lowercase + string.digits
+
+    # whole generated names, the prefix is reserved for them
+    re_name = re.compile(r"(?<!\w)vgs_\w+")
+
+    def __init__(self, filename=None):
+        self.filename = filename
+        # name -> symbol
+        self.symbols = {}
+        # number of references to each name in the last build
+        self.counts = {}
+
+        if self.filename is not None and osp.isfile(self.filename):
+            self.load(self.filename)
+
+    def load(self, filename):
+        pickle = get_pickle()
+        try:
+            with open(filename, "rb") as f:
+                version, symbols = pickle.load(f)
+        except Exception as e:
+            log.warn("Could not read symbol table {}: {}".format(filename, e))
+            return
+
+        if version == self.version:
+            self.symbols = symbols
+
+    def save(self, filename=None):
+        if filename is None:
+            filename = self.filename
+        if filename is None:
+            return
+
+        pickle = get_pickle()
+        tmp_filename = filename + ".tmp"
+        with open(tmp_filename, "wb") as f:
+            pickle.dump((self.version, self.symbols), f,
+                    pickle.HIGHEST_PROTOCOL)
+        if osp.exists(filename):
+            os.remove(filename)
+        os.rename(tmp_filename, filename)
+
+    @classmethod
+    def get_symbol(cls, idx):
+        """
+            Symbols are "va", ..., "v9", "vaa", "vab", ...
+        """
+        num_chars = len(cls.symbol_chars)
+        symbol = ""
+        idx += 1
+        while idx > 0:
+            idx -= 1
+            symbol = cls.symbol_chars[idx % num_chars] + symbol
+            idx //= num_chars
+        return cls.prefix + symbol
+
+    def count(self, texts):
+        """
+            Count the references to all names in the iterable `texts`.
+        """
+        counts = {}
+        for text in texts:
+            for name in self.re_name.findall(text):
+                counts[name] = counts.get(name, 0) + 1
+        self.counts = counts
+        return counts
+
+    def assign(self, counts=None):
+        """
+            Give all names in `counts` (name -> number of references) that do
+            not have a symbol yet the shortest free ones, most referenced
+            first.
+        """
+        if counts is None:
+            counts = self.counts
+        new_names = sorted((n for n in counts if n not in self.symbols),
+                key=lambda n: (-counts[n], n))
+        if len(new_names) == 0:
+            return
+
+        used = set(self.symbols.values())
+        idx = 0
+        for name in new_names:
+            while self.get_symbol(idx) in used:
+                idx += 1
+            self.symbols[name] = self.get_symbol(idx)
+            idx += 1
+
+    def get(self, name):
+        """
+            Returns the symbol for `name` or `name` itself if it has none.
+        """
+        return self.symbols.get(name, name)
+
+    def rename(self, text):
+        """
+            Replace all names in `text` by their symbols.
+        """
+        return self.re_name.sub(lambda m: self.get(m.group()), text)
+
+    def write_map(self, f):
+        """
+            Write a readable "symbol name references" table of all names
+            referenced in the last build to file `f`.
+        """
+        order = dict((c, i) for i, c in enumerate(self.symbol_chars))
+        names = sorted(self.counts, key=lambda n: (len(self.get(n)),
+            [order.get(c, -1) for c in self.get(n)]))
+        width = max([len(self.get(n)) for n in names] + [0])
+        for name in names:
+            f.write("{symbol:<{width}} {name} {count}\n".format(
+                symbol=self.get(name), width=width, name=name,
+                count=self.counts[name]))
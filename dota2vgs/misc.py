@@ -21,13 +21,181 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
-import yaml
+import os
+import os.path as osp
+import hashlib
+
+from .logcfg import log
+
+# yaml is only imported when needed
+YamlLoader = None
 
-try:
-    from yaml import CLoader as YamlLoader, CDumper as YamlDumper
-except ImportError:
-    from yaml import YamlLoader, YamlDumper
 
 def load_data(obj):
     "Load yaml from object."
+    global YamlLoader
+    import yaml
+    if YamlLoader is None:
+        try:
+            from yaml import CLoader as YamlLoader
+        except ImportError:
+            from yaml import Loader as YamlLoader
     return yaml.load(obj, Loader=YamlLoader)
+
+
+def dump_data(obj, f):
+    "Write `obj` as yaml to file `f`."
+    import yaml
+    try:
+        from yaml import CSafeDumper as YamlDumper
+    except ImportError:
+        from yaml import SafeDumper as YamlDumper
+    yaml.dump(obj, f, Dumper=YamlDumper, default_flow_style=False)
+
+
+def load_layout(layout_file, cache=None):
+    """
+        Returns the layout from `layout_file` (YAML file or string) or
+        `layout_file` itself if it is already loaded (dict).
+
+        The layout is taken from `cache` (a `LayoutCache`) if given.
+    """
+    if isinstance(layout_file, dict):
+        return layout_file
+    elif cache is not None:
+        return cache.load(layout_file)
+    else:
+        return load_data(layout_file)
+
+
+class BufferedWriter(object):
+    """
+        Collects the written strings and writes them to file `f` in blocks
+        of roughly `buffer_size` characters.
+
+        If a `profiler` is given, the time spent writing is recorded in stage
+        "write" and the number of written characters as "chars_written".
+    """
+
+    def __init__(self, f, buffer_size=1 << 16, profiler=None):
+        self.f = f
+        self.buffer_size = buffer_size
+        self.profiler = profiler
+        self.buffered = []
+        self.size = 0
+
+    def write(self, text):
+        self.buffered.append(text)
+        self.size += len(text)
+        if self.size >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if len(self.buffered) == 0:
+            return
+        text = "".join(self.buffered)
+        self.buffered = []
+        self.size = 0
+
+        if self.profiler is None:
+            self.f.write(text)
+        else:
+            with self.profiler.stage("write"):
+                self.f.write(text)
+            self.profiler.count("chars_written", len(text))
+
+
+def write_lines(f, lines, buffer_size=1 << 16, profiler=None):
+    """
+        Write all strings from the iterable `lines` to file `f` (see
+        `BufferedWriter`).
+    """
+    writer = BufferedWriter(f, buffer_size=buffer_size, profiler=profiler)
+    for line in lines:
+        writer.write(line)
+    writer.flush()
+
+
+def get_file_digest(filename, block_size=1 << 16):
+    """
+        Returns the sha1 hex digest of the content of `filename`.
+    """
+    digest = hashlib.sha1()
+    with open(filename, "rb") as f:
+        block = f.read(block_size)
+        while len(block) > 0:
+            digest.update(block)
+            block = f.read(block_size)
+    return digest.hexdigest()
+
+
+class AtomicFile(object):
+    """
+        File-like object that writes to a temporary file next to `filename`
+        which replaces `filename` on `close` -- but only if the content
+        differs, otherwise the existing file (and its modification time) is
+        left untouched. Afterwards `changed` tells which was the case.
+
+        When used as context manager, an exception discards the temporary
+        file so that `filename` is never left half-written.
+    """
+
+    def __init__(self, filename, mode="w"):
+        self.name = filename
+        self.tmp_filename = "{}.{}.tmp".format(filename, os.getpid())
+        self.f = open(self.tmp_filename, mode)
+        self.changed = None
+
+    @property
+    def closed(self):
+        return self.f.closed
+
+    def write(self, text):
+        self.f.write(text)
+
+    def flush(self):
+        self.f.flush()
+
+    def is_unchanged(self):
+        if not osp.isfile(self.name):
+            return False
+        if osp.getsize(self.name) != osp.getsize(self.tmp_filename):
+            return False
+        return get_file_digest(self.name)\
+                == get_file_digest(self.tmp_filename)
+
+    def close(self):
+        if self.closed:
+            return
+        self.f.close()
+
+        self.changed = not self.is_unchanged()
+        if not self.changed:
+            log.debug("{} is unchanged.".format(self.name))
+            os.remove(self.tmp_filename)
+            return
+
+        try:
+            os.rename(self.tmp_filename, self.name)
+        except OSError:
+            # rename does not replace existing files on Windows
+            os.remove(self.name)
+            os.rename(self.tmp_filename, self.name)
+
+    def discard(self):
+        """
+            Drop everything written so far and leave `filename` as it is.
+        """
+        if self.closed:
+            return
+        self.f.close()
+        os.remove(self.tmp_filename)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
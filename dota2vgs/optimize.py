@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright (c) 2013-2014 Oliver Breitwieser
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+"""
+    Rearrange layouts so that often used phrases need fewer keystrokes.
+"""
+
+__all__ = ["LayoutOptimizer", "get_phrase_costs"]
+
+import heapq
+import string
+
+from .layout import LayoutIR
+
+
+def get_phrase_costs(layout):
+    """
+        Returns a list of (phrase item, keys)-tuples for all phrases of
+        `layout`, `keys` being all keys to press to say the phrase (start
+        hotkey, one key per group and the phrase hotkey).
+    """
+    ir = LayoutIR(layout)
+    costs = []
+    for idx in range(len(ir)):
+        if ir.kinds[idx] != ir.PHRASE:
+            continue
+        keys = [layout["hotkey"]] + [ir.hotkeys[i]
+                for i in ir.get_path(idx)[1:]]
+        costs.append((ir.items[idx], keys))
+    return costs
+
+
+class LayoutOptimizer(object):
+    """
+        Builds a layout that minimizes the expected number of keystrokes per
+        phrase, given how often each phrase is used.
+
+        Phrases are distributed over groups by a k-ary Huffman code, k being
+        the number of keys each group may use: the k least used phrases (or
+        groups) are repeatedly merged into a new group.
+
+        Keys that are `reserved`, already bound (`bound_keys`) or the start
+        and cancel hotkey are not used within groups. Where possible
+        phrases keep their hotkey or get the first letter of their name.
+    """
+
+    def __init__(self, layout, weights=None, keys=string.ascii_lowercase,
+            reserved=(), bound_keys=(), max_group_size=None):
+        """
+            `weights` maps phrase names or ids to how often they are used,
+            phrases that are not listed have weight 0. If `weights` is None,
+            all phrases weigh the same.
+        """
+        self.layout = layout
+        self.weights = weights
+
+        self.excluded = set(reserved) | set(k.lower() for k in bound_keys)\
+                | set([layout["hotkey"], layout["hotkey_cancel"]])
+        self.keys = [k for k in keys if k not in self.excluded]
+
+        self.group_size = len(self.keys)
+        if max_group_size is not None:
+            self.group_size = min(self.group_size, max_group_size)
+        if self.group_size < 2:
+            raise ValueError("At least two keys are needed per group, "
+                    "available: {} (excluded: {})".format(
+                        ", ".join(self.keys) or "none",
+                        ", ".join(sorted(k for k in self.excluded
+                            if k in keys))))
+
+    def get_weight(self, phrase):
+        if self.weights is None:
+            return 1.
+        for k in (phrase["name"], phrase["id"], str(phrase["id"])):
+            if k in self.weights:
+                return float(self.weights[k])
+        return 0.
+
+    def get_cost(self, layout):
+        """
+            Returns the expected number of keystrokes per phrase.
+        """
+        costs = [(self.get_weight(p), len(keys))
+                for p, keys in get_phrase_costs(layout)]
+        total = sum(w for w, c in costs)
+        if total == 0:
+            # nothing is used, all phrases count the same
+            return float(sum(c for w, c in costs)) / max(len(costs), 1)
+        return sum(w * c for w, c in costs) / total
+
+    def build_tree(self, phrases):
+        """
+            Returns the root of the Huffman tree of `phrases`; nodes are
+            (weight, phrase or list of child nodes)-tuples.
+        """
+        k = self.group_size
+        # the counter keeps the order stable for equal weights
+        heap = [(self.get_weight(p), i, (self.get_weight(p), p))
+                for i, p in enumerate(phrases)]
+        counter = len(heap)
+        if len(heap) <= k:
+            return (sum(w for w, i, n in heap), [n for w, i, n in heap])
+
+        # pad with empty nodes so that every merge takes k nodes
+        while (len(heap) - 1) % (k - 1) != 0:
+            heap.append((0., counter, None))
+            counter += 1
+        heapq.heapify(heap)
+
+        while len(heap) > 1:
+            merged = [heapq.heappop(heap) for i in range(k)]
+            children = [n for w, i, n in merged if n is not None]
+            weight = sum(w for w, i, n in merged)
+            heapq.heappush(heap, (weight, counter, (weight, children)))
+            counter += 1
+
+        return heap[0][2]
+
+    def get_preferred_keys(self, node):
+        weight, content = node
+        if isinstance(content, dict):
+            name = content["name"]
+            preferred = [content.get("hotkey", None)]
+        else:
+            name = self.get_group_name(node)
+            preferred = []
+        preferred.append(name[:1].lower())
+        return preferred + self.keys
+
+    def get_group_name(self, node):
+        # named after its most used phrase
+        while not isinstance(node[1], dict):
+            node = max(node[1], key=lambda n: n[0])
+        return "{}_etc".format(node[1]["name"])
+
+    def make_group(self, node, group, names):
+        """
+            Fill the `group` (dict) with the children of `node`.
+        """
+        used = set()
+        phrases = []
+        groups = []
+        # the most used children pick their keys first
+        for child in sorted(node[1], key=lambda n: -n[0]):
+            key = next(k for k in self.get_preferred_keys(child)
+                    if k in self.keys and k not in used)
+            used.add(key)
+
+            if isinstance(child[1], dict):
+                phrase = dict(child[1])
+                phrase["hotkey"] = key
+                phrases.append(phrase)
+            else:
+                name = self.get_group_name(child)
+                if name in names:
+                    i = 2
+                    while "{}_{}".format(name, i) in names:
+                        i += 1
+                    name = "{}_{}".format(name, i)
+                names.add(name)
+                subgroup = {"name" : name, "hotkey" : key}
+                self.make_group(child, subgroup, names)
+                groups.append(subgroup)
+
+        group.pop("phrases", None)
+        group.pop("groups", None)
+        if len(phrases) > 0:
+            group["phrases"] = phrases
+        if len(groups) > 0:
+            group["groups"] = groups
+        return group
+
+    def optimize(self):
+        """
+            Returns the rearranged layout (all other settings are kept).
+        """
+        phrases = [p for p, keys in get_phrase_costs(self.layout)]
+        root = self.build_tree(phrases)
+        layout = dict(self.layout)
+        return self.make_group(root, layout, set(["start"]))
+
+    def get_results(self, optimized, top=None):
+        """
+            Costs before and after optimizing as well as the keys of the
+            `top` most used phrases (all if None).
+        """
+        before = dict(((p["name"], p["id"]), keys)
+                for p, keys in get_phrase_costs(self.layout))
+        phrases = []
+        for p, keys in get_phrase_costs(optimized):
+            phrases.append({
+                "name" : p["name"],
+                "id" : p["id"],
+                "weight" : self.get_weight(p),
+                "before" : before[p["name"], p["id"]],
+                "after" : keys,
+                })
+        phrases.sort(key=lambda p: (-p["weight"], p["name"]))
+
+        return {
+                "cost_before" : self.get_cost(self.layout),
+                "cost_after" : self.get_cost(optimized),
+                "group_size" : self.group_size,
+                "keys" : self.keys,
+                "phrases" : phrases[:top],
+            }
+
+    def report_text(self, optimized, top=20):
+        results = self.get_results(optimized, top=top)
+        lines = ["Expected keystrokes per phrase: {:.3f} -> {:.3f} "
+                "(at most {} keys per group: {})".format(
+                    results["cost_before"], results["cost_after"],
+                    results["group_size"], "".join(results["keys"])), ""]
+        lines.append("{:<32} {:>8}  {:<12} {}".format("Phrase", "Weight",
+            "Before", "After"))
+        for p in results["phrases"]:
+            lines.append("{:<32} {:>8g}  {:<12} {}".format(p["name"],
+                p["weight"], " ".join(p["before"]), " ".join(p["after"])))
+        return "\n".join(lines)
+
+    def report_json(self, optimized):
+        import json
+        return json.dumps(self.get_results(optimized), indent=2,
+                sort_keys=True)
+
+    def report(self, optimized, format="text", top=20):
+        if format == "json":
+            return self.report_json(optimized)
+        else:
+            return self.report_text(optimized, top=top)
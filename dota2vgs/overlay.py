@@ -23,7 +23,9 @@
 
 import copy
 
-from .misc import load_data
+from .misc import load_layout, write_lines
+from .layout import LayoutIR
+from .profiling import null_profiler
 
 class ConsoleWriter(object):
     """
@@ -32,7 +34,8 @@ class ConsoleWriter(object):
     """
     cmd_echo = "echo \"| {}\""
 
-    def __init__(self, lines_offset=5, lines_write_area=25, notify_time=30):
+    def __init__(self, lines_offset=5, lines_write_area=25, notify_time=30,
+            frame_prefix=None):
         """
             lines_offset: number of lines that are always empty
                           to offset the menu position.
@@ -40,12 +43,18 @@ class ConsoleWriter(object):
             lines_write_area: How big is the area in which actual content
                               is written.
             notify_time: How long should notifies be visible.
+
+            frame_prefix: If given, the empty lines and the footer are not
+                          echoed directly but by calling shared aliases
+                          whose names start with `frame_prefix` (see
+                          `get_frame_aliases`).
         """
         self.lines_offset = lines_offset
         self.lines_area = lines_write_area
 
         self.lines_total = self.lines_offset + self.lines_area
         self.notify_time = notify_time
+        self.frame_prefix = frame_prefix
 
         self.footer = []
 
@@ -69,6 +78,14 @@ class ConsoleWriter(object):
 
             Returns the necessare commands.
         """
+        if self.frame_prefix is not None:
+            return self.write_messages_framed(messages)
+        return self.write_messages_inline(messages)
+
+    def write_messages_inline(self, messages):
+        """
+            Like `write_messages` but all lines are echoed directly.
+        """
         all_messages = messages + self.footer
 
         # enable the developer mode to actually display the messages
@@ -101,6 +118,82 @@ class ConsoleWriter(object):
 
         return commands
 
+    def write_messages_framed(self, messages, share_header=True):
+        """
+            Like `write_messages` but the footer and filler lines (and the
+            offset lines if `share_header` is set) are written by calling
+            the aliases from `get_frame_aliases`.
+        """
+        commands = []
+        if self.lines_offset > 0 and share_header:
+            commands.append(self.get_frame_name("header"))
+        elif self.lines_offset > 0:
+            commands.extend([self.cmd_echo.format("")] * self.lines_offset)
+
+        for message in messages:
+            commands.append(self.cmd_echo.format(message))
+
+        num_filler_lines = self.get_num_filler_lines(messages)
+        if len(self.footer) > 0 or num_filler_lines > 0:
+            commands.append(self.get_tail_name(num_filler_lines))
+
+        return commands
+
+    def get_message_variants(self, messages):
+        """
+            Returns the alternative command lists writing `messages`: inline,
+            then (if `frame_prefix` is set) sharing the footer and filler
+            lines and sharing the offset lines as well.
+
+            Every shared part saves script size but costs an alias call when
+            the messages are written.
+        """
+        variants = [self.write_messages_inline(messages)]
+        if self.frame_prefix is not None:
+            variants.append(self.write_messages_framed(messages,
+                share_header=False))
+            if self.lines_offset > 0:
+                variants.append(self.write_messages_framed(messages))
+        return variants
+
+    def get_num_filler_lines(self, messages):
+        return max(0, self.lines_area - len(messages) - len(self.footer))
+
+    def get_frame_name(self, name):
+        return self.frame_prefix + name
+
+    def get_tail_name(self, num_filler_lines):
+        return self.get_frame_name("tail_{}".format(num_filler_lines))
+
+    def get_frame_aliases(self, filler_counts):
+        """
+            Returns a list of (name, commands)-tuples of the shared aliases
+            used if `frame_prefix` is set.
+
+            `filler_counts` are the numbers of filler lines needed after the
+            messages written with `write_messages`; there is one tail alias
+            (footer and filler lines) for each of them.
+
+            All frame aliases echo their lines directly so that writing
+            messages adds at most two alias calls.
+        """
+        aliases = []
+        if self.frame_prefix is None:
+            return aliases
+
+        if self.lines_offset > 0:
+            aliases.append((self.get_frame_name("header"),
+                [self.cmd_echo.format("")] * self.lines_offset))
+
+        for num_filler_lines in sorted(set(filler_counts)):
+            if len(self.footer) == 0 and num_filler_lines == 0:
+                continue
+            aliases.append((self.get_tail_name(num_filler_lines),
+                [self.cmd_echo.format(m) for m in self.footer]
+                + [self.cmd_echo.format("")] * num_filler_lines))
+
+        return aliases
+
     def add_messages_to_alias(self, messages, alias):
         """
             Adds messages to alias execution
@@ -136,9 +229,6 @@ class GroupWriter(ConsoleWriter):
     """
         Class to write an overview over the group contents.
     """
-    designator_groups = "groups"
-    designator_cmds = "phrases"
-
     name_cmds = "Phrases"
 
     fmt_hotkey = "{hk} -> {lbl}"
@@ -155,43 +245,56 @@ class GroupWriter(ConsoleWriter):
         return self.fmt_hotkey.format(hk=hotkey,
                 lbl=label.replace("_", " "))
 
-    def append_hotkeys(self, items, messages):
-        for item in items:
-            messages.append(self.format_hotkey(item["hotkey"], item["name"]))
+    def append_hotkeys(self, ir, indices, messages):
+        for idx in indices:
+            messages.append(self.format_hotkey(ir.hotkeys[idx], ir.names[idx]))
 
 
-    def write_group_info_to_alias(self, group, alias):
+    def write_group_info_to_alias(self, ir, idx, alias):
         """
-            Make the group alias display an overview over all groups and
-            commands when called.
+            Make the alias of group `idx` in the layout IR `ir` display an
+            overview over all groups and commands when called.
         """
+        self.add_messages_to_alias(self.get_group_messages(ir, idx), alias)
+
+    def get_group_messages(self, ir, idx):
         messages = []
-        if self.designator_groups in group:
+        has_groups = len(ir.groups[idx]) > 0
+        if has_groups:
             messages.append("Available groups:")
             messages.append("=================")
-            groups = sorted(group[self.designator_groups],
-                    key=lambda x:x["name"])
 
-            self.append_hotkeys(groups, messages)
+            self.append_hotkeys(ir, ir.groups_by_name[idx], messages)
 
-        if self.designator_cmds in group:
-            if self.designator_groups in group:
+        if len(ir.phrases[idx]) > 0:
+            if has_groups:
                 # Add separator
                 messages.append("")
 
             messages.append("Available {}:".format(self.name_cmds))
             messages.append("===========" + "=" * len(self.name_cmds))
-            cmds = sorted(group[self.designator_cmds],
-                    key=lambda x:x["name"])
 
-            self.append_hotkeys(cmds, messages)
+            self.append_hotkeys(ir, ir.phrases_by_name[idx], messages)
 
-        self.add_messages_to_alias(messages, alias)
+        return messages
+
+    def get_filler_counts(self, ir):
+        """
+            Numbers of filler lines needed by the groups in `ir` (see
+            `get_frame_aliases`).
+        """
+        return [self.get_num_filler_lines(self.get_group_messages(ir, idx))
+                for idx in ir.group_indices]
 
 
 class AutohotkeyWriter(object):
     """
         Writer that generates an Autohotkey script that will act as overlay.
+
+        By default every group subroutine rebinds all hotkeys. If the overlay
+        option `dispatch_table` is set, all hotkeys are bound once to a
+        single subroutine instead that looks up what to do in a table for the
+        current state, so that switching groups only sets the state.
     """
 
     default_config = {
@@ -207,6 +310,8 @@ class AutohotkeyWriter(object):
 
             "hotkey_toggle" : "^F12",
             "hotkey_reset" : "Esc",
+
+            "dispatch_table" : False,
         }
 
     sub_names = {
@@ -214,7 +319,14 @@ class AutohotkeyWriter(object):
             "reset" : "ResetHotkeys",
             "init" : "Initialize",
             "empty" : "Empty",
-            "toggle": "VGS_Toggle"
+            "toggle": "VGS_Toggle",
+            "dispatch": "VGS_Dispatch",
+        }
+
+    # names of the dispatch table states besides the group subroutines
+    state_names = {
+            "idle" : "Idle",
+            "off" : "Off",
         }
 
     window_names = {
@@ -222,10 +334,26 @@ class AutohotkeyWriter(object):
             "overlay" : "d2vgs_overlay",
             }
 
-    def __init__(self):
+    def __init__(self, profiler=None, layout_cache=None, dispatch_table=None):
+        """
+            `profiler` is an optional `Profiler` recording the time spent in
+            the different stages.
+
+            `layout_cache` is an optional `LayoutCache` used by
+            `set_layout_from_file` to skip parsing unchanged layouts.
+
+            `dispatch_table` overrides the overlay option of the same name if
+            not None.
+        """
+        self.layout_cache = layout_cache
+        self.dispatch_table = dispatch_table
         self.layout = None
+        self.ir = None
         self.all_hotkeys = set()
         self.code = []
+        if profiler is None:
+            profiler = null_profiler
+        self.profiler = profiler
 
     def get_popup_appearance(self):
         return "b zh0 c0 fs{font_size} Hide ".format(
@@ -242,10 +370,12 @@ class AutohotkeyWriter(object):
             layout["overlay"]["ypos"] = layout["overlay_ypos"]
 
         self.config = self.setup_config(layout["overlay"])
-
-        layout["name"] = self.config["root_group"]
+        if self.dispatch_table is not None:
+            self.config["dispatch_table"] = self.dispatch_table
 
         self.layout = layout
+        with self.profiler.stage("compile_layout"):
+            self.ir = LayoutIR(layout, root_name=self.config["root_group"])
 
     def setup_config(self, cfg):
         config = copy.deepcopy(self.default_config)
@@ -253,72 +383,77 @@ class AutohotkeyWriter(object):
         return config
 
     def set_layout_from_file(self, layout_file):
-        self.set_layout(load_data(layout_file))
+        with self.profiler.stage("load_layout"):
+            layout = load_layout(layout_file, cache=self.layout_cache)
+        self.set_layout(layout)
 
-    def generate_code(self):
-        self.all_hotkeys = self.gather_hotkeys(self.layout)
+    def iter_chunks(self):
+        """
+            Yields the code of the script as lists of lines, one for every
+            subroutine (including the empty line separating it from the
+            next one).
+        """
+        self.all_hotkeys = self.ir.all_hotkeys
 
-        self.code = []
-        self.code.append("#SingleInstance force")
-        self.code.append("#IfWinActive, {}".format(self.window_names["dota2"]))
-        # optimizations
-        self.code.extend([
+        yield [
+                "#SingleInstance force",
+                "#IfWinActive, {}".format(self.window_names["dota2"]),
+                # optimizations
                 "#NoEnv",
                 "SetBatchLines -1",
                 "ListLines Off",
                 # hotkey that resets everything
                 self.get_hotkey(self.config["hotkey_reset"],
-                    self.sub_names["reset"])
-            ])
-
-        self.code.append(self.get_call_sub(self.sub_names["init"]))
-        self.code.append(self.get_call_sub(self.sub_names["reset"]))
-        self.code.append("Return")
-        self.code.append("")
-
-        groups = [self.layout]
-
-        for group in groups:
-            self.code.extend(self.get_group_subroutine(group))
-            groups.extend(group.get("groups", []))
+                    self.sub_names["reset"]),
+                self.get_call_sub(self.sub_names["init"]),
+                self.get_call_sub(self.sub_names["reset"]),
+                "Return",
+                "",
+            ]
 
-            self.code.append("")
+        for idx in self.ir.group_indices:
+            yield self.get_group_subroutine(idx) + [""]
 
         # add special subroutines
-        self.code.extend(self.get_subroutine_hide())
-        self.code.append("")
-        self.code.extend(self.get_subroutine_reset())
-        self.code.append("")
-        self.code.extend(self.get_subroutine_empty())
-        self.code.append("")
-        self.code.extend(self.get_subroutine_init())
-        self.code.append("")
-        self.code.extend(self.get_subroutine_toggle())
-        self.code.append("")
-
-        self.code.append("")
-        self.code.append("")
-
-
-    def write(self, outfile, newline="\r\n"):
-        self.generate_code()
-        outfile.write(newline.join(self.code))
+        yield self.get_subroutine_hide() + [""]
+        yield self.get_subroutine_reset() + [""]
+        yield self.get_subroutine_empty() + [""]
+        yield self.get_subroutine_init() + [""]
+        yield self.get_subroutine_toggle() + [""]
+        if self.config["dispatch_table"]:
+            yield self.get_subroutine_dispatch() + [""]
 
-    def gather_hotkeys(self, group):
-        hotkeys = set()
+        yield ["", ""]
 
-        for hk in ("hotkey", "hotkey_cancel"):
-            if hk in group:
-                hotkeys.add(group[hk])
-
-        for phr in group.get("phrases", []):
-            hotkeys.add(phr["hotkey"])
+    def generate_code(self):
+        self.code = []
+        for chunk in self.iter_chunks():
+            self.code.extend(chunk)
 
-        for grp in group.get("groups", []):
-            hotkeys.add(grp["hotkey"])
-            hotkeys = hotkeys.union(self.gather_hotkeys(grp))
+    def iter_text(self, newline="\r\n"):
+        """
+            Yields the text of the script subroutine by subroutine so that it
+            never has to be kept in memory as a whole.
+        """
+        chunks = self.iter_chunks()
+        num_lines = 0
+        while True:
+            with self.profiler.stage("generate_code"):
+                chunk = next(chunks, None)
+            if chunk is None:
+                break
+
+            text = newline.join(chunk)
+            # lines are separated (not terminated) by newlines
+            if num_lines > 0:
+                text = newline + text
+            num_lines += len(chunk)
+            yield text
+
+        self.profiler.count("lines_written", num_lines)
 
-        return hotkeys
+    def write(self, outfile, newline="\r\n"):
+        write_lines(outfile, self.iter_text(newline), profiler=self.profiler)
 
     def get_progress_popup(self, lines):
         code = ["Progress, {fmt}, {lines}, , {title}, {font_name}".format(
@@ -364,16 +499,20 @@ class AutohotkeyWriter(object):
         return self.get_timer(self.sub_names["hide"],
                 delay=self.config["hide_delay"])
 
-    def get_group_subroutine(self, group):
-        lines = self.get_group_displaytext(group)
-        hotkeys_to_group = {v["hotkey"]:v["name"]
-                for v in group.get("groups", [])}
-        hotkeys_phrases = [v["hotkey"] for v in group.get("phrases", [])]
+    def get_group_subroutine(self, idx):
+        ir = self.ir
+        lines = self.get_group_displaytext(idx)
+        hotkeys_to_group = {ir.hotkeys[g]:ir.names[g] for g in ir.groups[idx]}
+        hotkeys_phrases = [ir.hotkeys[p] for p in ir.phrases[idx]]
         code = [
-                "{}:".format(self.get_group_subroutine_name(group["name"])),
+                "{}:".format(self.get_group_subroutine_name(ir.names[idx])),
             ]
         code.extend(self.get_progress_popup(lines))
-        code.extend(self.get_rebinds(hotkeys_to_group, hotkeys_phrases))
+        if self.config["dispatch_table"]:
+            code.append(self.get_set_state(
+                self.get_group_subroutine_name(ir.names[idx])))
+        else:
+            code.extend(self.get_rebinds(hotkeys_to_group, hotkeys_phrases))
         code.extend([self.get_hide_timer(), "Return"])
 
         return code
@@ -381,22 +520,22 @@ class AutohotkeyWriter(object):
     def beautify(self, line):
         return line.replace("_", " ")
 
-    def get_group_displaytext(self, group):
+    def get_group_displaytext(self, idx):
+        ir = self.ir
         lines = [
-                self.beautify(group["name"]) + ":",
+                self.beautify(ir.names[idx]) + ":",
                 "",
             ]
-        for grp in sorted(group.get("groups", []), key=lambda x: x["name"]):
-            lines.append("{key} ==> {name}".format(key=grp["hotkey"],
-                name=self.beautify(grp["name"])))
+        for grp in ir.groups_by_name[idx]:
+            lines.append("{key} ==> {name}".format(key=ir.hotkeys[grp],
+                name=self.beautify(ir.names[grp])))
 
-        if len(group.get("groups", [])) > 0\
-                and len(group.get("phrases", [])) > 0:
+        if len(ir.groups[idx]) > 0 and len(ir.phrases[idx]) > 0:
             lines.append("")
 
-        for phr in sorted(group.get("phrases", []), key=lambda x: x["name"]):
-            lines.append("{key} ==> {name}".format(key=phr["hotkey"],
-                name=self.beautify(phr["name"])))
+        for phr in ir.phrases_by_name[idx]:
+            lines.append("{key} ==> {name}".format(key=ir.hotkeys[phr],
+                name=self.beautify(ir.names[phr])))
 
         lines.append("")
         lines.append("{key} ==> (Cancel hotkeys)".format(
@@ -413,7 +552,7 @@ class AutohotkeyWriter(object):
         # disable all hotkeys not in this group except for the global cancel
         code = map(lambda k: self.get_hotkey(k,
             hotkeys_to_subnames.get(k, self.sub_names["empty"])),
-            list(self.all_hotkeys - set(hotkeys_phrases)))
+            sorted(self.all_hotkeys - set(hotkeys_phrases)))
 
         # all phrase hotkeys reset the overlay (also the cancel hotkey does)
         for k in hotkeys_phrases:
@@ -421,6 +560,54 @@ class AutohotkeyWriter(object):
 
         return code
 
+    def get_dispatch_tables(self):
+        """
+            Returns the code defining which subroutine each hotkey calls in
+            every state (hotkeys missing from a table do nothing).
+        """
+        ir = self.ir
+        reset = self.sub_names["reset"]
+
+        tables = [
+                (self.state_names["idle"], [(self.layout["hotkey"],
+                    self.get_group_subroutine_name(self.config["root_group"]))]),
+                (self.state_names["off"], []),
+            ]
+
+        for idx in ir.group_indices:
+            entries = [(ir.hotkeys[g], self.get_group_subroutine_name(
+                ir.names[g])) for g in ir.groups[idx]]
+            # all phrase hotkeys reset the overlay (also the cancel hotkey
+            # does)
+            entries.extend((ir.hotkeys[p], reset) for p in ir.phrases[idx])
+            entries.append((self.layout["hotkey_cancel"], reset))
+            tables.append((self.get_group_subroutine_name(ir.names[idx]),
+                entries))
+
+        code = ["vgs_groups := {}"]
+        for state, entries in tables:
+            # later entries win just like later Hotkey commands do
+            mapping = {}
+            for k, sub in entries:
+                mapping[k] = sub
+            code.append("vgs_groups[\"{state}\"] := {{{entries}}}".format(
+                state=state, entries=", ".join("\"{}\": \"{}\"".format(
+                    k, mapping[k]) for k in sorted(mapping))))
+        return code
+
+    def get_set_state(self, state):
+        return "vgs_state := \"{}\"".format(state)
+
+    def get_subroutine_dispatch(self):
+        return [
+                "{}:".format(self.sub_names["dispatch"]),
+                # strip the ~ prefix
+                "vgs_action := vgs_groups[vgs_state][SubStr(A_ThisHotkey, 2)]",
+                "If (vgs_action != \"\")",
+                self.get_call_sub("%vgs_action%"),
+                "Return",
+            ]
+
     def get_hotkey(self, hotkey, bind):
         return "Hotkey, ~{key}, {bind}".format(key=hotkey, bind=bind)
 
@@ -438,8 +625,14 @@ class AutohotkeyWriter(object):
     def get_subroutine_init(self):
         code = ["{}:".format(self.sub_names["init"])]
 
-        for k in self.all_hotkeys:
-            code.append(self.get_hotkey(k, self.sub_names["empty"]))
+        if self.config["dispatch_table"]:
+            code.extend(self.get_dispatch_tables())
+            code.append(self.get_set_state(self.state_names["idle"]))
+            for k in sorted(self.all_hotkeys):
+                code.append(self.get_hotkey(k, self.sub_names["dispatch"]))
+        else:
+            for k in sorted(self.all_hotkeys):
+                code.append(self.get_hotkey(k, self.sub_names["empty"]))
 
         code.append("TrayTip, Dota 2 VGS Overlay, VGS Overlay for Dota 2 "
                 "enabled`, please use CTRL-F12 to disable/enable the overlay "
@@ -463,8 +656,11 @@ class AutohotkeyWriter(object):
                 "vgs_overlay_enabled := false",
                 "TrayTip, Dota 2 VGS Overlay, VGS Overlay disabled, 10",
             ]
-        for k in self.all_hotkeys:
-            code.append(self.get_hotkey(k, self.sub_names["empty"]))
+        if self.config["dispatch_table"]:
+            code.append(self.get_set_state(self.state_names["off"]))
+        else:
+            for k in sorted(self.all_hotkeys):
+                code.append(self.get_hotkey(k, self.sub_names["empty"]))
 
         code.extend([
                 "}",
@@ -483,7 +679,12 @@ class AutohotkeyWriter(object):
                 self.get_call_sub(self.sub_names["hide"]),
             ]
 
-        for k in self.all_hotkeys - set(self.layout["hotkey"]):
+        if self.config["dispatch_table"]:
+            code.append(self.get_set_state(self.state_names["idle"]))
+            code.append("Return")
+            return code
+
+        for k in sorted(self.all_hotkeys - set(self.layout["hotkey"])):
             code.append(self.get_hotkey(k, self.sub_names["empty"]))
 
         code.append(self.get_hotkey(self.layout["hotkey"],
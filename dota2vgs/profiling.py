@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright (c) 2013-2014 Oliver Breitwieser
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""
+    Per-stage timing and counting of events (aliases created, bytes written,
+    ...) for all writers.
+"""
+
+__all__ = ["Profiler", "null_profiler"]
+
+import time
+
+
+class Stage(object):
+    """
+        Context manager timing a stage of a `Profiler`.
+    """
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.profiler.enter(self.name)
+        self.t_start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.exit(self.name, time.time() - self.t_start)
+        return False
+
+
+class Profiler(object):
+    """
+        Collects wall time and number of calls per stage as well as arbitrary
+        counts.
+
+        Stages may be nested, the time of a stage includes all its substages.
+
+        Hooks are called as `hook(kind, name, value)` with kind "stage"
+        (value: elapsed time) or "count" (value: increment).
+
+        If `cprofile_stage` is given, that stage is run under cProfile (see
+        `dump_cprofile`).
+    """
+
+    def __init__(self, cprofile_stage=None):
+        # name -> [wall time, calls]
+        self.stages = {}
+        self.stage_order = []
+        self.counts = {}
+        self.count_order = []
+        self.hooks = []
+
+        self.cprofile_stage = cprofile_stage
+        self.cprofile = None
+        self.cprofile_depth = 0
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def stage(self, name):
+        return Stage(self, name)
+
+    def enter(self, name):
+        if name == self.cprofile_stage:
+            if self.cprofile is None:
+                try:
+                    import cProfile
+                except ImportError:
+                    import profile as cProfile
+                self.cprofile = cProfile.Profile()
+            if self.cprofile_depth == 0:
+                self.cprofile.enable()
+            self.cprofile_depth += 1
+
+    def exit(self, name, elapsed):
+        if name == self.cprofile_stage:
+            self.cprofile_depth -= 1
+            if self.cprofile_depth == 0:
+                self.cprofile.disable()
+
+        if name not in self.stages:
+            self.stages[name] = [0., 0]
+            self.stage_order.append(name)
+        stage = self.stages[name]
+        stage[0] += elapsed
+        stage[1] += 1
+
+        for hook in self.hooks:
+            hook("stage", name, elapsed)
+
+    def count(self, name, increment=1):
+        if name not in self.counts:
+            self.counts[name] = 0
+            self.count_order.append(name)
+        self.counts[name] += increment
+
+        for hook in self.hooks:
+            hook("count", name, increment)
+
+    def get_results(self):
+        return {
+                "stages" : [{"name" : name, "time" : self.stages[name][0],
+                    "calls" : self.stages[name][1]}
+                    for name in self.stage_order],
+                "counts" : [{"name" : name, "count" : self.counts[name]}
+                    for name in self.count_order],
+            }
+
+    def report_text(self):
+        lines = ["{:<24} {:>12} {:>10}".format("Stage", "Time [s]", "Calls")]
+        for name in self.stage_order:
+            lines.append("{:<24} {:>12.6f} {:>10}".format(name,
+                *self.stages[name]))
+        lines.append("")
+        lines.append("{:<24} {:>12}".format("Count", "Value"))
+        for name in self.count_order:
+            lines.append("{:<24} {:>12}".format(name, self.counts[name]))
+        return "\n".join(lines)
+
+    def report_json(self):
+        import json
+        return json.dumps(self.get_results(), indent=2)
+
+    def report(self, format="text"):
+        if format == "json":
+            return self.report_json()
+        else:
+            return self.report_text()
+
+    def dump_cprofile(self, filename):
+        """
+            Write the cProfile statistics of `cprofile_stage` (if it was run)
+            to `filename`.
+
+            Returns True if statistics were written.
+        """
+        if self.cprofile is None:
+            return False
+        self.cprofile.dump_stats(filename)
+        return True
+
+
+class NullStage(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class NullProfiler(object):
+    """
+        Profiler doing nothing, used if no profiler is given.
+    """
+
+    null_stage = NullStage()
+
+    def stage(self, name):
+        return self.null_stage
+
+    def count(self, name, increment=1):
+        pass
+
+
+null_profiler = NullProfiler()
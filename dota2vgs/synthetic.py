@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright (c) 2013-2014 Oliver Breitwieser
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""
+    Generators for synthetic layouts and key binding files (for benchmarks
+    and tests).
+"""
+
+__all__ = ["make_layout", "make_shaped_layout", "make_cfg", "make_lst",
+        "layout_shapes"]
+
+import random
+import string
+
+# hotkeys available within groups (start and cancel hotkey excluded)
+group_hotkeys = [c for c in string.ascii_lowercase if c not in "vb"]\
+        + list(string.digits)
+
+# predefined layout shapes, see `make_layout` for the parameters
+layout_shapes = {
+        "wide" : {"depth" : 1, "width" : len(group_hotkeys) // 2,
+            "phrases" : len(group_hotkeys) // 2},
+        "deep" : {"depth" : 24, "width" : 1, "phrases" : 4},
+        "phrases" : {"depth" : 2, "width" : 8, "phrases" : 25},
+        "long_names" : {"depth" : 2, "width" : 6, "phrases" : 12,
+            "name_length" : 60},
+    }
+
+
+def get_name(prefix, idx, name_length):
+    name = "{}{}_".format(prefix, idx)
+    if len(name) < name_length:
+        name += (string.ascii_letters * (name_length // 52 + 1))[
+                :name_length - len(name)]
+    return name
+
+
+def make_layout(depth=2, width=4, phrases=4, name_length=8, menu=False):
+    """
+        Returns a layout (dict) in which every group down to `depth` has
+        `width` subgroups and `phrases` phrases.
+
+        Names are unique and padded to `name_length` characters. Hotkeys are
+        unique within each group, therefore `width` + `phrases` must not exceed
+        the number of available hotkeys.
+    """
+    if width + phrases > len(group_hotkeys):
+        raise ValueError("At most {} children per group are possible.".format(
+            len(group_hotkeys)))
+
+    counter = {"group" : 0, "phrase" : 0}
+
+    def make_group(level):
+        group = {}
+        hotkeys = iter(group_hotkeys)
+
+        group["phrases"] = []
+        for i in range(phrases):
+            counter["phrase"] += 1
+            group["phrases"].append({
+                "id" : counter["phrase"],
+                "name" : get_name("P", counter["phrase"], name_length),
+                "hotkey" : next(hotkeys),
+                })
+
+        if level < depth:
+            group["groups"] = []
+            for i in range(width):
+                counter["group"] += 1
+                subgroup = make_group(level + 1)
+                subgroup["name"] = get_name("G", counter["group"],
+                        name_length)
+                subgroup["hotkey"] = next(hotkeys)
+                group["groups"].append(subgroup)
+
+        return group
+
+    layout = make_group(0)
+    layout["hotkey"] = "v"
+    layout["hotkey_cancel"] = "b"
+    layout["indicate_vgs_mode_via_minimap"] = True
+    if menu:
+        layout["vgs_console_menu_enabled"] = True
+
+    return layout
+
+
+def make_shaped_layout(shape, **kwargs):
+    """
+        Returns a layout of one of the `layout_shapes`, `kwargs` override
+        the parameters of the shape.
+    """
+    params = dict(layout_shapes[shape])
+    params.update(kwargs)
+    return make_layout(**params)
+
+
+# keys that can be bound in cfg/lst files
+bindable_keys = list(string.ascii_lowercase) + list(string.digits)\
+        + ["F{}".format(i) for i in range(1, 13)]\
+        + ["TAB", "SPACE", "ENTER", "MOUSE4", "MOUSE5"]
+
+stateful_commands = ["+attack", "+showscores", "+dota_camera_follow",
+        "+voicerecord", "+sixense_left_click"]
+stateless_commands = ["dota_stop", "dota_hold", "dota_select_courier",
+        "say_team careful", "dota_learn_stats", "toggleshoppanel"]
+
+
+def make_cfg(num_lines=200, stateful_ratio=0.2, seed=0):
+    """
+        Returns the content of a cfg file with `num_lines` lines, most of
+        them binds. A fraction of `stateful_ratio` of the binds contains
+        stateful ("+") commands.
+    """
+    rnd = random.Random(seed)
+    lines = ["// synthetic cfg"]
+    while len(lines) < num_lines:
+        kind = rnd.random()
+        if kind < 0.1:
+            lines.append("cl_showfps {}".format(rnd.randint(0, 3)))
+        elif kind < 0.15:
+            lines.append("// comment {}".format(len(lines)))
+        else:
+            key = rnd.choice(bindable_keys)
+            if rnd.random() < stateful_ratio:
+                cmd = rnd.choice(stateful_commands)
+            else:
+                cmd = ";".join(rnd.sample(stateless_commands,
+                    rnd.randint(1, 3)))
+            lines.append("bind \"{}\" \"{}\"".format(key, cmd))
+    return "\n".join(lines) + "\n"
+
+
+def make_lst(num_keys=200, seed=0):
+    """
+        Returns the content of a lst file (Valve KeyValues) with `num_keys`
+        key bindings.
+    """
+    rnd = random.Random(seed)
+    lines = ["\"KeyBindings\"", "{", "\t\"Version\"\t\t\"2\"", "\t\"Keys\"",
+            "\t{"]
+    for i in range(num_keys):
+        entry = [("Name", "Binding{}".format(i)),
+                ("Key", rnd.choice(bindable_keys).upper())]
+        if i % 3 == 0:
+            entry.append(("Action", "dota_ability_execute {}".format(i % 6)))
+            entry.append(("Panel", "#DOTA_KEYBIND_MENU_ABILITIES"))
+            entry.append(("SubPanel", "#DOTA_KEYBIND_ABILITY_HERO"))
+        else:
+            entry.append(("Action", rnd.choice(stateless_commands)))
+        if i % 17 == 0:
+            entry.append(("Modifier", "CTRL"))
+
+        lines.append("\t\t\"Binding{}\"".format(i))
+        lines.append("\t\t{")
+        for k, v in entry:
+            lines.append("\t\t\t\"{}\"\t\t\"{}\"".format(k, v))
+        lines.append("\t\t}")
+    lines.extend(["\t}", "}"])
+    return "\n".join(lines) + "\n"
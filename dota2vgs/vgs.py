@@ -24,14 +24,20 @@
 __all__ = ["Composer"]
 
 from .logcfg import log
-from .cfg_parser import BindParser
+from .cfg_parser import BindParser, CfgLoader
 from .lst_parser import LST_Hotkey_Parser
-from .commands import Bind, Alias, StatefulAlias
+from .commands import ScriptCommand, Bind, Alias, StatefulAlias,\
+        CachedCommand, split_commands
 from .overlay import GroupWriter
-from .misc import load_data
-
+from .misc import load_layout, write_lines
+from .cache import fingerprint
+from .layout import LayoutIR
+from .profiling import null_profiler
+from .version import __version__
+
+import itertools
+import re
 import string
-import itertools as it
 
 class ParseError(Exception):
     pass
@@ -51,6 +57,9 @@ class Composer(object):
     prefix_current = "cur_"
     prefix_group = "grp_"
     prefix_phrase = "phr_"
+    # prefix of the console menu aliases shared by all groups, None to echo
+    # all lines in each group alias
+    menu_frame_prefix = "menu_"
 
     designator_groups = "groups"
     designator_cmds = "phrases"
@@ -61,27 +70,78 @@ class Composer(object):
 
     def __init__(self, cfg_files, lst_files, layout_file,
             output_file=None, ignore_keys=None, silent=False,
-            lineending="\r\n" # windows style by default
+            lineending="\r\n", # windows style by default
+            build_cache=None, differential=False, alias_dispatch=None,
+            parse_cache=None, follow_exec=False, cfg_loader=None,
+            profiler=None, layout_cache=None, symbol_table=None
             ):
         """
             `cfg_files` is a list of filenames from which to read the
             original configuration that is to be preserved.
 
-            `layout_file` yaml file with layout infomration of the VGS.
+            `layout_file` yaml file with layout infomration of the VGS. An
+            already loaded layout (dict) can be supplied instead.
+
+            `build_cache` is an optional `BuildCache` from which the aliases
+            of unchanged groups are taken instead of composing them anew. It
+            is updated but not saved.
+
+            `differential`: If True, group aliases only change the keys that
+            differ from the parent group and the restore alias only resets
+            keys that are changed at all.
+
+            `alias_dispatch` selects how aliases that are too long call their
+            helper aliases (see `Alias.dispatch_modes`).
+
+            `parse_cache` is an optional `ParseCache` used to skip parsing
+            cfg and lst files that did not change.
+
+            `follow_exec`: If True, files executed by the cfg files are read
+            as well (see `CfgLoader`). A `cfg_loader` can be supplied to share
+            parsed files between several Composers.
+
+            `profiler` is an optional `Profiler` recording the time spent in
+            the different stages.
+
+            `layout_cache` is an optional `LayoutCache` used to skip parsing
+            the layout file if it did not change.
+
+            `symbol_table` is an optional `SymbolTable` used to replace all
+            generated alias names by short symbols when writing the script.
+            All aliases are composed before anything is written then. The
+            table is updated but not saved.
         """
         self.silent = silent
         # aliases to be included in the final script
         self.aliases = {}
         self.LE = lineending
+        self.build_cache = build_cache
+        self.differential = differential
+        self.alias_dispatch = alias_dispatch
+        self.parse_cache = parse_cache
+        self.symbol_table = symbol_table
+        if profiler is None:
+            profiler = null_profiler
+        self.profiler = profiler
 
         # read existing binds
         self.existing_binds = {}
-        for cfg_file in cfg_files:
-            b = BindParser(cfg_file, silent=self.silent)
-            for k,v in b.get().items():
-                self.existing_binds[k.lower()] = v
-
-        self.layout = load_data(layout_file)
+        with self.profiler.stage("parse_cfg"):
+            if follow_exec or cfg_loader is not None:
+                if cfg_loader is None:
+                    cfg_loader = CfgLoader(parse_cache=self.parse_cache,
+                            silent=self.silent)
+                for k,v in cfg_loader.load(cfg_files).items():
+                    self.existing_binds[k.lower()] = v
+            else:
+                for cfg_file in cfg_files:
+                    for k,v in self.read_binds(cfg_file).items():
+                        self.existing_binds[k.lower()] = v
+
+        with self.profiler.stage("load_layout"):
+            self.layout = load_layout(layout_file, cache=layout_cache)
+        with self.profiler.stage("compile_layout"):
+            self.ir = LayoutIR(self.layout, root_name="start")
         self.check_layout_names()
         self._determine_used_keys()
         self.key_stateful = set([])
@@ -92,10 +152,10 @@ class Composer(object):
 
         # see if any of the used keys have a mapping in the lst file (dota 2
         # options)
-        for lst_file in lst_files:
-            h =  LST_Hotkey_Parser(lst_file, silent=self.silent)
-            mapping = h.get_hotkey_functions(self.used_keys)
-            self.existing_binds.update(mapping)
+        with self.profiler.stage("parse_lst"):
+            for lst_file in lst_files:
+                self.existing_binds.update(
+                        self.read_hotkey_functions(lst_file))
 
         # adjust the existing binding for the start hotkey only
         self.existing_binds[self.layout["hotkey"]] =\
@@ -109,17 +169,56 @@ class Composer(object):
         else:
             self.has_menu = False
 
-        self.layout["name"] = "start"
-        self.setup_aliases_group(self.layout)
-
-        self.additional_commands()
+        if self.build_cache is not None:
+            with self.profiler.stage("fingerprint"):
+                self.fingerprint_groups(self.get_build_context())
+        self.num_cached_groups = 0
+        self.num_built_groups = 0
+        # group and phrase aliases are either kept in `self.aliases` or
+        # written as soon as they are composed
+        self.aliases_composed = False
+        self.aliases_streamed = False
+
+        if self.symbol_table is not None:
+            # the most used names get the shortest symbols, so all of them
+            # have to be known before writing
+            self.compose_aliases()
+            with self.profiler.stage("mangle"):
+                self.symbol_table.assign(
+                        self.symbol_table.count(self.iter_texts()))
 
         if output_file is not None:
             self.write_script_file(output_file)
+        else:
+            self.compose_aliases()
 
         if not self.silent:
             log.info("Please go to the Dota 2 options menu and delete the "
-                    "bindings to the following keys: {}".format(self.used_keys))
+                    "bindings to the following keys: {}".format(
+                        ", ".join(sorted(self.used_keys))))
+
+    def read_binds(self, cfg_file):
+        parse = lambda: BindParser(cfg_file, silent=self.silent).get()
+
+        if self.parse_cache is None:
+            return parse()
+        else:
+            return self.parse_cache.get("binds", cfg_file, parse)
+
+    def read_hotkey_functions(self, lst_file):
+        """
+            Returns the functions of all used keys defined in `lst_file`.
+        """
+        if self.parse_cache is None:
+            h = LST_Hotkey_Parser(lst_file, silent=self.silent)
+            return h.get_hotkey_functions(self.used_keys)
+
+        # the cache holds the functions of all hotkeys
+        parse = lambda: LST_Hotkey_Parser(lst_file,
+                silent=self.silent).get_hotkey_functions(None)
+        mapping = self.parse_cache.get("hotkeys", lst_file, parse)
+        return dict((k, v) for k, v in mapping.items()
+                if k in self.used_keys)
 
     def setup_menu(self):
         writer_kwargs = {}
@@ -133,16 +232,91 @@ class Composer(object):
         add_if_exists("vgs_menu_notify_time", "notify_time")
         add_if_exists("vgs_menu_hotkeys_min_width", "hotkey_min_width")
 
+        # empty lines and footer can be shared by all groups
+        if self.menu_frame_prefix is not None:
+            writer_kwargs["frame_prefix"] = self.get_alias_name(
+                    self.menu_frame_prefix)
+
         self.console_writer = GroupWriter(**writer_kwargs)
         self.console_writer.add_stop_commands_to_alias(self.aliases["restore"])
         self.console_writer.set_footer(["",
             self.console_writer.format_hotkey(self.layout["hotkey_cancel"], "Cancel..")])
 
+        # only added to the script once used (see `add_menu_to_alias`)
+        self.frame_aliases = {}
+        # alias calls needed to execute each of them and their size shared
+        # among all groups that might use them
+        self.frame_calls = {}
+        self.frame_sizes = {}
+        cw = self.console_writer
+        filler_counts = cw.get_filler_counts(self.ir)
+        for name, commands in cw.get_frame_aliases(filler_counts):
+            alias = self.make_alias(name)
+            for cmd in commands:
+                alias.add(cmd)
+            text = alias.get()
+            if name == cw.get_frame_name("header"):
+                num_users = len(filler_counts)
+            else:
+                num_users = len([n for n in filler_counts
+                    if cw.get_tail_name(n) == name])
+            self.frame_aliases[name] = alias
+            self.frame_calls[name] = text.count(self.LE) + 1
+            self.frame_sizes[name] = float(len(text) + len(self.LE))\
+                    / num_users
+        if self.menu_frame_prefix is not None:
+            self.frame_regex = re.compile(r"(?<!\w){}\w+".format(
+                re.escape(self.console_writer.frame_prefix)))
+
+    def add_menu_to_alias(self, alias, idx):
+        """
+            Make `alias` display the console menu of group `idx`.
+
+            The shared frame aliases are only used if that does not make the
+            alias execute more commands, i.e. if the saved space also saves
+            helper aliases (see `ConsoleWriter.get_message_variants`).
+        """
+        cw = self.console_writer
+        best = None
+        for commands in cw.get_message_variants(
+                cw.get_group_messages(self.ir, idx)):
+            trial = type(alias)(alias.name, lineending=self.LE,
+                    dispatch=self.alias_dispatch)
+            for cmd in alias.content:
+                trial.add(cmd, escape_command=False)
+            for cmd in commands:
+                trial.add(cmd)
+            text = trial.get()
+
+            frames = [cmd for cmd in commands if cmd in self.frame_aliases]
+            # every helper alias is called once
+            cost = (text.count(self.LE)
+                    + sum(self.frame_calls[f] for f in frames),
+                    len(text) + sum(self.frame_sizes[f] for f in frames))
+            if best is None or cost < best[0]:
+                best = (cost, commands, frames)
+
+        for cmd in best[1]:
+            alias.add(cmd)
+        for name in best[2]:
+            self.use_frame_alias(name)
+
+    def use_frame_alias(self, name):
+        self.aliases[name] = self.frame_aliases[name]
+
     def add_alias(self, name, type_=Alias):
-        new_alias = type_(self.get_alias_name(name), lineending=self.LE)
+        new_alias = self.make_alias(name, type_=type_)
         self.aliases[name] = new_alias
         return new_alias
 
+    def make_alias(self, name, type_=Alias):
+        """
+            Like `add_alias` but the alias is not kept in `self.aliases`.
+        """
+        self.profiler.count("aliases_created")
+        return type_(self.get_alias_name(name), lineending=self.LE,
+                dispatch=self.alias_dispatch)
+
     def get_cmd_alias(self, a_from, a_to):
         return "alias {} {}".format(a_from, a_to)
 
@@ -191,32 +365,17 @@ class Composer(object):
         return key in self.key_stateful
 
     def _determine_used_keys(self):
-        # self.used_keys = set()
-
         # for now just add all ascii keys
         self.used_keys = set(string.lowercase)
 
-        self.used_keys.add(self.layout["hotkey"])
-        self.used_keys.add(self.layout["hotkey_cancel"])
-
-        queue = []
-        queue.extend(self.layout[self.designator_groups])
-
-        while len(queue) > 0:
-            item = queue.pop()
-
-            if "hotkey" in item:
-                self.used_keys.add(item["hotkey"])
-
-            for k in self.recursive_elements:
-                if k in item:
-                    queue.extend(item[k])
+        # all hotkeys of the layout (including start and cancel hotkey)
+        self.used_keys |= self.ir.all_hotkeys
 
     def _setup_aliases_existing_binds(self):
         """
             Sets up aliases containing the original key function.
         """
-        for k in self.used_keys & set(self.existing_binds.keys()):
+        for k in sorted(self.used_keys & set(self.existing_binds.keys())):
             existing_bind = self.existing_binds[k]
 
             alias_type = Alias
@@ -246,126 +405,460 @@ class Composer(object):
     def _setup_aliases_restore(self):
         """
             Sets up the alias resetting all used keys to their original state.
+
+            In differential mode only keys that are changed by the group
+            aliases are reset. The remaining keys are set once by an
+            additional init alias that is called when loading the script.
         """
         restore = self.add_alias("restore")
         self.restore_alias_name = restore.name
-        for k in self.used_keys:
-            restore.add("alias {current} {original}".format(
+        self.init_alias_name = restore.name
+
+        if self.differential:
+            keys_on, keys_off = self.get_touched_keys()
+        else:
+            keys_on = keys_off = self.used_keys
+
+        init_cmds = []
+        for k in sorted(self.used_keys):
+            cmd = "alias {current} {original}".format(
                 current=self.get_aname_current(k),
                 original=self.get_aname_original(k),
-                ))
+                )
+            if k in keys_on:
+                restore.add(cmd)
+            else:
+                init_cmds.append(cmd)
+
             if self.is_key_stateful(k):
-                restore.add("alias {current} {original}".format(
+                cmd = "alias {current} {original}".format(
                     current=self.get_aname_current(k, off_state=True),
                     original=self.get_aname_original(k, off_state=True),
-                    ))
+                    )
+                if k in keys_off:
+                    restore.add(cmd)
+                else:
+                    init_cmds.append(cmd)
+
+        if len(init_cmds) > 0:
+            init = self.add_alias("init")
+            for cmd in init_cmds:
+                init.add(cmd)
+            init.add(restore.name)
+            self.init_alias_name = init.name
+
+    def get_touched_keys(self):
+        """
+            Determine which keys are changed at all by the group aliases in
+            differential mode.
 
-    def setup_aliases_group(self, dct):
+            Returns the set of keys whose (on-state) alias is changed and the
+            set of keys whose off-state alias is cleared.
         """
-            Set up the starting alias.
+        ir = self.ir
+        cancel = self.layout["hotkey_cancel"]
+        hotkey = self.layout["hotkey"]
+
+        # every group sets the cancel hotkey, the start hotkey is left alone
+        # unless it is used within a group
+        keys_on = set(self.used_keys)
+        if hotkey != cancel and hotkey not in ir.key_nodes:
+            keys_on.discard(hotkey)
+
+        # the starting group clears everything it does not use itself, all
+        # other groups what their parent used
+        cleared = ~ir.masks[0]
+        for idx in ir.group_indices[1:]:
+            cleared |= ir.masks[ir.parents[idx]] & ~ir.masks[idx]
+        cleared &= ~(ir.get_bit(cancel) | ir.get_bit(hotkey))
+
+        # keys not present in the layout are always cleared by the start group
+        keys_off = set(k for k in self.used_keys
+                if ir.get_bit(k) == 0 or cleared & ir.get_bit(k))
+
+        return keys_on, keys_off
+
+    def iter_group_aliases(self, idx, path=()):
         """
-        self.assure_no_duplicate_hotkeys(dct)
+            Compose the aliases for group `idx` (in the layout IR) and all its
+            subgroups.
 
-        alias = self.add_alias(self.get_aname_group(dct["name"]))
-        alias.add(self.get_cmd_alias(
-            self.get_aname_current(self.layout["hotkey_cancel"]),
-            self.restore_alias_name))
+            The aliases are yielded one group at a time so that they can be
+            written (and forgotten) before the next group is composed. Only
+            the alias of the starting group is kept in `self.aliases` because
+            it is amended by `additional_commands`.
 
-        # clear all other keys to prevent accidentatl keypresses
-        clear_hotkeys = self.used_keys - set(self.get_concurrent_hotkeys(dct))
-        clear_hotkeys -= set([self.layout["hotkey_cancel"],
-            self.layout["hotkey"]])
+            `path` contains the names of all parent groups.
+        """
+        ir = self.ir
+        path = path + (ir.names[idx],)
+
+        # the starting group is amended by `additional_commands` and
+        # therefore never taken from the cache
+        if len(path) > 1 and self.build_cache is not None:
+            entry = self.build_cache.lookup(path, self.fingerprints[idx])
+            if entry is not None:
+                for cmd in self.iter_cached_aliases(path):
+                    yield cmd
+                return
+
+        self.assure_no_duplicate_hotkeys(idx)
+
+        parent = ir.parents[idx]
+        if parent < 0:
+            alias = self.add_alias(self.get_aname_group(ir.names[idx]))
+            commands = []
+        else:
+            alias = self.make_alias(self.get_aname_group(ir.names[idx]))
+            commands = [alias]
 
-        self.add_clear_aliases(alias, clear_hotkeys)
+        if self.differential and parent >= 0:
+            parent_bindings = self.get_group_bindings(parent)
+            self.add_transition_aliases(alias, idx, parent_bindings)
+        else:
+            parent_bindings = {}
+            alias.add(self.get_cmd_alias(
+                self.get_aname_current(self.layout["hotkey_cancel"]),
+                self.restore_alias_name))
+
+            # clear all other keys to prevent accidentatl keypresses
+            keep_mask = ir.masks[idx]\
+                    | ir.get_bit(self.layout["hotkey_cancel"])\
+                    | ir.get_bit(self.layout["hotkey"])
+            clear_hotkeys = [k for k in sorted(self.used_keys)
+                    if not keep_mask & ir.get_bit(k)]
+
+            self.add_clear_aliases(alias, clear_hotkeys)
+
+        for phrase in ir.phrases[idx]:
+            phrase_alias = self.setup_phrase(ir.names[phrase],
+                    ir.items[phrase]["id"])
+            commands.append(phrase_alias)
+
+            self.add_binding(alias, idx, ir.hotkeys[phrase],
+                    phrase_alias.name, parent_bindings)
 
-        for phrase in dct.get(self.designator_cmds, []):
-            phrase_name = self.setup_phrase(phrase["name"], phrase["id"])
-            hotkey_name = self.get_aname_current(phrase["hotkey"])
+        for group in ir.groups[idx]:
+            self.add_binding(alias, idx, ir.hotkeys[group],
+                    self.get_aname_group(ir.names[group]), parent_bindings)
 
-            alias.add(self.get_cmd_alias(hotkey_name, phrase_name))
+        # the menu of the starting group is added after `additional_commands`
+        if self.has_menu and parent >= 0:
+            self.add_menu_to_alias(alias, idx)
 
-        for group in dct.get(self.designator_groups, []):
-            self.setup_aliases_group(group)
+        self.num_built_groups += 1
+        self.profiler.count("groups_composed")
 
-            group_name = self.get_aname_group(group["name"])
-            hotkey_name = self.get_aname_current(group["hotkey"])
+        if len(path) > 1 and self.build_cache is not None:
+            commands = self.store_group_in_cache(idx, path, commands)
 
-            alias.add(self.get_cmd_alias(hotkey_name, group_name))
+        for cmd in commands:
+            yield cmd
+        del commands, alias
 
+        for group in ir.groups[idx]:
+            for cmd in self.iter_group_aliases(group, path):
+                yield cmd
+
+    def add_binding(self, alias, idx, hotkey, target, parent_bindings):
+        """
+            Make `hotkey` call `target` in group `idx` unless the parent group
+            already did so.
+        """
+        if parent_bindings.get(hotkey, None) == target\
+                and hotkey not in self.ir.duplicates.get(idx, []):
+            return
+
+        alias.add(self.get_cmd_alias(self.get_aname_current(hotkey), target))
+
+    def add_transition_aliases(self, alias, idx, parent_bindings):
+        """
+            Adds the alias changes needed to get from the state of the parent
+            group to the one of group `idx` (except for the bindings of group
+            `idx` itself).
+        """
+        ir = self.ir
+        cancel = self.layout["hotkey_cancel"]
+
+        # the parent might have used the cancel hotkey for something else
+        if cancel in parent_bindings:
+            alias.add(self.get_cmd_alias(self.get_aname_current(cancel),
+                self.restore_alias_name))
+
+        # everything else not used by the parent is already cleared
+        keep_mask = ir.masks[idx] | ir.get_bit(cancel)\
+                | ir.get_bit(self.layout["hotkey"])
+        clear_hotkeys = [k for k in ir.get_keys(
+                    ir.masks[ir.parents[idx]] & ~keep_mask)
+                if k in self.used_keys]
+
+        self.add_clear_aliases(alias, clear_hotkeys)
+
+    def get_group_bindings(self, idx):
+        """
+            Returns a dict mapping the hotkeys of group `idx` to the aliases
+            they call.
+        """
+        ir = self.ir
+        bindings = {}
+        for phrase in ir.phrases[idx]:
+            bindings[ir.hotkeys[phrase]] = self.get_aname_phrase(
+                    ir.names[phrase])
+        for group in ir.groups[idx]:
+            bindings[ir.hotkeys[group]] = self.get_aname_group(ir.names[group])
+        return bindings
+
+    def get_build_context(self):
+        """
+            Everything besides the group itself that influences the aliases
+            of a group.
+        """
         if self.has_menu:
-            self.console_writer.write_group_info_to_alias(dct, alias)
+            cw = self.console_writer
+            menu = (cw.lines_offset, cw.lines_area, cw.hk_min_width,
+                    cw.footer, cw.frame_prefix)
+        else:
+            menu = None
 
-    def assure_no_duplicate_hotkeys(self, dct):
-        hotkeys = self.get_concurrent_hotkeys(dct)
-        set_hotkeys = set(hotkeys)
+        return (__version__, self.LE, Alias.max_cmd_len, self.differential,
+                self.alias_dispatch, self.symbol_table is not None,
+                sorted(self.used_keys), sorted(self.key_stateful),
+                self.layout["hotkey"], self.layout["hotkey_cancel"],
+                self.restore_alias_name, menu)
 
-        if len(hotkeys) != len(set_hotkeys):
-            duplicate_hotkeys = self.duplicates.setdefault(dct["name"], [])
-            for k in set_hotkeys:
-                if hotkeys.count(k) > 1:
-                    duplicate_hotkeys.append(k)
-            log.warn("Group {} contains duplicate hotkeys for: {}".format(
-                dct["name"], ", ".join(duplicate_hotkeys)))
+    def fingerprint_groups(self, context):
+        """
+            Computes the fingerprints of all groups. The fingerprint of a
+            group covers its whole subtree.
+        """
+        ir = self.ir
+        self.fingerprints = {}
 
-    def get_concurrent_hotkeys(self, dct):
+        local_info = {}
+        for idx in ir.group_indices:
+            local_info[idx] = (ir.names[idx], ir.hotkeys[idx],
+                    [(ir.names[p], ir.items[p]["id"], ir.hotkeys[p])
+                        for p in ir.phrases[idx]],
+                    [(ir.names[g], ir.hotkeys[g]) for g in ir.groups[idx]])
+
+        # children come after their parents in the IR
+        for idx in reversed(ir.group_indices):
+            local = local_info[idx]
+            if self.differential and ir.parents[idx] >= 0:
+                # aliases depend on the state of the parent group
+                local = (local, local_info[ir.parents[idx]])
+
+            children = [self.fingerprints[g] for g in ir.groups[idx]]
+
+            self.fingerprints[idx] = fingerprint(context, local, children)
+
+    def iter_cached_aliases(self, path):
         """
-            Returns all hotkeys used by group.
+            Yields all aliases of the group at `path` (and its subgroups) from
+            the build cache.
+        """
+        for p, e in self.build_cache.iter_subtree(path):
+            for name, text in e["texts"]:
+                if self.has_menu and len(self.frame_aliases) > 0:
+                    for frame in self.frame_regex.findall(text):
+                        if frame in self.frame_aliases:
+                            self.use_frame_alias(frame)
+                yield CachedCommand(name, text)
+            if len(e["duplicates"]) > 0:
+                self.duplicates[p[-1]] = e["duplicates"]
+            self.num_cached_groups += 1
+            self.profiler.count("groups_cached")
+
+    def store_group_in_cache(self, idx, path, commands):
+        """
+            Store the freshly composed aliases of group `idx` in the build
+            cache.
 
-            NOTE: That it is a list and may have duplicates etc.
+            Returns the commands with their text already computed.
         """
-        hotkeys = []
+        ir = self.ir
+        if self.symbol_table is not None:
+            # aliases are only split up once their names are replaced
+            cached = [CachedCommand(cmd.name, ScriptCommand.get(cmd))
+                    for cmd in commands]
+        else:
+            cached = [CachedCommand(cmd.name, cmd.get()) for cmd in commands]
+        children = [path + (ir.names[g],) for g in ir.groups[idx]]
+
+        self.build_cache.store(path, self.fingerprints[idx],
+                [(cmd.name, cmd.get()) for cmd in cached], children,
+                self.duplicates.get(ir.names[idx], []))
+        return cached
+
+    def assure_no_duplicate_hotkeys(self, idx):
+        if idx in self.ir.duplicates:
+            name = self.ir.names[idx]
+            duplicate_hotkeys = self.duplicates.setdefault(name, [])
+            duplicate_hotkeys.extend(self.ir.duplicates[idx])
+            log.warn("Group {} contains duplicate hotkeys for: {}".format(
+                name, ", ".join(duplicate_hotkeys)))
 
-        for elem in self.recursive_elements:
-            for item in dct.get(elem, []):
-                hotkeys.append(item["hotkey"])
+    def get_concurrent_hotkeys(self, idx):
+        """
+            Returns all hotkeys used by group `idx`.
 
-        return hotkeys
+            NOTE: That it is a list and may have duplicates etc.
+        """
+        return self.ir.get_concurrent_hotkeys(idx)
 
     def setup_phrase(self, name, id):
         """
             Set up the alias with name `name` and id `id`.
 
-            Returns the name of the alias.
+            Returns the alias.
         """
-        alias = self.add_alias(self.get_aname_phrase(name))
+        alias = self.make_alias(self.get_aname_phrase(name))
         alias.add("chatwheel_say {}".format(id))
         alias.add(self.restore_alias_name)
-        return alias.name
+        return alias
+
+    def compose_aliases(self):
+        """
+            Compose all group and phrase aliases and keep them in
+            `self.aliases`.
+        """
+        if self.aliases_composed:
+            return
+        for cmd in self.iter_composed_aliases():
+            self.aliases[cmd.name] = cmd
+        self.finish_aliases()
+
+    def iter_composed_aliases(self):
+        """
+            `iter_group_aliases` for all groups, recording the time spent
+            composing.
+        """
+        groups = self.iter_group_aliases(0)
+        while True:
+            with self.profiler.stage("compose"):
+                cmd = next(groups, None)
+            if cmd is None:
+                break
+            yield cmd
+
+    def finish_aliases(self):
+        with self.profiler.stage("compose"):
+            self.additional_commands()
+            if self.has_menu:
+                self.add_menu_to_alias(
+                        self.aliases[self.get_aname_group("start")], 0)
+        self.aliases_composed = True
+
+        if self.build_cache is not None and not self.silent:
+            log.info("Reused {} of {} groups from build cache.".format(
+                self.num_cached_groups,
+                self.num_cached_groups + self.num_built_groups - 1))
+
+    def iter_aliases(self):
+        """
+            Yields all aliases of the script.
+
+            If the aliases have not been composed yet, group and phrase
+            aliases are yielded as soon as they are composed and not kept.
+        """
+        if not self.aliases_composed:
+            self.aliases_streamed = True
+            for cmd in self.iter_composed_aliases():
+                yield cmd
+            self.finish_aliases()
+        elif self.aliases_streamed:
+            raise ValueError("Aliases were already streamed and not kept.")
+
+        # sorted for a reproducible script
+        for name in sorted(self.aliases):
+            yield self.aliases[name]
+
+    def iter_lines(self):
+        """
+            Yields the lines of the script (including line endings).
+        """
+        for a in self.iter_aliases():
+            a = self.mangle_command(a)
+            with self.profiler.stage("alias_text"):
+                text = a.get()
+            self.profiler.count("aliases_written")
+            # helper aliases of long aliases (and off-state aliases)
+            self.profiler.count("extra_aliases_written", text.count(self.LE))
+            yield text + self.LE
+
+        for b in self.iter_bindings():
+            yield self.mangle_command(b).get() + self.LE
 
-    def write_script_file(self, f):
-        self.write_aliases(f)
-        self.write_bindings(f)
         if self.has_menu:
-            self.write_menu_prelude(f)
-        f.write(self.restore_alias_name + self.LE)
-        f.write("echo \"VGS successfully loaded!\"" + self.LE)
+            for cmd in self.console_writer.start_commands():
+                yield cmd + self.LE
 
-    def write_menu_prelude(self, f):
-        for cmd in self.console_writer.start_commands():
-            f.write(cmd + self.LE)
+        if self.symbol_table is not None:
+            yield self.symbol_table.get(self.init_alias_name) + self.LE
+        else:
+            yield self.init_alias_name + self.LE
+        yield "echo \"VGS successfully loaded!\"" + self.LE
 
-    def write_bindings(self, file):
-        for k in self.used_keys:
-            b = Bind(k)
-            b.add(self.get_aname_current(k))
-            file.write(b.get() + self.LE)
+    def write_script_file(self, f):
+        write_lines(f, self.iter_lines(), profiler=self.profiler)
 
-    def write_aliases(self, file):
-        for a in self.aliases.values():
-            file.write(a.get() + self.LE)
+    def iter_texts(self):
+        """
+            Yields the names and commands of all aliases and bindings.
+        """
+        for cmd in itertools.chain(self.iter_aliases(), self.iter_bindings()):
+            if isinstance(cmd, CachedCommand):
+                yield cmd.text
+            else:
+                yield cmd.key
+                for c in cmd.content:
+                    yield c
+        yield self.init_alias_name
+
+    def mangle_command(self, cmd):
+        """
+            Returns `cmd` with all alias names replaced by their symbols if a
+            symbol table is used.
+        """
+        symbols = self.symbol_table
+        if symbols is None:
+            return cmd
 
-    def check_layout_names(self, grp=None):
-        if grp is None:
-            grp = self.layout
+        with self.profiler.stage("mangle"):
+            if isinstance(cmd, CachedCommand):
+                cmd = self.get_cached_alias(cmd)
 
-        name = grp.get("name", "")
-        if any((l not in self.desired_letters for l in name)):
-            raise ParseError("Illegal character in {}.".format(name))
+            if isinstance(cmd, Alias):
+                mangled = type(cmd)(symbols.get(cmd.key), lineending=self.LE,
+                        dispatch=self.alias_dispatch)
+            else:
+                mangled = type(cmd)(cmd.key, lineending=self.LE)
+            for c in cmd.content:
+                mangled.add(symbols.rename(c), escape_command=False)
+        return mangled
+
+    def get_cached_alias(self, cmd):
+        """
+            Rebuild the alias from a cached command stored without being
+            split up (see `store_group_in_cache`).
+        """
+        head = Alias.template.format(key=cmd.key, function="")[:-1]
+        alias = Alias(cmd.key, lineending=self.LE,
+                dispatch=self.alias_dispatch)
+        for c in split_commands(cmd.text[len(head):-1], alias.separator):
+            alias.add(c, escape_command=False)
+        return alias
+
+    def iter_bindings(self):
+        for k in sorted(self.used_keys):
+            b = Bind(k)
+            b.add(self.get_aname_current(k))
+            yield b
 
-        for g in it.chain(
-                grp.get(self.designator_groups, []),
-                grp.get(self.designator_cmds, [])):
-            self.check_layout_names(g)
+    def check_layout_names(self):
+        for name in self.ir.names:
+            if any((l not in self.desired_letters for l in name)):
+                raise ParseError("Illegal character in {}.".format(name))
 
     def additional_commands(self):
         """
@@ -0,0 +1,419 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright (c) 2013-2014 Oliver Breitwieser
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""
+    Regenerate the outputs whenever one of the inputs changes.
+
+    Changes are detected with inotify where available (Linux), otherwise the
+    inputs are polled. Since editors often write a file several times when
+    saving, changes are collected until no further change happened for a
+    short while before rebuilding.
+
+    Parsed inputs are kept in memory between builds and only the outputs
+    depending on a changed input are regenerated.
+"""
+
+__all__ = ["Rebuilder", "InotifyWatcher", "PollingWatcher", "get_watcher",
+        "report_build", "run_watch"]
+
+import os
+import os.path as osp
+import select
+import struct
+import time
+
+from .logcfg import log
+from .misc import load_data, AtomicFile
+from .cache import MemoryParseCache
+from .cfg_parser import CfgLoader
+
+
+class PollingWatcher(object):
+    """
+        Detects changes by comparing size and modification time of all
+        watched files every `interval` seconds.
+    """
+
+    def __init__(self, paths, interval=0.1):
+        self.interval = interval
+        self.stats = {}
+        self.set_paths(paths)
+
+    def get_stat(self, path):
+        try:
+            stat = os.stat(path)
+        except EnvironmentError:
+            return None
+        return (stat.st_size, stat.st_mtime)
+
+    def set_paths(self, paths):
+        stats = {}
+        for path in paths:
+            path = osp.abspath(path)
+            if path in self.stats:
+                stats[path] = self.stats[path]
+            else:
+                stats[path] = self.get_stat(path)
+        self.stats = stats
+
+    def poll(self):
+        changed = set()
+        for path, stat in self.stats.items():
+            new_stat = self.get_stat(path)
+            if new_stat != stat:
+                self.stats[path] = new_stat
+                changed.add(path)
+        return changed
+
+    def wait(self, timeout=None):
+        """
+            Returns the paths that changed within `timeout` seconds (waits
+            for a change if None).
+        """
+        t_end = None if timeout is None else time.time() + timeout
+        while True:
+            changed = self.poll()
+            if len(changed) > 0:
+                return changed
+            if t_end is not None and time.time() >= t_end:
+                return changed
+            if t_end is None:
+                time.sleep(self.interval)
+            else:
+                time.sleep(max(0., min(self.interval, t_end - time.time())))
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher(object):
+    """
+        Detects changes with inotify.
+
+        The directories containing the files are watched (instead of the
+        files themselves) so that files replaced by editors are noticed as
+        well.
+    """
+
+    IN_MODIFY = 0x2
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_CLOEXEC = 0o2000000
+
+    mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+    event_header = struct.Struct("iIII")
+
+    def __init__(self, paths, libc):
+        self.libc = libc
+        self.fd = self.libc.inotify_init1(self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError("inotify_init1 failed")
+        # watch descriptor -> directory
+        self.directories = {}
+        self.paths = set()
+        self.set_paths(paths)
+
+    def set_paths(self, paths):
+        self.paths = set(osp.abspath(p) for p in paths)
+        watched = set(self.directories.values())
+        for directory in set(osp.dirname(p) for p in self.paths) - watched:
+            wd = self.libc.inotify_add_watch(self.fd,
+                    directory.encode("utf-8"), self.mask)
+            if wd < 0:
+                log.warn("Could not watch {}.".format(directory))
+                continue
+            self.directories[wd] = directory
+
+    def read_events(self):
+        changed = set()
+        data = os.read(self.fd, 1 << 16)
+        pos = 0
+        while pos + self.event_header.size <= len(data):
+            wd, mask, cookie, length = self.event_header.unpack_from(data, pos)
+            pos += self.event_header.size
+            name = data[pos:pos + length].rstrip(b"\0").decode("utf-8")
+            pos += length
+
+            if wd in self.directories:
+                path = osp.join(self.directories[wd], name)
+                if path in self.paths:
+                    changed.add(path)
+        return changed
+
+    def wait(self, timeout=None):
+        """
+            Returns the paths that changed within `timeout` seconds (waits
+            for a change if None).
+        """
+        t_end = None if timeout is None else time.time() + timeout
+        while True:
+            if t_end is None:
+                remaining = None
+            else:
+                remaining = max(0., t_end - time.time())
+            ready = select.select([self.fd], [], [], remaining)[0]
+            if len(ready) == 0:
+                return set()
+            changed = self.read_events()
+            # other files in the same directories are ignored
+            if len(changed) > 0:
+                return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+def get_libc_inotify():
+    """
+        Returns libc if it supports inotify, None otherwise.
+    """
+    try:
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6",
+                use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+    except (ImportError, OSError, AttributeError):
+        return None
+    return libc
+
+
+def get_watcher(paths, polling=False):
+    """
+        Returns an `InotifyWatcher` if possible (and `polling` is False),
+        a `PollingWatcher` otherwise.
+    """
+    if not polling:
+        libc = get_libc_inotify()
+        if libc is not None:
+            try:
+                return InotifyWatcher(paths, libc)
+            except OSError as e:
+                log.warn("Could not use inotify: {}".format(e))
+    return PollingWatcher(paths)
+
+
+def wait_for_changes(watcher, debounce):
+    """
+        Wait for a change and collect further changes until there were none
+        for `debounce` seconds.
+
+        Returns the changed paths and the time the first change was noticed.
+    """
+    changed = set()
+    while len(changed) == 0:
+        changed = watcher.wait()
+    t_detected = time.time()
+
+    while True:
+        more = watcher.wait(debounce)
+        if len(more) == 0:
+            return changed, t_detected
+        changed |= more
+
+
+class Rebuilder(object):
+    """
+        Builds all outputs from a single parse of the inputs and rebuilds
+        the affected ones after changes.
+
+        `outputs` maps the targets "vgs", "sheet" and "overlay" to the
+        filenames they are written to (targets that are missing are not
+        built). `composer_kwargs` are passed on to the `Composer`.
+    """
+
+    targets = ["vgs", "sheet", "overlay"]
+
+    def __init__(self, cfg_files, lst_files, layout_file, outputs,
+            follow_exec=False, composer_kwargs=None):
+        self.cfg_files = [osp.abspath(fn) for fn in cfg_files]
+        self.lst_files = [osp.abspath(fn) for fn in lst_files]
+        self.layout_file = osp.abspath(layout_file)
+        self.outputs = outputs
+        if composer_kwargs is None:
+            composer_kwargs = {}
+        self.composer_kwargs = composer_kwargs
+
+        self.parse_cache = MemoryParseCache()
+        if follow_exec:
+            self.cfg_loader = CfgLoader(parse_cache=self.parse_cache,
+                    silent=True)
+        else:
+            self.cfg_loader = None
+        self.layout = None
+
+    def get_inputs(self):
+        """
+            All files the outputs depend on (including the files executed by
+            the cfg files if they are followed).
+        """
+        inputs = set([self.layout_file])
+        if "vgs" in self.outputs:
+            inputs.update(self.cfg_files)
+            inputs.update(self.lst_files)
+            if self.cfg_loader is not None:
+                inputs.update(self.cfg_loader.commands)
+        return inputs
+
+    def invalidate(self, paths):
+        """
+            Forget everything parsed from `paths`.
+
+            Returns the targets depending on them.
+        """
+        targets = set()
+        for path in paths:
+            if path == self.layout_file:
+                self.layout = None
+                targets.update(self.outputs)
+            else:
+                self.parse_cache.invalidate(path)
+                if self.cfg_loader is not None:
+                    self.cfg_loader.commands.pop(path, None)
+                targets.add("vgs")
+        return [t for t in self.targets if t in targets and t in self.outputs]
+
+    def get_layout(self):
+        if self.layout is None:
+            with open(self.layout_file, "r") as f:
+                self.layout = load_data(f)
+        return self.layout
+
+    def build(self, targets=None, threads=1):
+        """
+            Build `targets` (all by default), using up to `threads` threads.
+
+            Returns a list of (target, duration, error)-tuples. Errors (e.g.
+            in a layout that is still being edited) are logged instead of
+            raised.
+        """
+        if targets is None:
+            targets = [t for t in self.targets if t in self.outputs]
+
+        if threads <= 1 or len(targets) <= 1:
+            return [self.build_target(t) for t in targets]
+
+        # the layout is parsed once before the writers share it
+        try:
+            self.get_layout()
+        except Exception:
+            # reported by every target
+            pass
+
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(min(threads, len(targets)))
+        try:
+            return pool.map(self.build_target, targets)
+        finally:
+            pool.close()
+            pool.join()
+
+    def build_target(self, target):
+        t_start = time.time()
+        error = None
+        try:
+            getattr(self, "build_" + target)(self.outputs[target])
+        except Exception as e:
+            error = e
+            log.error("Could not build {}: {}".format(target, e))
+        return (target, time.time() - t_start, error)
+
+    def build_vgs(self, filename):
+        from .vgs import Composer
+
+        layout = self.get_layout()
+        cfg_files = [open(fn, "r") for fn in self.cfg_files]
+        lst_files = [open(fn, "r") for fn in self.lst_files]
+        try:
+            with AtomicFile(filename) as output_file:
+                Composer(
+                    cfg_files=cfg_files,
+                    lst_files=lst_files,
+                    layout_file=layout,
+                    output_file=output_file,
+                    silent=True,
+                    parse_cache=self.parse_cache,
+                    cfg_loader=self.cfg_loader,
+                    **self.composer_kwargs)
+        finally:
+            for f in cfg_files + lst_files:
+                f.close()
+
+    def build_sheet(self, filename):
+        from .format import SheetMaker
+
+        with AtomicFile(filename) as sheet_file:
+            SheetMaker(self.get_layout(), sheet_file)
+
+    def build_overlay(self, filename):
+        from .overlay import AutohotkeyWriter
+
+        # the writer adds its settings to the layout, which is shared with
+        # the other writers
+        layout = dict(self.get_layout())
+        layout["overlay"] = dict(layout.get("overlay", {}))
+
+        writer = AutohotkeyWriter()
+        writer.set_layout(layout)
+        with AtomicFile(filename) as overlay_file:
+            writer.write(overlay_file)
+
+
+def report_build(results, t_detected=None):
+    parts = ["{} ({:.1f} ms{})".format(target, duration * 1000.,
+        ", failed" if error is not None else "")
+        for target, duration, error in results]
+    msg = "Built {}".format(", ".join(parts))
+    if t_detected is not None:
+        msg += ", {:.1f} ms after the change was noticed".format(
+                (time.time() - t_detected) * 1000.)
+    log.info(msg + ".")
+
+
+def run_watch(rebuilder, polling=False, debounce=0.05):
+    """
+        Build everything once and then rebuild whenever inputs change (until
+        interrupted).
+    """
+    report_build(rebuilder.build())
+
+    watcher = get_watcher(rebuilder.get_inputs(), polling=polling)
+    log.info("Watching {} files for changes ({}).".format(
+        len(rebuilder.get_inputs()), watcher.__class__.__name__))
+    try:
+        while True:
+            changed, t_detected = wait_for_changes(watcher, debounce)
+            log.info("Changed: {}".format(", ".join(
+                osp.basename(p) for p in sorted(changed))))
+            targets = rebuilder.invalidate(changed)
+            report_build(rebuilder.build(targets), t_detected)
+            # executed files might have changed
+            watcher.set_paths(rebuilder.get_inputs())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
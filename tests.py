@@ -23,11 +23,112 @@
 
 from __future__ import print_function
 
+import os
+import os.path as osp
+import shutil
+import subprocess
+import sys
+import tempfile
 import unittest
 import dota2vgs
 
 from pprint import pprint
 
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+
+example_cfg = """
+bind "a" "+attack"
+bind "s" "dota_stop"
+bind "TAB" "+showscores"
+"""
+
+example_lst = """
+"KeyBindings"
+{
+    "Keys"
+    {
+        "Ability1"
+        {
+            "Name"      "Ability1"
+            "Key"       "Q"
+            "Action"    "dota_ability_execute 0"
+            "Panel"     "#DOTA_KEYBIND_MENU_ABILITIES"
+            "SubPanel"  "#DOTA_KEYBIND_ABILITY_HERO"
+        }
+    }
+}
+"""
+
+example_layout = """
+hotkey: v
+hotkey_cancel: b
+groups:
+  - name: Quick
+    hotkey: q
+    phrases:
+      - {id: 1, name: Care, hotkey: c}
+      - {id: 2, name: Get_Back, hotkey: b}
+  - name: Team
+    hotkey: t
+    groups:
+      - name: Lanes
+        hotkey: l
+        phrases:
+          - {id: 3, name: Missing_Top, hotkey: t}
+"""
+
+
+def compose(layout=example_layout, **kwargs):
+    """
+        Compose the example configuration and return the Composer as well as
+        the written script.
+    """
+    output = StringIO()
+    kwargs.setdefault("silent", True)
+    composer_class = kwargs.pop("composer_class", dota2vgs.Composer)
+    comp = composer_class([StringIO(example_cfg)], [StringIO(example_lst)],
+            StringIO(layout), output_file=output, **kwargs)
+    return comp, output.getvalue()
+
+
+def run_cli(argv, files=None):
+    """
+        Run the command line interface with `argv` in a temporary directory
+        containing the example files (and `files`, a dict of filenames and
+        contents).
+
+        Returns the exit code and everything written to stderr.
+    """
+    tmpdir = tempfile.mkdtemp()
+    try:
+        contents = {"config.cfg" : example_cfg,
+                "dotakeys_personal.lst" : example_lst,
+                "layout.yaml" : example_layout}
+        contents.update(files or {})
+        for fn, content in contents.items():
+            with open(osp.join(tmpdir, fn), "w") as f:
+                f.write(content)
+
+        code = "\n".join([
+            "import sys",
+            "sys.argv = {!r}",
+            "from dota2vgs.main import main_loop",
+            "main_loop()",
+            ]).format([osp.join(osp.dirname(osp.abspath(__file__)), "d2vgs")]
+                + argv)
+        env = dict(os.environ)
+        env["PYTHONPATH"] = osp.dirname(osp.abspath(__file__))
+        process = subprocess.Popen([sys.executable, "-c", code], cwd=tmpdir,
+                env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdout, stderr = process.communicate()
+    finally:
+        shutil.rmtree(tmpdir)
+    return process.returncode, stderr.decode("utf-8")
+
 
 class TestRestoreAlias(unittest.TestCase):
 
@@ -44,6 +145,891 @@ class TestRestoreAlias(unittest.TestCase):
             print(v.get())
 
 
+class TestLayoutIR(unittest.TestCase):
+
+    def test_structure(self):
+        layout = dota2vgs.misc.load_data(example_layout)
+        layout["groups"][0]["phrases"].append(
+                {"id": 4, "name": "Again", "hotkey": "c"})
+        ir = dota2vgs.LayoutIR(layout, root_name="start")
+
+        self.assertEqual([ir.names[i] for i in ir.group_indices],
+                ["start", "Quick", "Team", "Lanes"])
+        for idx in range(1, len(ir)):
+            self.assertTrue(ir.parents[idx] < idx)
+
+        quick = ir.group_indices[1]
+        self.assertEqual(sorted(ir.get_keys(ir.masks[quick])), ["b", "c"])
+        self.assertEqual(ir.duplicates, {quick: ["c"]})
+        self.assertEqual([ir.names[i] for i in ir.phrases_by_name[quick]],
+                ["Again", "Care", "Get_Back"])
+        self.assertEqual(ir.all_hotkeys, set("vbqtcl"))
+
+
+class TestBuildCache(unittest.TestCase):
+
+    def test_unchanged_groups_are_reused(self):
+        from dota2vgs.cache import BuildCache
+
+        cache = BuildCache()
+        comp, first = compose(build_cache=cache)
+        self.assertEqual(comp.num_cached_groups, 0)
+
+        cache.entries, cache.updated = cache.updated, {}
+        comp, second = compose(build_cache=cache)
+        self.assertEqual(comp.num_cached_groups, 3)
+        self.assertEqual(sorted(first.splitlines()),
+                sorted(second.splitlines()))
+
+        cache.entries, cache.updated = cache.updated, {}
+        comp, third = compose(example_layout.replace("Care", "Caution"),
+                build_cache=cache)
+        # only Quick changed
+        self.assertEqual(comp.num_cached_groups, 2)
+        self.assertIn("chatwheel_say 1", third)
+        self.assertIn("vgs_phr_Caution", third)
+
+
+class TestDifferential(unittest.TestCase):
+
+    def test_transitions(self):
+        full = compose()[1]
+        comp, diff = compose(differential=True)
+
+        self.assertTrue(len(diff) < len(full))
+
+        lanes = [l for l in diff.splitlines()
+                if l.startswith('alias "vgs_grp_Lanes"')][0]
+        # Team only bound l, everything else is cleared already
+        self.assertEqual(lanes, 'alias "vgs_grp_Lanes" '
+                '"alias vgs_cur_l;alias vgs_cur_t vgs_phr_Missing_Top"')
+
+        # start hotkey is never changed -> only set once on load
+        self.assertNotIn("vgs_cur_v", comp.aliases["restore"].get())
+        self.assertIn("vgs_init", diff.splitlines()[-2])
+
+
+class TestStreaming(unittest.TestCase):
+
+    def test_streaming(self):
+        comp, streamed = compose()
+        # group and phrase aliases are not kept when streaming
+        self.assertNotIn("vgs_grp_Team", comp.aliases)
+        self.assertRaises(ValueError, comp.write_script_file, StringIO())
+
+        comp = dota2vgs.Composer([StringIO(example_cfg)],
+                [StringIO(example_lst)], StringIO(example_layout), silent=True)
+        self.assertIn("vgs_grp_Team", comp.aliases)
+        output = StringIO()
+        comp.write_script_file(output)
+        self.assertEqual(sorted(streamed.splitlines()),
+                sorted(output.getvalue().splitlines()))
+
+    def test_first_lines(self):
+        comp = dota2vgs.Composer([StringIO(example_cfg)],
+                [StringIO(example_lst)], StringIO(example_layout), silent=True)
+        comp.aliases_composed = False
+        comp.num_built_groups = 0
+        lines = comp.iter_lines()
+        next(lines)
+        # only the starting group and its first subgroup have been composed
+        self.assertEqual(comp.num_built_groups, 2)
+
+
+class TestConsoleMenu(unittest.TestCase):
+
+    def expand(self, aliases, name):
+        commands = []
+        for cmd in aliases[name].split(";"):
+            if cmd in aliases:
+                commands.extend(self.expand(aliases, cmd))
+            else:
+                commands.append(cmd)
+        return commands
+
+    menu_layout = "vgs_console_menu_enabled: True\n"\
+            "vgs_menu_lines_offset: 3\nvgs_menu_show_lines: 32\n"\
+            + example_layout
+
+    class InlineComposer(dota2vgs.Composer):
+        menu_frame_prefix = None
+
+    def get_aliases(self, script):
+        aliases = {}
+        for line in script.splitlines():
+            if line.startswith("alias "):
+                name, body = line.split(" ", 2)[1:]
+                aliases[name[1:-1]] = body[1:-1]
+        return aliases
+
+    def replay(self, script, keys):
+        console = dota2vgs.Console()
+        console.load(StringIO(script))
+        return console.replay(keys)
+
+    def test_shared_frame(self):
+        script = compose(self.menu_layout)[1]
+        aliases = self.get_aliases(script)
+
+        self.assertEqual(aliases["vgs_menu_tail_26"], ";".join(
+            ['echo "| "', 'echo "| b -> Cancel.."'] + ['echo "| "'] * 26))
+        self.assertTrue(aliases["vgs_grp_Quick_b"].endswith(
+            ";vgs_menu_tail_26"))
+        echos = [c for c in self.expand(aliases, "vgs_grp_Quick")
+                if c.startswith("echo")]
+        self.assertEqual(len(echos), 3 + 32)
+        self.assertEqual(echos[3:7], ['echo "| Available Phrases:"',
+            'echo "| {}"'.format("=" * 18), 'echo "| c -> Care"',
+            'echo "| b -> Get Back"'])
+        self.assertEqual(echos[7:], ['echo "| "', 'echo "| b -> Cancel.."']
+                + ['echo "| "'] * 26)
+
+    def test_commands_per_keypress(self):
+        framed = compose(self.menu_layout)[1]
+        inline = compose(self.menu_layout,
+                composer_class=self.InlineComposer)[1]
+        self.assertTrue(len(framed) < len(inline))
+        self.assertNotIn("vgs_menu_", inline)
+
+        for keys in (["v"], ["v", "q"], ["v", "q", "c"]):
+            framed_presses = self.replay(framed, keys)
+            inline_presses = self.replay(inline, keys)
+            for f, i in zip(framed_presses, inline_presses):
+                self.assertEqual(f.echoed, i.echoed)
+                self.assertTrue(f.commands <= i.commands)
+
+
+class TestOverlay(unittest.TestCase):
+
+    def write(self, **kwargs):
+        writer = dota2vgs.AutohotkeyWriter(**kwargs)
+        writer.set_layout_from_file(StringIO(example_layout))
+        output = StringIO()
+        writer.write(output, newline="\n")
+        return output.getvalue().splitlines()
+
+    def test_dispatch_table(self):
+        classic = self.write()
+        table = self.write(dispatch_table=True)
+
+        rebinds = [l for l in table if l.startswith("Hotkey")]
+        # all layout hotkeys + reset + toggle
+        self.assertEqual(len(rebinds), 6 + 2)
+        self.assertTrue(len(rebinds) < len([l for l in classic
+            if l.startswith("Hotkey")]))
+
+        self.assertIn('vgs_groups["Group_Quick"] := {"b": "ResetHotkeys", '
+                '"c": "ResetHotkeys"}', table)
+        self.assertIn('vgs_groups["Group_Team"] := {"b": "ResetHotkeys", '
+                '"l": "Group_Lanes"}', table)
+        self.assertIn('vgs_state := "Group_Lanes"', table)
+
+    def test_streaming(self):
+        for kwargs in [{}, {"dispatch_table" : True}]:
+            writer = dota2vgs.AutohotkeyWriter(**kwargs)
+            writer.set_layout_from_file(StringIO(example_layout))
+            writer.generate_code()
+
+            output = StringIO()
+            writer.write(output)
+            self.assertEqual(output.getvalue(), "\r\n".join(writer.code))
+
+            output = StringIO()
+            writer.write(output, newline="\n")
+            self.assertEqual(output.getvalue(), "\n".join(writer.code))
+
+
+class TestSheet(unittest.TestCase):
+
+    def test_formats(self):
+        text = StringIO()
+        dota2vgs.SheetMaker(StringIO(example_layout), text)
+        outputs = dict((name, StringIO())
+                for name in dota2vgs.format.sheet_formats)
+        dota2vgs.SheetMaker(StringIO(example_layout), None, outputs=outputs)
+
+        self.assertEqual(outputs["text"].getvalue(), text.getvalue())
+        self.assertIn("v -> t -> l -> t Missing_Top\r\n", text.getvalue())
+        self.assertIn("### Lanes (`v -> t -> l`)",
+                outputs["markdown"].getvalue())
+        self.assertIn("v -> t -> l -> t,t,Lanes,Missing_Top,3\r\n",
+                outputs["csv"].getvalue())
+
+        html = outputs["html"].getvalue()
+        self.assertEqual(html.count("<tr class=\"phrase\">"), 3)
+        self.assertIn('"missing":[2]', html)
+        self.assertIn('"quick":[0,1]', html)
+
+
+class TestBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        for fn, content in [("autoexec.cfg", example_cfg),
+                ("dotakeys_personal.lst", example_lst),
+                ("layout.yaml", example_layout)]:
+            with open(osp.join(self.tmpdir, fn), "w") as f:
+                f.write(content)
+
+        jobs = ["jobs:"]
+        for name in ["one", "two", "three"]:
+            jobs.append("  - {{name: {0}, cfg: autoexec.cfg, "
+                    "lst: dotakeys_personal.lst, layout: layout.yaml, "
+                    "output: {0}.cfg}}".format(name))
+        jobs.append("  - {name: broken, cfg: missing.cfg, "
+                "layout: layout.yaml, output: broken.cfg}")
+        self.manifest = osp.join(self.tmpdir, "manifest.yaml")
+        with open(self.manifest, "w") as f:
+            f.write("\n".join(jobs))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_batch(self):
+        jobs = dota2vgs.load_manifest(self.manifest)
+        for processes in [1, 2]:
+            results = dota2vgs.run_batch(jobs, processes=processes)
+            self.assertEqual([r.name for r in results],
+                    ["one", "two", "three", "broken"])
+            self.assertEqual([r.success for r in results],
+                    [True, True, True, False])
+            self.assertIn("missing.cfg", results[-1].error)
+
+        with open(osp.join(self.tmpdir, "two.cfg")) as f:
+            self.assertEqual(f.read(), compose()[1])
+
+    def test_missing_layout(self):
+        jobs = dota2vgs.load_manifest(self.manifest)[:2]
+        jobs[0].layout_file = osp.join(self.tmpdir, "missing.yaml")
+        for processes in [1, 2]:
+            results = dota2vgs.run_batch(jobs, processes=processes)
+            self.assertEqual([r.success for r in results], [False, True])
+            self.assertIn("missing.yaml", results[0].error)
+
+
+class TestParseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cfg = osp.join(self.tmpdir, "config.cfg")
+        self.lst = osp.join(self.tmpdir, "dotakeys_personal.lst")
+        for fn, content in [(self.cfg, example_cfg), (self.lst, example_lst)]:
+            with open(fn, "w") as f:
+                f.write(content)
+        self.cache = dota2vgs.ParseCache(osp.join(self.tmpdir, "cache"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def compose(self):
+        output = StringIO()
+        with open(self.cfg) as cfg, open(self.lst) as lst:
+            dota2vgs.Composer([cfg], [lst], StringIO(example_layout),
+                    output_file=output, silent=True, parse_cache=self.cache)
+        return output.getvalue()
+
+    def test_cache(self):
+        self.assertEqual(self.compose(), compose()[1])
+        self.assertEqual((self.cache.hits, self.cache.misses), (0, 2))
+
+        self.assertEqual(self.compose(), compose()[1])
+        self.assertEqual((self.cache.hits, self.cache.misses), (2, 2))
+
+        # same content -> still a hit
+        os.utime(self.cfg, (0, 0))
+        self.compose()
+        self.assertEqual((self.cache.hits, self.cache.misses), (4, 2))
+
+        with open(self.cfg, "a") as f:
+            f.write('bind "d" "say_team hello"\n')
+        self.assertIn("say_team hello", self.compose())
+        self.assertEqual((self.cache.hits, self.cache.misses), (5, 3))
+
+    def test_eviction(self):
+        self.cache.max_size = 1
+        self.compose()
+        self.assertEqual(os.listdir(self.cache.directory), [])
+
+
+class TestLayoutCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.layout = osp.join(self.tmpdir, "layout.yaml")
+        with open(self.layout, "w") as f:
+            f.write(example_layout)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_directory(self):
+        cache = dota2vgs.LayoutCache(osp.join(self.tmpdir, "cache"))
+        expected = dota2vgs.load_data(example_layout)
+
+        self.assertEqual(cache.load(StringIO(example_layout)), expected)
+        self.assertEqual(cache.load(StringIO(example_layout)), expected)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        # keyed by content
+        changed = example_layout.replace("hotkey_cancel: ",
+                "name: other\nhotkey_cancel: ")
+        self.assertEqual(cache.load(changed)["name"], "other")
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+        output = StringIO()
+        dota2vgs.Composer([StringIO(example_cfg)], [StringIO(example_lst)],
+                StringIO(example_layout), output_file=output, silent=True,
+                layout_cache=cache)
+        self.assertEqual(output.getvalue(), compose()[1])
+        self.assertEqual((cache.hits, cache.misses), (2, 2))
+
+    def test_next_to_source(self):
+        cache = dota2vgs.LayoutCache()
+        for i in range(2):
+            with open(self.layout) as f:
+                cache.load(f)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertTrue(osp.isfile(osp.join(self.tmpdir, ".layout.yaml.cache")))
+
+        # nowhere to put the entry
+        cache.load(StringIO(example_layout))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+
+class TestAtomicFile(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = osp.join(self.tmpdir, "vgs.cfg")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, content):
+        with dota2vgs.AtomicFile(self.filename) as f:
+            f.write(content)
+        return f
+
+    def test_unchanged(self):
+        self.assertTrue(self.write(compose()[1]).changed)
+        stat = os.stat(self.filename)
+
+        self.assertFalse(self.write(compose()[1]).changed)
+        self.assertEqual(os.stat(self.filename).st_ino, stat.st_ino)
+        self.assertEqual(os.stat(self.filename).st_mtime, stat.st_mtime)
+
+        self.assertTrue(self.write("echo changed").changed)
+        with open(self.filename) as f:
+            self.assertEqual(f.read(), "echo changed")
+        self.assertEqual(os.listdir(self.tmpdir), ["vgs.cfg"])
+
+    def test_exception(self):
+        self.write("echo original")
+        try:
+            with dota2vgs.AtomicFile(self.filename) as f:
+                f.write("echo partial")
+                raise ValueError()
+        except ValueError:
+            pass
+        with open(self.filename) as f:
+            self.assertEqual(f.read(), "echo original")
+        self.assertEqual(os.listdir(self.tmpdir), ["vgs.cfg"])
+
+
+class TestMangle(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = osp.join(self.tmpdir, "vgs.symbols")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_symbols(self):
+        self.assertEqual([dota2vgs.SymbolTable.get_symbol(i)
+            for i in (0, 35, 36, 37)], ["va", "v9", "vaa", "vab"])
+
+        table = dota2vgs.SymbolTable(self.filename)
+        comp, script = compose(symbol_table=table)
+        plain = compose()[1]
+
+        self.assertNotIn("vgs_", script)
+        self.assertLess(len(script), len(plain) * 0.6)
+        # no helper aliases needed anymore
+        self.assertLess(script.count("\n"), plain.count("\n"))
+        # the most referenced name gets the shortest symbol
+        self.assertEqual(table.get("vgs_cur_a"), "va")
+        self.assertIn("bind \"a\" \"+va\"", script)
+        self.assertEqual(table.rename("alias +vgs_cur_a vgs_restore"),
+                "alias +va vb")
+
+        map_file = StringIO()
+        table.write_map(map_file)
+        self.assertEqual(map_file.getvalue().split("\n")[0].split(),
+                ["va", "vgs_cur_a", "11"])
+
+    def test_stable(self):
+        table = dota2vgs.SymbolTable(self.filename)
+        script = compose(symbol_table=table)[1]
+        table.save()
+
+        table = dota2vgs.SymbolTable(self.filename)
+        self.assertEqual(compose(symbol_table=table)[1], script)
+
+        # new names do not change existing symbols
+        layout = example_layout + """      - name: Mid
+        hotkey: m
+        phrases:
+          - {id: 4, name: Missing_Mid, hotkey: m}
+"""
+        symbols = dict(table.symbols)
+        compose(layout, symbol_table=table)
+        for name, symbol in symbols.items():
+            self.assertEqual(table.symbols[name], symbol)
+        self.assertIn("vgs_phr_Missing_Mid", table.symbols)
+
+
+class TestAnalyze(unittest.TestCase):
+
+    def test_report(self):
+        comp = dota2vgs.Composer([StringIO(example_cfg)],
+                [StringIO(example_lst)], StringIO(example_layout), silent=True)
+        analyzer = dota2vgs.ScriptAnalyzer(comp)
+        results = analyzer.get_results()
+
+        self.assertEqual(results["total_bytes"], len(compose()[1]))
+        aliases = dict((a["name"], a) for a in results["aliases"])
+        restore = aliases["vgs_restore"]
+        self.assertGreater(restore["length"], results["max_cmd_len"])
+        self.assertEqual(restore["chunks"], 2)
+        self.assertEqual(restore["helpers"], 2)
+        self.assertEqual(aliases["vgs_phr_Missing_Top"]["group"], "Lanes")
+        # the phrase calls restore
+        self.assertEqual(aliases["vgs_phr_Missing_Top"]["commands"],
+                2 + restore["commands"])
+
+        groups = dict((g["path"], g) for g in results["groups"])
+        self.assertEqual(sorted(groups), ["start", "start/Quick",
+            "start/Team", "start/Team/Lanes"])
+        lanes = groups["start/Team/Lanes"]
+        self.assertEqual(lanes["path_commands"], lanes["commands"]
+                + groups["start/Team"]["commands"]
+                + groups["start"]["commands"])
+        self.assertEqual(groups["start"]["subtree_bytes"],
+                sum(g["bytes"] for g in results["groups"]))
+
+        self.assertIn("start/Team/Lanes", analyzer.report("text"))
+        self.assertIn("\"path_commands\"", analyzer.report("json"))
+
+
+class TestConsole(unittest.TestCase):
+
+    def load(self, script):
+        console = dota2vgs.Console()
+        loaded = console.load(StringIO(script))
+        self.assertEqual(loaded.echoed, ["VGS successfully loaded!"])
+        return console
+
+    def test_replay(self):
+        console = self.load(compose()[1])
+
+        presses = console.replay(["v", "q", "c"])
+        self.assertEqual([p.said for p in presses], [[], [], [1]])
+        # group aliases are split into helpers
+        self.assertGreaterEqual(presses[0].depth, 3)
+        self.assertGreater(presses[1].commands, 26)
+
+        # keys behave as before after the phrase
+        self.assertEqual(console.press("a").other, ["+attack", "-attack"])
+        self.assertEqual(console.press("s").other, ["dota_stop"])
+
+        # cancel
+        presses = console.replay(["v", "t", "b", "a"])
+        self.assertEqual(presses[-1].other, ["+attack", "-attack"])
+        self.assertEqual([p.said for p in console.replay("vtlt")],
+                [[], [], [], [3]])
+
+    def test_variants(self):
+        expected = [[], [], [], [3], [], [], [2], [], [], [], []]
+        keys = "vtltvqbaavs"
+        for kwargs in [{}, {"differential" : True},
+                {"symbol_table" : dota2vgs.SymbolTable()},
+                {"alias_dispatch" : "tree"}]:
+            console = self.load(compose(**kwargs)[1])
+            self.assertEqual([p.said for p in console.replay(keys)],
+                    expected, kwargs)
+
+    def test_exec(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            with open(osp.join(tmpdir, "a.cfg"), "w") as f:
+                f.write("bind \"k\" \"say hi\"\nexec b\n")
+            with open(osp.join(tmpdir, "b.cfg"), "w") as f:
+                f.write("alias \"x\" \"echo \"one\";echo two\" // c\n")
+            console = dota2vgs.Console(basedir=tmpdir)
+            console.execute("exec a;x")
+            self.assertEqual(console.record.echoed, ["one", "two"])
+            self.assertEqual(console.press("k").other, ["say hi"])
+
+            with open(osp.join(tmpdir, "b.cfg"), "a") as f:
+                f.write("exec a.cfg\n")
+            with self.assertRaises(dota2vgs.console.ConsoleError):
+                console.execute("exec a")
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+class TestOptimize(unittest.TestCase):
+
+    def setUp(self):
+        self.layout = dota2vgs.load_data(example_layout)
+
+    def test_uniform(self):
+        optimizer = dota2vgs.LayoutOptimizer(self.layout)
+        optimized = optimizer.optimize()
+        self.assertAlmostEqual(optimizer.get_cost(self.layout), 10. / 3)
+        self.assertAlmostEqual(optimizer.get_cost(optimized), 2.)
+        # phrases keep their hotkeys if possible (b is the cancel hotkey)
+        self.assertEqual(sorted((p["name"], p["hotkey"])
+            for p in optimized["phrases"]), [("Care", "c"),
+                ("Get_Back", "g"), ("Missing_Top", "t")])
+        self.assertNotIn("groups", optimized)
+
+    def test_weights(self):
+        weights = {"Care" : 5, "Get_Back" : 3, 3 : 1}
+        optimizer = dota2vgs.LayoutOptimizer(self.layout, weights=weights,
+                max_group_size=2, bound_keys=["C"], reserved=["g"])
+        optimized = optimizer.optimize()
+        self.assertAlmostEqual(optimizer.get_cost(optimized), 22. / 9)
+
+        keys = dict((p["name"], k) for p, k in
+                dota2vgs.optimize.get_phrase_costs(optimized))
+        self.assertEqual(keys["Care"], ["v", "a"])
+        self.assertEqual(keys["Get_Back"], ["v", "d", "a"])
+        self.assertEqual(len(keys["Missing_Top"]), 3)
+        self.assertEqual(optimized["groups"][0]["name"], "Get_Back_etc")
+
+        # the optimized layout can be used right away
+        output = StringIO()
+        dota2vgs.Composer([StringIO(example_cfg)], [StringIO(example_lst)],
+                optimized, output_file=output, silent=True)
+        console = dota2vgs.Console()
+        console.load(StringIO(output.getvalue()))
+        self.assertEqual(console.replay(keys["Missing_Top"])[-1].said, [3])
+
+        results = optimizer.get_results(optimized)
+        self.assertEqual(results["phrases"][0]["before"], ["v", "q", "c"])
+
+    def test_too_few_keys(self):
+        # a is bound in the cfg, v and b are the start/cancel hotkeys
+        returncode, stderr = run_cli(["optimize", "-c", "config.cfg",
+            "-y", "layout.yaml", "--keys", "abv"])
+
+        self.assertEqual(returncode, 1)
+        self.assertNotIn("Traceback", stderr)
+        self.assertIn("available: none (excluded: a, b, v)", stderr)
+        self.assertIn("--keys", stderr)
+
+
+class TestWatch(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.files = {}
+        for fn, content in [("config.cfg", example_cfg),
+                ("dotakeys_personal.lst", example_lst),
+                ("layout.yaml", example_layout)]:
+            self.files[fn] = osp.join(self.tmpdir, fn)
+            with open(self.files[fn], "w") as f:
+                f.write(content)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_rebuild(self):
+        from dota2vgs.watch import Rebuilder, PollingWatcher
+
+        outputs = dict((t, osp.join(self.tmpdir, "out." + t))
+                for t in ["vgs", "sheet"])
+        rebuilder = Rebuilder([self.files["config.cfg"]],
+                [self.files["dotakeys_personal.lst"]],
+                self.files["layout.yaml"], outputs)
+        self.assertEqual([r[0] for r in rebuilder.build()], ["vgs", "sheet"])
+
+        watcher = PollingWatcher(rebuilder.get_inputs())
+        self.assertEqual(watcher.wait(0), set())
+        with open(self.files["config.cfg"], "a") as f:
+            f.write('bind "d" "say_team hello"\n')
+        changed = watcher.wait(1)
+        self.assertEqual(changed, set([self.files["config.cfg"]]))
+
+        self.assertEqual(rebuilder.invalidate(changed), ["vgs"])
+        results = rebuilder.build(["vgs"])
+        self.assertTrue(all(r[2] is None for r in results))
+        # the lst file was not parsed again
+        self.assertEqual(rebuilder.parse_cache.hits, 1)
+        with open(outputs["vgs"]) as f:
+            self.assertIn("say_team hello", f.read())
+
+        self.assertEqual(rebuilder.invalidate([self.files["layout.yaml"]]),
+                ["vgs", "sheet"])
+
+    def test_threads(self):
+        from dota2vgs.watch import Rebuilder
+
+        contents = []
+        for threads in [1, 3]:
+            outputs = dict((t, osp.join(self.tmpdir, "{}.{}".format(threads,
+                t))) for t in Rebuilder.targets)
+            rebuilder = Rebuilder([self.files["config.cfg"]],
+                    [self.files["dotakeys_personal.lst"]],
+                    self.files["layout.yaml"], outputs)
+            results = rebuilder.build(threads=threads)
+            self.assertEqual([r[0] for r in results], Rebuilder.targets)
+            self.assertTrue(all(r[2] is None for r in results))
+            contents.append([open(outputs[t]).read()
+                for t in Rebuilder.targets])
+            self.assertNotIn("overlay", rebuilder.layout)
+        self.assertEqual(contents[0], contents[1])
+
+
+class TestLstParser(unittest.TestCase):
+
+    def parse(self, data):
+        return dota2vgs.LST_Parser(StringIO(data)).get()
+
+    def test_formatting(self):
+        expected = dota2vgs.LST_Parser(StringIO(example_lst)).get()
+        self.assertEqual(expected["KeyBindings"]["Keys"]["Ability1"]["Key"],
+                "Q")
+
+        # everything on a single line, comments and conditionals
+        self.assertEqual(self.parse(" ".join(example_lst.split())), expected)
+        self.assertEqual(self.parse(example_lst.replace("\n",
+            " // a comment with \"quotes\" {\n")), expected)
+        self.assertEqual(self.parse(example_lst.replace('"Q"',
+            '"Q" [$WIN32]')), expected)
+
+    def test_escapes(self):
+        content = self.parse(r'"Keys" { "Say" "say \"hi\"\\" Bare {} }')
+        self.assertEqual(content, {"Keys": {"Say": 'say "hi"\\', "Bare": {}}})
+
+    def test_errors(self):
+        for data in ['"Keys" { "Key" "Q" }}', '"Keys" { "Key" "Q"',
+                '"Keys" "Key" { }', '"Keys" { "Key" "Q }']:
+            self.assertRaises(dota2vgs.errors.LST_Error, self.parse, data)
+
+
+class TestCfgLoader(unittest.TestCase):
+
+    files = {
+        "autoexec.cfg": 'bind "d" "say_team first"\nexec shared\n'
+            'exec "keys.cfg"\nexec shared.cfg\nexec missing\n',
+        "shared.cfg": 'bind "e" "say_team shared"\nunbind "d"\n',
+        "keys.cfg": 'unbindall\n  bind "d" "say_team keys"\n'
+            'bind "e" "say_team keys"\n',
+    }
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        for fn, content in self.files.items():
+            with open(osp.join(self.tmpdir, fn), "w") as f:
+                f.write(content)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_exec(self):
+        loader = dota2vgs.CfgLoader(silent=True)
+        binds = loader.load([osp.join(self.tmpdir, "autoexec.cfg")])
+        # shared.cfg is executed last and unbinds d
+        self.assertEqual(binds, {"e": "say_team shared"})
+        self.assertEqual(loader.num_parsed, 3)
+
+        loader.load([osp.join(self.tmpdir, "shared.cfg")])
+        self.assertEqual(loader.num_parsed, 3)
+
+    def test_composer(self):
+        with open(osp.join(self.tmpdir, "autoexec.cfg")) as f:
+            comp = dota2vgs.Composer([f], [StringIO(example_lst)],
+                    StringIO(example_layout), silent=True, follow_exec=True)
+        self.assertEqual(comp.existing_binds["e"], "say_team shared")
+        self.assertNotIn("d", comp.existing_binds)
+
+    def test_cycle(self):
+        with open(osp.join(self.tmpdir, "keys.cfg"), "a") as f:
+            f.write("exec autoexec\n")
+        loader = dota2vgs.CfgLoader(silent=True)
+        self.assertRaises(dota2vgs.errors.CfgError, loader.load,
+                [osp.join(self.tmpdir, "autoexec.cfg")])
+
+    def test_cycle_cli(self):
+        returncode, stderr = run_cli(["vgs", "-c", "autoexec.cfg", "-x"],
+                files={"autoexec.cfg" : "exec other\n",
+                    "other.cfg" : "exec autoexec\n"})
+        self.assertEqual(returncode, 1)
+        self.assertNotIn("Traceback", stderr)
+        self.assertIn("Cyclic exec", stderr)
+
+    def test_case(self):
+        with open(osp.join(self.tmpdir, "keys.cfg"), "a") as f:
+            f.write('bind "A" "say_team x"\nunbind a\n'
+                    'bind "E" "say_team one"\nbind "e" "say_team two"\n')
+        loader = dota2vgs.CfgLoader(silent=True)
+        binds = loader.load([osp.join(self.tmpdir, "keys.cfg")])
+        self.assertEqual(binds, {"d": "say_team keys", "e": "say_team two"})
+
+
+class TestLongNames(unittest.TestCase):
+
+    def test_cli(self):
+        name = "Very_" + "long_" * 90 + "name"
+        layout = example_layout.replace("Missing_Top", name)
+        for mode in ["vgs", "analyze"]:
+            returncode, stderr = run_cli([mode, "-c", "config.cfg"],
+                    files={"layout.yaml" : layout})
+            self.assertEqual(returncode, 1)
+            self.assertNotIn("Traceback", stderr)
+            self.assertIn("Command for vgs_grp_Lanes is too long", stderr)
+            self.assertIn(name, stderr)
+
+
+class TestSynthetic(unittest.TestCase):
+
+    def test_inputs(self):
+        from dota2vgs import synthetic
+        binds = dota2vgs.BindParser(StringIO(synthetic.make_cfg(100)),
+                silent=True).get()
+        self.assertTrue(any(v.startswith("+") for v in binds.values()))
+
+        lst = dota2vgs.LST_Parser(StringIO(synthetic.make_lst(50))).get()
+        self.assertEqual(len(lst["KeyBindings"]["Keys"]), 50)
+
+    def test_layouts(self):
+        from dota2vgs import synthetic
+        for shape in synthetic.layout_shapes:
+            layout = synthetic.make_shaped_layout(shape, menu=True)
+            ir = dota2vgs.LayoutIR(layout)
+            self.assertEqual(ir.duplicates, {})
+
+        layout = synthetic.make_shaped_layout("long_names", depth=1)
+        comp = dota2vgs.Composer([StringIO(example_cfg)],
+                [StringIO(example_lst)], layout, silent=True)
+        # long names require helper aliases
+        self.assertTrue(any(comp.aliases[name].get().count("\r\n") > 0
+            for name in comp.aliases if name.startswith("vgs_grp_")))
+
+
+class TestProfiler(unittest.TestCase):
+
+    def test_composer(self):
+        profiler = dota2vgs.Profiler()
+        events = []
+        profiler.add_hook(lambda *args: events.append(args))
+
+        comp, output = compose(profiler=profiler)
+        self.assertEqual(output, compose()[1])
+
+        results = profiler.get_results()
+        stages = [s["name"] for s in results["stages"]]
+        for name in ["parse_cfg", "parse_lst", "load_layout", "compose",
+                "alias_text", "write"]:
+            self.assertIn(name, stages)
+
+        counts = dict((c["name"], c["count"]) for c in results["counts"])
+        self.assertEqual(counts["groups_composed"], 4)
+        self.assertEqual(counts["chars_written"], len(output))
+        self.assertIn(("count", "groups_composed", 1), events)
+
+    def test_writers(self):
+        profiler = dota2vgs.Profiler(cprofile_stage="generate_code")
+        writer = dota2vgs.AutohotkeyWriter(profiler=profiler)
+        writer.set_layout_from_file(StringIO(example_layout))
+        writer.write(StringIO())
+        dota2vgs.SheetMaker(StringIO(example_layout), StringIO(),
+                profiler=profiler)
+
+        self.assertIn("generate_code", profiler.report_text())
+        self.assertEqual(profiler.stages["load_layout"][1], 2)
+        self.assertTrue(profiler.cprofile is not None)
+
+
+class TestImportTime(unittest.TestCase):
+
+    # seconds allowed for importing the command line interface
+    budget = 0.2
+
+    code = "\n".join([
+        "import sys, time",
+        "t_start = time.time()",
+        "import dota2vgs.main",
+        "print(time.time() - t_start)",
+        "print(' '.join(m for m in ['yaml', 'docopt', 'multiprocessing']",
+        "    if m in sys.modules))",
+        ])
+
+    def test_cold_start(self):
+        durations = []
+        for i in range(3):
+            output = subprocess.check_output([sys.executable, "-c",
+                self.code], cwd=osp.dirname(osp.abspath(__file__)))
+            lines = output.decode("utf-8").splitlines()
+            durations.append(float(lines[0]))
+            self.assertEqual(lines[1:], [""])
+
+        self.assertTrue(min(durations) < self.budget,
+                "Importing took {:.3f}s.".format(min(durations)))
+
+    def test_no_handlers(self):
+        self.assertEqual([type(h) for h in dota2vgs.log.handlers
+            if type(h).__name__ != "NullHandler"], [])
+
+
+class TestAliasChunking(unittest.TestCase):
+
+    def check_lines(self, alias):
+        lines = alias.get().split(alias.LE)
+        for line in lines:
+            body = line.split(" ", 2)[2][1:-1]
+            self.assertTrue(len(body) <= alias.max_cmd_len)
+        return lines
+
+    def test_many_chunks(self):
+        for dispatch in dota2vgs.commands.Alias.dispatch_modes:
+            alias = dota2vgs.commands.Alias("vgs_long", dispatch=dispatch)
+            for i in range(2000):
+                alias.add("alias vgs_cur_{} vgs_ori_{}".format(i, i))
+
+            lines = self.check_lines(alias)
+            names = [l.split(" ", 2)[1] for l in lines]
+            self.assertEqual(len(names), len(set(names)))
+            self.assertTrue(len(names) > 100)
+
+        # tree dispatch calls all helpers from the alias or its direct helpers
+        root = lines[0].split(" ", 2)[2][1:-1].split(";")
+        self.assertTrue(all(n + "\"" in " ".join(lines) for n in root))
+
+    def test_oversized_commands(self):
+        alias = dota2vgs.commands.Alias("vgs_long")
+        alias.add(";".join("echo \"| line {};\"".format(i) for i in range(100)))
+        self.check_lines(alias)
+
+        alias = dota2vgs.commands.Alias("vgs_long")
+        alias.add("echo \"{}\"".format("x" * 500))
+        self.assertRaises(dota2vgs.errors.ChunkError, alias.get)
+
+    def test_length_tracking(self):
+        alias = dota2vgs.commands.Alias("vgs_short", dispatch="tree")
+        self.assertEqual(alias.dispatch, "tree")
+        alias.add("bind a vgs_a")
+        alias.prepend("unbind b")
+        alias.add("echo done")
+        self.assertEqual(alias.cmd_length(), len(alias.get())
+                - len(alias.template.format(key="vgs_short", function="")))
+        self.assertEqual(alias.cmd_length(), alias.cmd_length(
+            list(alias.content)))
+        self.assertFalse(hasattr(alias, "__dict__"))
+
 
 if __name__ == "__main__":
     unittest.main()